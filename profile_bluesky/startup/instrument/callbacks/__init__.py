@@ -1,5 +1,5 @@
 """
-Bluesky callback imports
-"""
+Bluesky callbacks
 
-from .live_export import *
\ No newline at end of file
+Import modules directly, the session re-exports are set up in collection.py
+"""
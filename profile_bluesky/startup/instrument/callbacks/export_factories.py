@@ -0,0 +1,138 @@
+"""
+RunRouter factories of the live exports
+
+Kept apart from live_export.py, which sets up the session (RunEngine,
+databroker), so the export worker processes (export_workers.py) can import
+the factories on their own.
+"""
+
+__all__ = ['Selector', 'export_handlers', 'csv_factory', 'tiff_factory',
+           'meta_factory', 'columnar_factory']
+
+import suitcase.tiff_series as st
+import suitcase.csv as sc
+import suitcase.json_metadata as sj
+
+from event_model import DocumentRouter
+from databroker.core import discover_handlers
+
+from ..devices.dxp_writer import DxpSpectraWriter, DxpHDF5Handler
+from .prefetch_filler import PrefetchFiller
+from ..framework.columnar_export import ColumnarSerializer
+
+
+def export_handlers():
+    """ {spec: handler class} used to fill the live exports """
+    hands = discover_handlers()
+    hands.pop("XSP3")
+    hands[DxpSpectraWriter.spec] = DxpHDF5Handler
+    return hands
+
+def csv_factory(name, start_doc):
+    serializer = sc.Serializer(
+        '/bluedata/b_mehta/export/csv/', file_prefix='Scan{start[scan_id]}-' )
+
+    def cb(name, doc):
+        serializer(name, doc)
+
+    return [cb], []
+
+def _without(mapping, exclude):
+    """ shallow copy of ``mapping`` without the ``exclude`` keys """
+    return {key: value for key, value in mapping.items() if key not in exclude}
+
+class Selector(DocumentRouter):
+    """Drop data keys before passing documents on.
+
+    Filtered documents are new top-level dicts sharing all untouched values
+    (arrays are never copied), inputs are not modified.  Event and datum
+    pages are passed on as pages.  With ``exclude_external`` every key
+    stored outside the documents (datum ids) is dropped as well.
+    """
+    def __init__(self, exclude=None, exclude_external=False, **kwargs):
+        self._exclude = frozenset(exclude or [])
+        self._exclude_external = exclude_external
+        self._excludes = {} # descriptor uid: keys dropped from its events
+        super().__init__(**kwargs)
+
+    def _filter_data(self, doc):
+        exclude = self._excludes.get(doc['descriptor'], self._exclude)
+        edited = dict(doc)
+        for field in ('data', 'timestamps', 'filled'):
+            if field in doc:
+                edited[field] = _without(doc[field], exclude)
+        return edited
+
+    def start(self, doc):
+        self.emit('start', doc)
+
+    def descriptor(self, doc):
+        exclude = self._exclude
+        if self._exclude_external:
+            exclude = exclude | {key for key, data_key
+                                 in doc['data_keys'].items()
+                                 if data_key.get('external')}
+        self._excludes[doc['uid']] = exclude
+        edited = dict(doc)
+        edited['data_keys'] = _without(doc['data_keys'], exclude)
+        self.emit('descriptor', edited)
+
+    def event(self, doc):
+        self.emit('event', self._filter_data(doc))
+
+    def event_page(self, doc):
+        self.emit('event_page', self._filter_data(doc))
+
+    def resource(self, doc):
+        self.emit('resource', doc)
+
+    def datum(self, doc):
+        self.emit('datum', doc)
+
+    def datum_page(self, doc):
+        self.emit('datum_page', doc)
+
+    def stop(self, doc):
+        self.emit('stop', doc)
+
+def tiff_factory(name, start_doc):
+    serializer = st.Serializer(
+        '/bluedata/b_mehta/export/tiff/', file_prefix='Scan{start[scan_id]}-')
+
+    # images are read ahead as their datums arrive, see prefetch_filler.py.
+    # DXP spectra ('mca') are left out, DxpSpectraWriter still holds their
+    # file open for writing
+    handlers = export_handlers()
+    handlers.pop(DxpSpectraWriter.spec)
+    f = PrefetchFiller(handlers, inplace=True, prefetch=32,
+                       memory_budget=512 * 2**20)
+    def cb(name, doc):
+        name_, doc_, = f(name, doc)
+        serializer(name_, doc_)
+
+    selector = Selector(exclude=['xsp3_channel1', 'xsp3_channel2', 'mca'],
+                        emit=cb)
+
+    selector._stashed_hard_ref_to_serializer = serializer
+    selector._stashed_hard_ref_to_filler = f
+    selector._stashed_hard_ref_to_cb = cb
+    return [selector], []
+
+def meta_factory(name, start_doc):
+    serializer = sj.Serializer(
+        '/bluedata/b_mehta/export/meta/', file_prefix='Scan{start[scan_id]}-' )
+
+    def cb(name, doc):
+        serializer(name, doc)
+
+    return [cb], []
+
+def columnar_factory(name, start_doc):
+    # flyer and DXP_100E streams as Parquet (or .npz) columns, one row group
+    # per collect page.  External keys (DXP and xsp3 spectra) are dropped,
+    # their files are still being written, my_exporter adds them filled
+    serializer = ColumnarSerializer('/bluedata/b_mehta/export/columnar/')
+
+    selector = Selector(exclude_external=True, emit=serializer)
+    selector._stashed_hard_ref_to_serializer = serializer
+    return [selector], []
@@ -0,0 +1,252 @@
+"""
+Live export in worker processes
+
+The RunEngine callback only puts documents on a bounded multiprocessing
+queue per worker, each worker process hosts one RunRouter and runs its
+Filler and suitcase serializers off the acquisition path.
+
+Workers are spawned, not forked from the session with its Channel Access
+and RunEngine threads, so factories must be picklable (module level
+functions, see export_factories.py).  Documents are pickled when they are
+submitted, later changes by other subscribers do not reach the workers.
+
+fanout = ExportFanout()
+fanout.add_worker('tiff', [tiff_factory], policy='drop')
+RE.subscribe(fanout)
+...
+fanout.stats() # queue depth and lag per worker
+"""
+
+__all__ = ['ExportWorker', 'ExportFanout']
+
+import atexit
+import logging
+import multiprocessing
+import pickle
+import queue
+import signal
+import time as ttime
+
+import pandas as pd
+from event_model import RunRouter
+
+logger = logging.getLogger()
+
+# a fork could inherit locks held by the session's threads at fork time
+_CONTEXT = multiprocessing.get_context('spawn')
+
+# documents the 'drop' policy may discard, everything else is needed to
+# keep the RunRouter consistent
+DROPPABLE = {'event', 'event_page'}
+
+
+def _worker_main(name, factories, doc_queue, processed, failed, last_put):
+    """ worker process: feed every queued document to a RunRouter """
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # ctrl-c is for the RE
+    router = RunRouter(factories)
+    while True:
+        item = doc_queue.get()
+        if item is None:
+            return
+        t_put, doc_name, doc = pickle.loads(item)
+        try:
+            router(doc_name, doc)
+        except Exception:
+            with failed.get_lock():
+                failed.value += 1
+            logger.exception(f'export worker {name}: {doc_name} failed')
+        with processed.get_lock():
+            processed.value += 1
+        last_put.value = t_put
+
+
+class ExportWorker:
+    """One export process with a bounded document queue.
+
+    ``policy='block'`` makes the RunEngine callback wait when the queue is
+    full, ``policy='drop'`` discards events (never start, descriptor,
+    resource, datum or stop documents) instead.
+    """
+    def __init__(self, name, factories, maxsize=1000, policy='block'):
+        """
+        :param name: worker name, used in logs and stats
+        :type name: str
+        :param factories: RunRouter factories run in the worker process
+        :type factories: list
+        :param maxsize: documents allowed to wait for the worker
+        :type maxsize: int
+        :param policy: 'block' or 'drop' when the queue is full
+        :type policy: str
+        """
+        if policy not in ('block', 'drop'):
+            raise ValueError(f"policy must be 'block' or 'drop', not {policy}")
+        try:
+            pickle.dumps(list(factories))
+        except Exception as err:
+            raise TypeError(f'export worker {name}: factories must be '
+                            f'picklable (module level functions): {err}')
+        self.name = name
+        self.factories = list(factories)
+        self.maxsize = maxsize
+        self.policy = policy
+        self._process = None
+        self._queue = None
+        self._processed = None
+        self._failed = None
+        self._last_put = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.num_submitted = 0
+        self.num_dropped = 0
+        self.num_blocked = 0 # submits that found the queue full
+        self.blocked_time = 0.0 # s the RE callback waited for space
+
+    @property
+    def alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        if self.alive:
+            return
+        self.reset_stats()
+        self._queue = _CONTEXT.Queue(maxsize=self.maxsize)
+        self._processed = _CONTEXT.Value('q', 0)
+        self._failed = _CONTEXT.Value('q', 0)
+        self._last_put = _CONTEXT.Value('d', 0.0)
+        self._process = _CONTEXT.Process(target=_worker_main,
+                            args=(self.name, self.factories, self._queue,
+                                  self._processed, self._failed,
+                                  self._last_put),
+                            name=f'export_{self.name}', daemon=True)
+        self._process.start()
+        logger.info(f'export worker {self.name} started, '
+                    f'pid {self._process.pid}')
+
+    def submit(self, name, doc):
+        """ queue a document, called from the RunEngine callback """
+        self.submit_pickled(name, pickle.dumps((ttime.time(), name, doc),
+                                               pickle.HIGHEST_PROTOCOL))
+
+    def submit_pickled(self, name, item):
+        """ queue a document already pickled as (time, name, doc) """
+        if not self.alive:
+            if not self.num_dropped:
+                logger.warning(f'export worker {self.name} is not running, '
+                               'dropping documents')
+            self.num_dropped += 1
+            return
+
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            if self.policy == 'drop' and name in DROPPABLE:
+                if not self.num_dropped:
+                    logger.warning(f'export worker {self.name} is behind, '
+                                   'dropping events')
+                self.num_dropped += 1
+                return
+
+            if not self.num_blocked:
+                logger.warning(f'export worker {self.name} is behind, '
+                               'RunEngine callback is waiting')
+            self.num_blocked += 1
+            t0 = ttime.monotonic()
+            while True:
+                try:
+                    self._queue.put(item, timeout=1.0)
+                    break
+                except queue.Full:
+                    if not self.alive:
+                        logger.error(f'export worker {self.name} died')
+                        self.num_dropped += 1
+                        return
+            self.blocked_time += ttime.monotonic() - t0
+
+        self.num_submitted += 1
+
+    def stats(self):
+        """ queue and lag metrics: lag is the number of documents not yet
+        exported, lag_time how long ago the last exported one was queued [s]
+        """
+        started = self._queue is not None
+        processed = self._processed.value if started else 0
+        lag = self.num_submitted - processed
+        last_put = self._last_put.value if started else 0.0
+        try:
+            depth = self._queue.qsize() if started else 0
+        except NotImplementedError: # macOS
+            depth = None
+        return {'name': self.name,
+                'pid': self._process.pid if self._process else None,
+                'alive': self.alive,
+                'policy': self.policy,
+                'depth': depth,
+                'maxsize': self.maxsize,
+                'submitted': self.num_submitted,
+                'processed': processed,
+                'failed': self._failed.value if started else 0,
+                'dropped': self.num_dropped,
+                'blocked': self.num_blocked,
+                'blocked_time': self.blocked_time,
+                'lag': lag,
+                'lag_time': ttime.time() - last_put if lag and last_put else 0.0}
+
+    def stop(self, timeout=30):
+        """ export what is queued, then end the process.
+
+        :return: True if the worker finished within ``timeout``
+        :rtype: bool
+        """
+        if self._process is None:
+            return True
+        if self._process.is_alive():
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+            self._process.join(timeout)
+        finished = not self._process.is_alive()
+        if not finished:
+            logger.warning(f'export worker {self.name} did not finish in '
+                           f'{timeout} s, terminating')
+            self._process.terminate()
+            self._process.join()
+        self._process = None
+        return finished
+
+
+class ExportFanout:
+    """RunEngine callback publishing every document to all export workers"""
+    def __init__(self):
+        self.workers = {}
+        atexit.register(self.stop)
+
+    def add_worker(self, name, factories, maxsize=1000, policy='block',
+                   start=True):
+        """ add (and start) an ExportWorker, see ExportWorker for args """
+        if name in self.workers:
+            self.workers[name].stop()
+        worker = ExportWorker(name, factories, maxsize=maxsize, policy=policy)
+        self.workers[name] = worker
+        if start:
+            worker.start()
+        return worker
+
+    def remove_worker(self, name, timeout=30):
+        return self.workers.pop(name).stop(timeout)
+
+    def __call__(self, name, doc):
+        # pickled once for all workers, and before any other subscriber
+        # can modify the document
+        item = pickle.dumps((ttime.time(), name, doc), pickle.HIGHEST_PROTOCOL)
+        for worker in self.workers.values():
+            worker.submit_pickled(name, item)
+
+    def stats(self):
+        """ one row per worker, see ExportWorker.stats """
+        return pd.DataFrame([w.stats() for w in self.workers.values()])
+
+    def stop(self, timeout=30):
+        for worker in self.workers.values():
+            worker.stop(timeout)
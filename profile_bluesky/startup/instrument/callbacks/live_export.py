@@ -6,102 +6,53 @@ Set up callback to live export data as they are collected.
 
 from ..framework.initialize import RE, callback_db
 
-import copy
+from event_model import RunRouter
 
-import suitcase.tiff_series as st
-import suitcase.csv as sc
-import suitcase.json_metadata as sj
+from .export_workers import ExportFanout
+# factories and Selector live apart, the export worker processes import them
+from .export_factories import (Selector, export_handlers, csv_factory,
+                               tiff_factory, meta_factory, columnar_factory)
 
-from event_model import RunRouter, DocumentRouter
-from event_model import Filler
-from databroker.core import discover_handlers
-
-__all__ = ['csv_rr', 'tiff_rr', 'meta_rr']
-hands = discover_handlers()
-hands.pop("XSP3")
-
-def csv_factory(name, start_doc):
-    serializer = sc.Serializer( 
-        '/bluedata/b_mehta/export/csv/', file_prefix='Scan{start[scan_id]}-' )
-
-    def cb(name, doc):
-        f(name,doc)
-        serializer(name, doc) 
-
-    return [cb], []
+__all__ = ['csv_rr', 'tiff_rr', 'meta_rr', 'columnar_rr', 'export_fanout',
+           'start_export_workers']
+hands = export_handlers()
 
 csv_rr = RunRouter([csv_factory])
 
 #callback_db['csv_rr'] = RE.subscribe(csv_rr)
 
-class Selector(DocumentRouter):
-    def __init__(self, exclude=None, **kwargs):
-        self._exclude = exclude or []
-        super().__init__(**kwargs)
-
-    def start(self, doc):
-        #print('---start')
-        self.emit('start', doc)
-
-    def descriptor(self, doc):
-        #print('---desc')
-        edited = copy.deepcopy(dict(doc))
-        for key in self._exclude:
-            edited['data_keys'].pop(key, None)
-        self.emit('descriptor', edited)
-
-    def event(self, doc):
-        #print('---event')
-        #print(doc)
-        edited = copy.deepcopy(dict(doc))
-        for key in self._exclude:
-            edited['data'].pop(key, None)
-            edited['timestamps'].pop(key, None)
-            edited.get('filled', {}).pop(key, None)
-        #print('---event: emitting to serializer')
-        self.emit('event', edited)
-
-    def resource(self, doc):
-        self.emit('resource', doc)
-
-    def datum(self, doc):
-        self.emit('datum', doc)
-
-    def stop(self, doc):
-        self.emit('stop', doc)
-
-def tiff_factory(name, start_doc):
-    serializer = st.Serializer( 
-        '/bluedata/b_mehta/export/tiff/', file_prefix='Scan{start[scan_id]}-')
-
-    f = Filler(hands)
-    #serializer('start', start_doc)
-    def cb(name, doc):
-        name_, doc_, = f(name, doc)
-        serializer(name_, doc_)
-
-    selector = Selector(exclude=['xsp3_channel1', 'xsp3_channel2'], 
-                        emit=cb)
-    
-    selector._stashed_hard_ref_to_serializer = serializer
-    selector._stashed_hard_ref_to_filler = f 
-    selector._stashed_hard_ref_to_cb = cb
-    return [selector], []
-
 assert 'AD_TIFF' in hands
 tiff_rr = RunRouter([tiff_factory])
 
 # callback_db['tiff_rr'] = RE.subscribe(tiff_rr)
 
-def meta_factory(name, start_doc):
-    serializer = sj.Serializer( 
-        '/bluedata/b_mehta/export/meta/', file_prefix='Scan{start[scan_id]}-' )
+meta_rr = RunRouter([meta_factory])
 
-    def cb(name, doc):
-        serializer(name, doc) 
+# callback_db['meta_rr'] = RE.subscribe(meta_rr)
 
-    return [cb], []
+columnar_rr = RunRouter([columnar_factory])
 
-meta_rr = RunRouter([meta_factory])
+# callback_db['columnar_rr'] = RE.subscribe(columnar_rr)
+
+# same exports, run in worker processes so serializers and the Filler
+# never hold up the RunEngine
+export_fanout = ExportFanout()
+
+def start_export_workers(maxsize=1000, tiff_policy='drop'):
+    """ start csv, tiff, metadata and columnar export processes and
+    subscribe them.
+
+    :param maxsize: documents queued per worker before the policy applies
+    :param tiff_policy: 'drop' events or 'block' the RunEngine when the
+                        tiff worker falls behind
+    """
+    export_fanout.add_worker('csv', [csv_factory], maxsize=maxsize)
+    export_fanout.add_worker('tiff', [tiff_factory], maxsize=maxsize,
+                             policy=tiff_policy)
+    export_fanout.add_worker('meta', [meta_factory], maxsize=maxsize)
+    export_fanout.add_worker('columnar', [columnar_factory], maxsize=maxsize)
+    if 'export_fanout' not in callback_db:
+        callback_db['export_fanout'] = RE.subscribe(export_fanout)
+    return export_fanout
 
-# callback_db['meta_rr'] = RE.subscribe(meta_rr)
\ No newline at end of file
+# start_export_workers()
@@ -0,0 +1,300 @@
+"""
+Filler that loads external data ahead of the events
+
+A background thread starts loading each datum as soon as its Datum
+document arrives, so by the time the event shows up the image is usually
+in memory.  Open handlers (files) are kept in an LRU, loaded payloads are
+evicted by a memory budget.
+
+f = PrefetchFiller(discover_handlers(), prefetch=32, memory_budget=2**30,
+                   inplace=True)
+name, doc = f(name, doc)
+"""
+
+__all__ = ['HandlerLRU', 'PrefetchFiller']
+
+from collections import OrderedDict, deque
+import copy
+import logging
+import threading
+import time as ttime
+
+import numpy as np
+from event_model import Filler
+
+logger = logging.getLogger()
+
+
+class HandlerLRU(OrderedDict):
+    """handler_cache for Filler, closes the least recently used handler
+    once more than ``maxsize`` are open
+    """
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        super().__init__()
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            _, handler = self.popitem(last=False)
+            close = getattr(handler, 'close', None)
+            if close is not None:
+                try:
+                    close()
+                except Exception as err:
+                    logger.debug(f'closing handler {handler} failed: {err}')
+
+
+def _nbytes(payload):
+    try:
+        return np.asarray(payload).nbytes
+    except Exception:
+        return 0
+
+
+class PrefetchFiller(Filler):
+    """event_model.Filler with an open-handler LRU and datum prefetching.
+
+    Datums are loaded in arrival order, at most ``prefetch`` ahead of the
+    events that use them.  A datum whose data is not written yet is retried
+    with the filler's ``retry_intervals``, prefetching waits for it since
+    detectors write in order.  Events fall back to the normal Filler path
+    for anything not prefetched, and once an event has used a datum the
+    earlier datums of the same resource are no longer loaded or kept.
+    """
+    def __init__(self, handler_registry, *, max_handlers=16, prefetch=32,
+                 memory_budget=512 * 2**20, specs=None, **kwargs):
+        """
+        :param handler_registry: {spec: handler class}, as for Filler
+        :param max_handlers: open handlers kept in the LRU
+        :type max_handlers: int
+        :param prefetch: datums loaded ahead of the events
+        :type prefetch: int
+        :param memory_budget: loaded payload bytes kept in memory
+        :type memory_budget: int
+        :param specs: only prefetch resources with these specs, defaults to
+                      all
+        :type specs: set, optional
+        """
+        kwargs.setdefault('handler_cache', HandlerLRU(max_handlers))
+        super().__init__(handler_registry, **kwargs)
+        self.prefetch = prefetch
+        self.memory_budget = memory_budget
+        self.specs = None if specs is None else set(specs)
+
+        self._handler_lock = threading.RLock()
+        self._cond = threading.Condition()
+        self._pending = deque() # datum ids waiting to be prefetched
+        self._payloads = OrderedDict() # datum_id: (payload, nbytes), LRU
+        self._ahead = set() # prefetched, not yet used by an event
+        # datum_id: (resource uid, arrival index within the resource), for
+        # datums pending or prefetched
+        self._index = {}
+        self._num_datums = {} # resource uid: datums seen
+        # resource uid: highest index an event asked for, datums at or
+        # below it are stale and not worth prefetching (any more)
+        self._seen = {}
+        self._nbytes = 0
+        self._thread = None
+        self._stopping = False
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def stats(self):
+        return {'hits': self.num_hits, 'misses': self.num_misses,
+                'pending': len(self._pending), 'ahead': len(self._ahead),
+                'cached': len(self._payloads), 'nbytes': self._nbytes,
+                'handlers': len(self._handler_cache or ())}
+
+    def _get_handler_maybe_cached(self, resource):
+        # handlers are shared with the prefetch thread
+        with self._handler_lock:
+            handler = super()._get_handler_maybe_cached(resource)
+        return _LockedHandler(handler, self._handler_lock)
+
+    def datum(self, doc):
+        doc = super().datum(doc)
+        resource = self._resource_cache.get(doc['resource'])
+        if (resource is not None and resource['spec'] in self.handler_registry
+                and (self.specs is None or resource['spec'] in self.specs)):
+            with self._cond:
+                n = self._num_datums.get(doc['resource'], 0)
+                self._num_datums[doc['resource']] = n + 1
+                self._index[doc['datum_id']] = (doc['resource'], n)
+                self._pending.append(doc['datum_id'])
+                self._cond.notify()
+            if self._thread is None:
+                self._start_prefetch()
+        return doc
+
+    def _start_prefetch(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._prefetch_loop,
+                                        daemon=True, name='filler_prefetch')
+        self._thread.start()
+
+    def _prefetch_loop(self):
+        while True:
+            with self._cond:
+                while not self._stopping and (not self._pending
+                        or len(self._ahead) >= self.prefetch
+                        or self._nbytes >= self.memory_budget):
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                datum_id = self._pending[0]
+                if self._stale(datum_id):
+                    self._pending.popleft()
+                    self._index.pop(datum_id, None)
+                    continue
+
+            payload = self._load(datum_id)
+            with self._cond:
+                if self._pending and self._pending[0] == datum_id:
+                    self._pending.popleft()
+                if payload is None or self._stale(datum_id):
+                    # an event overtook the load and was filled the normal
+                    # way, nobody will take this payload
+                    self._index.pop(datum_id, None)
+                    continue
+                self._store(datum_id, payload)
+                self._ahead.add(datum_id)
+
+    def _stale(self, datum_id):
+        """ True once an event used ``datum_id`` or a later datum of its
+        resource, call with ``_cond`` held
+        """
+        index = self._index.get(datum_id)
+        if index is None:
+            return True
+        resource, n = index
+        return n <= self._seen.get(resource, -1)
+
+    def _load(self, datum_id):
+        """ load one datum, None if it never became readable """
+        try:
+            datum = self._datum_cache[datum_id]
+            resource = self._resource_cache[datum['resource']]
+            handler = self._get_handler_maybe_cached(resource)
+        except Exception as err:
+            logger.debug(f'prefetch of {datum_id} failed: {err}')
+            return None
+        for interval in [0] + list(self.retry_intervals):
+            if self._stopping or self._stale(datum_id):
+                return None
+            ttime.sleep(interval)
+            try:
+                return handler(**datum['datum_kwargs'])
+            except Exception as err:
+                error = err
+        logger.debug(f'prefetch of {datum_id} failed: {error}')
+        return None
+
+    def _store(self, datum_id, payload):
+        """ cache a payload, evicting the least recently used ones """
+        nbytes = _nbytes(payload)
+        self._payloads[datum_id] = (payload, nbytes)
+        self._nbytes += nbytes
+        while self._nbytes > self.memory_budget and len(self._payloads) > 1:
+            old_id, (_, old_nbytes) = self._payloads.popitem(last=False)
+            self._nbytes -= old_nbytes
+            self._ahead.discard(old_id)
+            self._index.pop(old_id, None)
+
+    def _evict(self, datum_id):
+        """ drop a prefetched payload, call with ``_cond`` held """
+        item = self._payloads.pop(datum_id, None)
+        self._ahead.discard(datum_id)
+        self._index.pop(datum_id, None)
+        if item is not None:
+            self._nbytes -= item[1]
+        return item
+
+    def _take(self, datum_id):
+        """ prefetched payload of ``datum_id``, or None """
+        with self._cond:
+            index = self._index.get(datum_id)
+            item = self._evict(datum_id)
+            if index is not None:
+                resource, n = index
+                if n > self._seen.get(resource, -1):
+                    self._seen[resource] = n
+                # payloads of earlier datums were skipped by the events
+                for old_id in [d for d in self._ahead
+                               if self._stale(d)]:
+                    self._evict(old_id)
+            self._cond.notify()
+        return None if item is None else item[0]
+
+    def fill_event(self, doc, include=None, exclude=None, inplace=None):
+        if inplace is None:
+            inplace = self._inplace
+        if not inplace:
+            doc = copy.deepcopy(doc)
+
+        for key, filled in doc.get('filled', {}).items():
+            if filled is not False:
+                continue
+            if exclude is not None and key in exclude:
+                continue
+            if include is not None and key not in include:
+                continue
+            datum_id = doc['data'][key]
+            payload = self._take(datum_id)
+            if payload is None:
+                self.num_misses += 1
+                continue
+            self.num_hits += 1
+            doc['data'][key] = payload
+            doc['filled'][key] = datum_id
+
+        # whatever was not prefetched
+        return super().fill_event(doc, include=include, exclude=exclude,
+                                  inplace=True)
+
+    def stop(self, doc):
+        self.stop_prefetch()
+        return super().stop(doc)
+
+    def stop_prefetch(self):
+        """ end the prefetch thread and drop loaded payloads """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._cond:
+            self._pending.clear()
+            self._index.clear()
+            self._num_datums.clear()
+            self._seen.clear()
+            self._payloads.clear()
+            self._ahead.clear()
+            self._nbytes = 0
+
+    def close(self):
+        self.stop_prefetch()
+        if self._handler_cache is not None:
+            for handler in self._handler_cache.values():
+                close = getattr(handler, 'close', None)
+                if close is not None:
+                    close()
+        super().close()
+
+
+class _LockedHandler:
+    """calls a shared handler under a lock"""
+    def __init__(self, handler, lock):
+        self._handler = handler
+        self._lock = lock
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            return self._handler(*args, **kwargs)
@@ -2,6 +2,10 @@
 configure for data collection in a console session
 """
 
+# time every import and device from here on, written to .logs
+from .startup_profile import profiler
+profiler.start()
+
 from .session_logs import *
 logger.info(__file__)
 
@@ -9,9 +13,24 @@ from .mpl import *
 
 logger.info("bluesky framework")
 
-from .framework import *
-from .devices import *
-from .callbacks import *
+from .framework.check_python import *
+from .framework.check_bluesky import *
+
+from .framework.initialize import *
+from .framework.metadata import *
+from .framework.user_dir import *
+
+from .devices.stages import *
+#from .devices.xspress3 import *
+from .devices.misc_devices import *
+#from .devices.fpga_flyer import *
+from .devices.flyer_100e import *
+
+# DXP spectra are written out of band, see devices/dxp_writer.py
+from .devices.dxp_writer import DxpSpectraWriter, DxpHDF5Handler
+db.reg.register_handler(DxpSpectraWriter.spec, DxpHDF5Handler, overwrite=True)
+
+from .callbacks.live_export import *
 from .plans import *
 
 #from apstools.utils import *
@@ -19,6 +38,14 @@ from .plans import *
 # ensure nothing clobbered our logger
 from .session_logs import logger
 
+# devices are only declared so far, build and connect them in bulk while
+# the prompt comes up, registry.connection_report() to see the table again
+from .devices.lazy import registry
+registry.connect_in_background(timeout=5.0)
+
+profiler.stop()
+logger.info(f'startup profile written to {profiler.path}')
+
 logger.info(
     "Disabling log output to the console now."
     " Log output will still be recoreded in log files."
@@ -1,5 +1,5 @@
-from .stages import *
-#from .xspress3 import *
-from .misc_devices import *
-#from .fpga_flyer import *
-from .flyer_100e import *
+"""
+Devices
+
+Import modules directly, the session re-exports are set up in collection.py
+"""
@@ -0,0 +1,167 @@
+"""
+Columnar buffer for fly scan data
+
+Frames are written into preallocated NumPy columns with vectorized slicing,
+event dictionaries are only built when the data is handed to bluesky.
+"""
+
+__all__ = ['ColumnBuffer']
+
+import threading
+import time as ttime
+
+import numpy as np
+
+
+class ColumnBuffer:
+    """Preallocated, growable column store.  One array per data key, plus a
+    column holding the arrival time of each row.
+
+    Columns are created on the first call to ``extend()`` (or declared up
+    front with ``columns``), each row may itself be an array (e.g. a spectrum).
+    Capacity doubles whenever a batch does not fit.
+
+    buf = ColumnBuffer(capacity=len(time_list))
+    buf.extend({'adc_0': adc[:, 0], 'gate': gate})
+    for ev in buf.to_events(*buf.drain()):
+        ...
+
+    or, for ``collect_pages()``:
+    page = buf.to_page(*buf.drain())
+    """
+    def __init__(self, capacity=1024, columns=None):
+        self._capacity = max(int(capacity), 1)
+        self._len = 0
+        self._lock = threading.Lock()
+        self._time = np.empty(self._capacity, np.float64)
+        self._columns = {}
+        for key, (dtype, shape) in (columns or {}).items():
+            self._columns[key] = np.empty((self._capacity,) + tuple(shape),
+                                          dtype)
+
+    def __len__(self):
+        return self._len
+
+    def keys(self):
+        return self._columns.keys()
+
+    def reserve(self, capacity):
+        """ grow storage to hold at least ``capacity`` rows """
+        with self._lock:
+            self._grow(capacity)
+
+    def _grow(self, capacity):
+        if capacity <= self._capacity:
+            return
+        new_capacity = max(int(capacity), 2 * self._capacity)
+        self._time = self._resized(self._time, new_capacity)
+        for key, col in self._columns.items():
+            self._columns[key] = self._resized(col, new_capacity)
+        self._capacity = new_capacity
+
+    def _resized(self, arr, capacity):
+        new = np.empty((capacity,) + arr.shape[1:], arr.dtype)
+        new[:self._len] = arr[:self._len]
+        return new
+
+    def extend(self, columns, timestamp=None):
+        """ append a batch of rows.  The keys must match the buffered rows,
+        ``drain()`` before switching to a different set of columns.
+
+        :param columns: key -> array, first axis is the row axis.  All arrays
+                        must have the same length.
+        :type columns: dict
+        :param timestamp: arrival time for all rows in this batch,
+                          defaults to now
+        :type timestamp: float, optional
+        :return: number of rows appended
+        :rtype: int
+        :raises KeyError: if the keys differ from the buffered rows
+        """
+        n = len(next(iter(columns.values()))) if columns else 0
+        if n == 0:
+            return 0
+        if timestamp is None:
+            timestamp = ttime.time()
+
+        with self._lock:
+            if self._len and columns.keys() != self._columns.keys():
+                raise KeyError('Column keys do not match buffered data: '
+                               f'{set(columns) ^ set(self._columns)}')
+            if not self._len:
+                self._match_columns(columns)
+
+            self._grow(self._len + n)
+            sl = slice(self._len, self._len + n)
+            self._time[sl] = timestamp
+            for key, val in columns.items():
+                self._columns[key][sl] = val
+            self._len += n
+        return n
+
+    def _match_columns(self, columns):
+        """ (re)allocate columns to fit the incoming batch """
+        for key, val in columns.items():
+            val = np.asanyarray(val)
+            col = self._columns.get(key)
+            if (col is None or col.shape[1:] != val.shape[1:]
+                    or col.dtype != val.dtype):
+                self._columns[key] = np.empty((self._capacity,) + val.shape[1:],
+                                              val.dtype)
+        for key in set(self._columns) - set(columns):
+            del self._columns[key]
+
+    def last(self):
+        """ return (time, {key: value}) for the most recent row """
+        with self._lock:
+            if not self._len:
+                raise IndexError('ColumnBuffer is empty')
+            i = self._len - 1
+            return (self._time[i].item(),
+                    {k: col[i] for k, col in self._columns.items()})
+
+    def drain(self):
+        """ remove and return all buffered rows.
+
+        :return: (time, columns), copies of the buffered data
+        :rtype: (np.ndarray, dict)
+        """
+        with self._lock:
+            n = self._len
+            t = self._time[:n].copy()
+            columns = {k: col[:n].copy() for k, col in self._columns.items()}
+            self._len = 0
+        return t, columns
+
+    @staticmethod
+    def to_events(t, columns, filled=None):
+        """ lazily build event dictionaries suitable for ``collect()``
+
+        :param t: row times, as returned by ``drain()``
+        :param columns: row data, as returned by ``drain()``
+        :param filled: keys to mark as unfilled external data
+        """
+        keys = list(columns)
+        values = [columns[k].tolist() for k in keys]
+        for i, ti in enumerate(t.tolist()):
+            ev = {'time': ti,
+                  'data': {k: v[i] for k, v in zip(keys, values)},
+                  'timestamps': {k: ti for k in keys}}
+            if filled:
+                ev['filled'] = {k: False for k in filled}
+            yield ev
+
+    @staticmethod
+    def to_page(t, columns, filled=None):
+        """ build a single (partial) event page suitable for ``collect_pages()``
+
+        :param t: row times, as returned by ``drain()``
+        :param columns: row data, as returned by ``drain()``
+        :param filled: keys to mark as unfilled external data
+        """
+        page = {'time': t,
+                'data': columns,
+                'timestamps': {k: t for k in columns}}
+        if filled:
+            page['filled'] = {k: np.zeros(len(t), bool) for k in filled}
+        return page
@@ -0,0 +1,131 @@
+"""
+Bulk PV connection for the session devices
+
+All signals of all devices are instantiated first, which sends every
+Channel Access search at once, then a single wait with a global timeout
+collects the connection latency of each PV.
+
+df = connect_signals({'s_stage': s_stage, 'I0': I0}, timeout=5)
+print(connection_report(df))
+"""
+
+__all__ = ['gather_signals', 'connect_signals', 'connection_report']
+
+import logging
+import time as ttime
+
+import pandas as pd
+from ophyd import Device
+
+logger = logging.getLogger()
+
+
+def _pvnames(signal):
+    """ PV names of an EPICS signal, empty for soft signals """
+    names = []
+    for attr in ('pvname', 'setpoint_pvname'):
+        pv = getattr(signal, attr, None)
+        if pv and pv not in names:
+            names.append(pv)
+    return names
+
+
+def gather_signals(devices):
+    """ every EPICS signal of ``devices``, instantiating lazy components.
+
+    :param devices: {name: device or signal}
+    :type devices: dict
+    :return: [(device name, signal, pv names)]
+    :rtype: list
+    """
+    signals = []
+    seen = set() # px is also part of s_stage
+    for name, device in devices.items():
+        if isinstance(device, Device):
+            walk = (w.item for w in device.walk_signals(include_lazy=True))
+        else:
+            walk = [device]
+        for sig in walk:
+            pvs = _pvnames(sig)
+            if pvs and id(sig) not in seen:
+                seen.add(id(sig))
+                signals.append((name, sig, pvs))
+    return signals
+
+
+def connect_signals(devices, timeout=5.0, slow=1.0, poll=0.01):
+    """ wait once for all PVs of ``devices`` to connect.
+
+    :param devices: {name: device or signal}
+    :type devices: dict
+    :param timeout: global timeout for the whole set [s]
+    :type timeout: float
+    :param slow: PVs connecting later than this are flagged 'slow' [s]
+    :type slow: float
+    :param poll: connection polling interval [s]
+    :type poll: float
+    :return: one row per signal: device, signal, pv, status
+             ('connected', 'slow' or 'missing'), latency [s]
+    :rtype: pd.DataFrame
+    """
+    t0 = ttime.monotonic()
+    signals = gather_signals(devices)
+    latency = [None] * len(signals)
+    pending = set(range(len(signals)))
+
+    deadline = t0 + timeout
+    while pending:
+        now = ttime.monotonic()
+        for i in list(pending):
+            try:
+                connected = signals[i][1].connected
+            except Exception:
+                connected = False
+            if connected:
+                latency[i] = now - t0
+                pending.discard(i)
+        if not pending or now >= deadline:
+            break
+        ttime.sleep(poll)
+
+    rows = []
+    for (name, sig, pvs), lat in zip(signals, latency):
+        if lat is None:
+            status = 'missing'
+        elif lat > slow:
+            status = 'slow'
+        else:
+            status = 'connected'
+        rows.append({'device': name, 'signal': sig.name, 'pv': ', '.join(pvs),
+                     'status': status, 'latency': lat})
+
+    df = pd.DataFrame(rows, columns=['device', 'signal', 'pv', 'status',
+                                     'latency'])
+    logger.info(f'connected {(df.status != "missing").sum()}/{len(df)} PVs '
+                f'in {ttime.monotonic() - t0:.2f} s')
+    return df
+
+
+def connection_report(df):
+    """ compact text table: one line per device, then each slow or missing
+    PV with its latency
+    """
+    if not len(df):
+        return 'no EPICS signals'
+
+    summary = df.groupby('device', sort=False).agg(
+                    connected=('status', lambda s: (s == 'connected').sum()),
+                    slow=('status', lambda s: (s == 'slow').sum()),
+                    missing=('status', lambda s: (s == 'missing').sum()),
+                    max_latency=('latency', 'max'))
+    lines = [summary.to_string(float_format='{:.3f}'.format)]
+
+    problems = df[df.status != 'connected']
+    if len(problems):
+        problems = problems.sort_values(['status', 'latency'],
+                                        na_position='first')
+        lines.append('')
+        lines.append(problems[['device', 'pv', 'status', 'latency']].to_string(
+                        index=False, float_format='{:.3f}'.format,
+                        na_rep='-'))
+    return '\n'.join(lines)
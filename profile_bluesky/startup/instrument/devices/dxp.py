@@ -1,11 +1,16 @@
 from ophyd import Device, Component as Cpt, EpicsSignal
+from ophyd import DeviceStatus
+from ophyd.status import SubscriptionStatus
 
 import ctypes
+import logging
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 
+logger = logging.getLogger()
+
 dxp_path = Path(__file__).parent / 'dxp_eval' / 'dxp.so'
 omDxpLib = ctypes.cdll.LoadLibrary(dxp_path)
 
@@ -29,6 +34,46 @@ class DxpData(ctypes.Structure):
                     ("lastErrorCode",   ctypes.POINTER(ctypes.c_int))]
 
 
+class DxpDecodeBuffers:
+    """Output arrays for one EvalDxpData call.  Allocated once per arm and 
+    reused, ctypes views are built here so each decode only wraps the PV data.
+
+    bufs = DxpDecodeBuffers(n_buf_pix, n_det_elem, 2048)
+    bufs.decode(pv_data)
+    """
+    def __init__(self, n_buf_pix, n_det_elem, max_mca_length):
+        self.n_rows = int(n_buf_pix * n_det_elem)
+        self.max_mca_length = max_mca_length
+
+        self.num_pixel       = np.zeros(1,           np.uint32)
+        self.element         = np.zeros(self.n_rows, np.uint32)
+        self.pixel           = np.zeros(self.n_rows, np.uint32)
+        self.live_time       = np.zeros(self.n_rows, np.float64)
+        self.real_time       = np.zeros(self.n_rows, np.float64)
+        self.icr             = np.zeros(self.n_rows, np.float64)
+        self.ocr             = np.zeros(self.n_rows, np.float64)
+        self.mca_length      = np.zeros(self.n_rows, np.int32)
+        self.mca             = np.zeros(self.n_rows * max_mca_length, np.uint32)
+        self.last_error_code = np.zeros(1,           np.int32)
+
+        self._c_outputs = [np.ctypeslib.as_ctypes(arr) for arr in 
+                            [self.num_pixel, self.element, self.pixel, 
+                             self.live_time, self.real_time, self.icr, 
+                             self.ocr, self.mca_length, self.mca, 
+                             self.last_error_code]]
+
+    def fits(self, n_buf_pix, n_det_elem):
+        return self.n_rows == n_buf_pix * n_det_elem
+
+    def decode(self, pv_data):
+        """ run EvalDxpData on ``pv_data``, filling this set of arrays """
+        dxp_data = DxpData(0, np.ctypeslib.as_ctypes(pv_data), *self._c_outputs)
+
+        # C function call
+        omDxpLib.EvalDxpData.restype = None
+        omDxpLib.EvalDxpData(ctypes.byref(dxp_data))
+        return self.last_error_code[0]
+
 
 class Dxp(Device):
     """Dxp portion of 100e detector, for use as component of 100e flyer object.
@@ -52,6 +97,89 @@ class Dxp(Device):
     curr_buff_pixels = None
     curr_num_elems = None
     curr_first_elem = None
+
+    # decode buffers, rotated so one result can be consumed while the next 
+    # buffer is decoded
+    num_decode_buffers = 2
+    _decode_buffers = None
+    _next_buffer = 0
+
+    def arm_buffers(self):
+        """ read buffer geometry and (re)allocate decode buffers if needed.
+        Call on arm, before data starts arriving
+        """
+        self.curr_buff_pixels = self.num_buffer_pixels.get()
+        self.curr_num_elems = self.num_detector_elems.get()
+        self.curr_first_elem = self.first_element.get()
+
+        if (self._decode_buffers is None or not 
+                self._decode_buffers[0].fits(self.curr_buff_pixels, 
+                                             self.curr_num_elems)):
+            self._decode_buffers = [DxpDecodeBuffers(self.curr_buff_pixels,
+                                                     self.curr_num_elems,
+                                                     self.max_MCA_length)
+                                    for _ in range(self.num_decode_buffers)]
+        self._next_buffer = 0
+
+    def arm(self, num_pixels, timeout=None):
+        """ arm for a map of ``num_pixels`` without blocking.  
+
+        Requests a dxp update, starts acquisition once ``update_dxp`` reports 
+        up-to-date, and finishes once ``is_armed`` is set.  Decode buffers are
+        sized from the armed configuration.  Arm several modules at once by 
+        combining their statuses: ``dxp1.arm(n) & dxp2.arm(n)``
+
+        :param num_pixels: number of map pixels (triggers)
+        :type num_pixels: int
+        :param timeout: fail if not armed after this many seconds
+        :type timeout: float, optional
+        :rtype: DeviceStatus
+        """
+        status = DeviceStatus(self, timeout=timeout)
+
+        def _up_to_date(*, value, **kwargs):
+            return value == 2
+
+        def _armed(*, value, **kwargs):
+            return value == 1
+
+        def _start_acquire(st):
+            if not st.success:
+                logger.error(f'{self.name}: dxp update did not complete')
+                status._finished(success=False)
+                return
+            if self.start_acquire.get() != 0 and self.is_armed.get() == 1:
+                # still armed from an aborted run, IsArmed won't transition
+                logger.info(f'{self.name}: already armed')
+                self.arm_buffers()
+                status._finished(success=True)
+                return
+            # idle, so the current IsArmed counts too.  Subscribe before
+            # starting, so the transition can't be missed
+            armed = SubscriptionStatus(self.is_armed, _armed, 
+                                       timeout=timeout, run=True)
+            armed.add_callback(_finish)
+            self.start_acquire.put(1)
+
+        def _finish(st):
+            if st.success:
+                self.arm_buffers() # size decode buffers once per arm
+            else:
+                logger.error(f'{self.name}: dxp did not arm')
+            status._finished(success=st.success)
+
+        self.num_map_pixels.put(num_pixels)
+        updated = SubscriptionStatus(self.update_dxp, _up_to_date, 
+                                     timeout=timeout, run=False)
+        updated.add_callback(_start_acquire)
+        self.update_dxp.put(1)
+
+        return status
+
+    def disarm(self):
+        """ stop acquisition, e.g. when another module failed to arm """
+        self.start_acquire.put(0)
+
     def describe_data(self):
         d = dict(
             source = 'dxp 100E detector',
@@ -71,78 +199,65 @@ class Dxp(Device):
         dd.update({
             'mca':{'source': 'dxp 100E detector',
                    'dtype':'array',
-                   'shape':[-1, -1]} 
+                   'shape':[-1]} # one spectrum of mca_length channels per row
                   })
         
         return dd
 
-    def get_data(self):
-        pv_data = self.data.get()
-        # try to limit access
-        if not self.curr_buff_pixels:
-            n_buf_pix = self.num_buffer_pixels.get()
-            self.curr_buff_pixels = n_buf_pix
-            print(self.curr_buff_pixels)
-        else:
-            n_buf_pix = self.curr_buff_pixels
-        if not self.curr_num_elems:
-            n_det_elem = self.num_detector_elems.get()
-            self.curr_num_elems = n_det_elem
-            print(self.curr_num_elems)
-        else:
-            n_det_elem = self.curr_num_elems
-        if not self.curr_first_elem:
-            self.curr_first_elem = self.first_element.get()
-
-
-        # parse frame data
-        numPixel        = np.zeros(1,                      np.uint32)
-        element         = np.zeros(n_buf_pix * n_det_elem, np.uint32)
-        pixel           = np.zeros(n_buf_pix * n_det_elem, np.uint32)
-        liveTime        = np.zeros(n_buf_pix * n_det_elem, np.float64)
-        realTime        = np.zeros(n_buf_pix * n_det_elem, np.float64)
-        icr             = np.zeros(n_buf_pix * n_det_elem, np.float64)
-        ocr             = np.zeros(n_buf_pix * n_det_elem, np.float64)
-        mcaLen          = np.zeros(n_buf_pix * n_det_elem, np.int32)
-        mca             = np.zeros(n_buf_pix * n_det_elem * self.max_MCA_length, 
-                                                           np.uint32)
-        lastErrorCode   = np.zeros(1, np.int32)
-
-        dxp_data = DxpData( 0,
-                            np.ctypeslib.as_ctypes(pv_data),
-                            np.ctypeslib.as_ctypes(numPixel),
-                            np.ctypeslib.as_ctypes(element),
-                            np.ctypeslib.as_ctypes(pixel),
-                            np.ctypeslib.as_ctypes(liveTime),
-                            np.ctypeslib.as_ctypes(realTime),
-                            np.ctypeslib.as_ctypes(icr),
-                            np.ctypeslib.as_ctypes(ocr),
-                            np.ctypeslib.as_ctypes(mcaLen),
-                            np.ctypeslib.as_ctypes(mca),
-                            np.ctypeslib.as_ctypes(lastErrorCode))
-                            
-        # C function call                    
-        omDxpLib.EvalDxpData.restype = None
-        omDxpLib.EvalDxpData(ctypes.byref(dxp_data))
+    def get_data(self, pv_data=None):
+        """ decode a .Data buffer, defaults to reading the current value.
 
-        # construct dataframe
-        frame_dicts= []
-        for i in range( int(n_buf_pix * n_det_elem) ):
-            d = {
-                  'element': element[i],
-                  'first_element': self.curr_first_elem,
-                  'pixel': pixel[i],
-                  'live_time': liveTime[i],
-                  'real_time': realTime[i],
-                  'icr': icr[i],
-                  'ocr': ocr[i],
-                  'mca_length': mcaLen[i],
-                  'mca': list(mca[i*self.max_MCA_length:(i+1)*self.max_MCA_length])
-                }
+        Returns a dictionary of columns with one row per (pixel, element),
+        pixel-major.  'mca' is a 2-D (rows x mca_length) view of the decode 
+        buffer, so the spectra for element ``e`` are 
+        ``mca.reshape(n_pixels, n_elements, -1)[:, e]``.
 
-            frame_dicts.append(d)
+        Arrays are views into reused decode buffers, they are only valid 
+        until ``num_decode_buffers`` further calls.  Copy (e.g. into a 
+        ColumnBuffer) before then.  Returns None if the buffer could not be 
+        decoded
 
-        # return a list of dictionaries suitable for collect()
+        :param pv_data: raw .Data value, e.g. from a monitor callback
+        :type pv_data: np.ndarray, optional
+        """
+        if pv_data is None:
+            pv_data = self.data.get()
+        if self._decode_buffers is None:
+            self.arm_buffers()
+
+        # parse frame data into the next free set of buffers
+        bufs = self._decode_buffers[self._next_buffer]
+        self._next_buffer = (self._next_buffer + 1) % len(self._decode_buffers)
+        err = bufs.decode(pv_data)
+        if err != 1:
+            logger.warning(f'{self.name}: EvalDxpData failed ({err})')
+            return None
+
+        # spectra are packed with the decoded channel count, not the max
+        n = bufs.n_rows
+        mca_length = int(bufs.mca_length[0])
+        if not 0 < mca_length <= self.max_MCA_length:
+            logger.warning(f'{self.name}: invalid mca length {mca_length}')
+            return None
+        if np.any(bufs.mca_length[:n] != mca_length):
+            # rows can't be split into a 2-D block of spectra
+            lengths = np.unique(bufs.mca_length[:n])
+            logger.warning(f'{self.name}: mca lengths differ between rows '
+                           f'({lengths}), dropping buffer')
+            return None
+
+        data = {
+                  'element': bufs.element,
+                  'first_element': np.broadcast_to(self.curr_first_elem, n),
+                  'pixel': bufs.pixel,
+                  'live_time': bufs.live_time,
+                  'real_time': bufs.real_time,
+                  'icr': bufs.icr,
+                  'ocr': bufs.ocr,
+                  'mca_length': bufs.mca_length,
+                  'mca': bufs.mca[:n * mca_length].reshape(n, mca_length)
+                }
 
-        print(self.name + '_get_data: ' + str(np.max(pixel)))
-        return frame_dicts 
+        if logger.isEnabledFor(logging.DEBUG): # skip the max otherwise
+            logger.debug(f'{self.name}_get_data: {np.max(bufs.pixel)}')
+        return data
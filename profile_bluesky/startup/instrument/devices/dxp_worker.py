@@ -0,0 +1,150 @@
+"""
+Off-callback decoding of DXP .Data buffers
+
+Monitor callbacks only enqueue the raw buffer, one worker thread per dxp
+module runs EvalDxpData (ctypes releases the GIL, so modules decode in
+parallel) and hands results to the flyer in arrival order.
+"""
+
+__all__ = ['DxpDecodeWorker']
+
+import logging
+import queue
+import threading
+import time as ttime
+
+logger = logging.getLogger()
+
+
+class DxpDecodeWorker:
+    """Bounded queue plus a single decode thread for one Dxp module.
+
+    ``submit()`` blocks once ``maxsize`` buffers are waiting, so a decoder
+    that falls behind slows the callback instead of growing memory.  Time
+    spent blocked is recorded in ``stats()``.
+
+    worker = DxpDecodeWorker(flyer.dxp1, flyer._publish_dxp)
+    worker.start()
+    dxp1.data.subscribe(lambda value, timestamp, **kw:
+                            worker.submit(value, timestamp))
+    ...
+    worker.join() # wait for queued buffers to be decoded
+    worker.stop()
+    """
+    def __init__(self, dxp, publish, maxsize=8):
+        """
+        :param dxp: module to decode with, ``dxp.get_data(pv_data)``
+        :type dxp: Dxp
+        :param publish: called as ``publish(dxp, data, timestamp)`` from the
+                        worker thread for every decoded buffer
+        :type publish: callable
+        :param maxsize: number of raw buffers allowed to wait for decoding
+        :type maxsize: int
+        """
+        self.dxp = dxp
+        self.publish = publish
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.num_submitted = 0
+        self.num_decoded = 0
+        self.num_failed = 0
+        self.max_depth = 0
+        self.num_blocked = 0 # submits that found the queue full
+        self.blocked_time = 0.0 # s spent in submit() waiting for space
+        self.decode_time = 0.0 # s spent in get_data() + publish()
+        self.max_latency = 0.0 # s from submit() to publish()
+
+    def stats(self):
+        """ back-pressure metrics, depth is the current queue length """
+        return {'name': self.dxp.name,
+                'depth': self._queue.qsize(),
+                'max_depth': self.max_depth,
+                'maxsize': self._queue.maxsize,
+                'submitted': self.num_submitted,
+                'decoded': self.num_decoded,
+                'failed': self.num_failed,
+                'blocked': self.num_blocked,
+                'blocked_time': self.blocked_time,
+                'decode_time': self.decode_time,
+                'max_latency': self.max_latency}
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.reset_stats()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f'{self.dxp.name}_decode')
+        self._thread.start()
+
+    def submit(self, pv_data, timestamp=None):
+        """ queue a raw .Data buffer for decoding.  Called from the monitor
+        callback, blocks only when the queue is full
+        """
+        item = (pv_data, timestamp, ttime.monotonic())
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            if not self.num_blocked:
+                logger.warning(f'{self.dxp.name}: decode queue full, '
+                               'decoder is behind the detector')
+            self.num_blocked += 1
+            t0 = ttime.monotonic()
+            self._queue.put(item)
+            self.blocked_time += ttime.monotonic() - t0
+
+        self.num_submitted += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._decode(*item)
+            finally:
+                self._queue.task_done()
+
+    def _decode(self, pv_data, timestamp, t_submit):
+        t0 = ttime.monotonic()
+        try:
+            data = self.dxp.get_data(pv_data)
+            if data is None:
+                self.num_failed += 1
+                return
+            self.publish(self.dxp, data, timestamp)
+            self.num_decoded += 1
+        except Exception:
+            self.num_failed += 1
+            logger.exception(f'{self.dxp.name}: decode failed')
+        finally:
+            t1 = ttime.monotonic()
+            self.decode_time += t1 - t0
+            self.max_latency = max(self.max_latency, t1 - t_submit)
+
+    def join(self, timeout=None):
+        """ wait until every submitted buffer has been published.
+
+        :return: True if the queue drained within ``timeout``
+        :rtype: bool
+        """
+        deadline = None if timeout is None else ttime.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = (None if deadline is None
+                             else deadline - ttime.monotonic())
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stop(self):
+        """ finish queued buffers, then end the worker thread """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
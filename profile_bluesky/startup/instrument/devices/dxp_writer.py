@@ -0,0 +1,131 @@
+"""
+Out-of-band storage for DXP spectra
+
+Spectra are appended to an HDF5 file straight from the decode step, events
+only carry datum ids (like the Xspress3 HDF5 plugin).  Scalars stay inline.
+"""
+
+__all__ = ['DxpSpectraWriter', 'DxpHDF5Handler']
+
+from collections import deque
+from datetime import datetime
+import logging
+from pathlib import Path
+import threading
+import uuid
+
+import h5py
+import numpy as np
+from databroker.assets.handlers_base import HandlerBase
+
+logger = logging.getLogger()
+
+
+class DxpSpectraWriter:
+    """Streaming HDF5 writer for DXP spectra, one file per run with one
+    resizable '<module>/mca' dataset (rows x mca_length) per dxp module.
+
+    Produces one Resource and one DatumPage per ``write()``, gathered with
+    ``collect_asset_docs()``.
+
+    writer = DxpSpectraWriter('/bluedata/b_mehta/dxp')
+    writer.open()
+    datum_ids = writer.write('dxp1', mca) # mca: rows x channels
+    """
+    spec = 'DXP_HDF5'
+
+    def __init__(self, root, chunk_rows=1024):
+        self.root = Path(root)
+        self.chunk_rows = chunk_rows
+        self._lock = threading.Lock()
+        self._asset_docs_cache = deque()
+        self._file = None
+        self._resource_uid = None
+
+    def open(self):
+        """ create a new file and its resource document """
+        self.close()
+        rel_path = Path(datetime.now().strftime('%Y/%m/%d')) / f'{uuid.uuid4()}.h5'
+        path = self.root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._file = h5py.File(path, 'w')
+        self._resource_uid = str(uuid.uuid4())
+        resource = {'spec': self.spec,
+                    'root': str(self.root),
+                    'resource_path': str(rel_path),
+                    'resource_kwargs': {},
+                    'path_semantics': 'posix',
+                    'uid': self._resource_uid}
+        self._asset_docs_cache.append(('resource', resource))
+        logger.info(f'DXP spectra writing to {path}')
+
+    def write(self, module, mca):
+        """ append spectra for one dxp module.
+
+        :param module: dxp name, used as the HDF5 group
+        :type module: str
+        :param mca: spectra, rows x channels
+        :type mca: np.ndarray
+        :return: datum ids, one per row
+        :rtype: np.ndarray (object)
+        """
+        if self._file is None:
+            raise RuntimeError('DxpSpectraWriter is not open')
+
+        with self._lock:
+            if module not in self._file:
+                self._file.create_dataset(f'{module}/mca',
+                        shape=(0, mca.shape[1]), maxshape=(None, mca.shape[1]),
+                        chunks=(self.chunk_rows, mca.shape[1]), dtype=mca.dtype)
+            dset = self._file[module]['mca']
+
+            start = dset.shape[0]
+            stop = start + len(mca)
+            dset.resize(stop, axis=0)
+            dset[start:stop] = mca
+
+            index = np.arange(start, stop)
+            datum_ids = np.char.add(f'{self._resource_uid}/{module}/',
+                                    index.astype(str)).astype(object)
+            datum_page = {'resource': self._resource_uid,
+                          'datum_id': datum_ids.tolist(),
+                          'datum_kwargs': {'module': [module] * len(mca),
+                                           'index': index.tolist()}}
+            self._asset_docs_cache.append(('datum_page', datum_page))
+
+        return datum_ids
+
+    def collect_asset_docs(self):
+        with self._lock:
+            # spectra of the datums handed out here are readable from now on
+            if self._file is not None:
+                self._file.flush()
+            items = list(self._asset_docs_cache)
+            self._asset_docs_cache.clear()
+        yield from items
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = None
+
+
+class DxpHDF5Handler(HandlerBase):
+    """Read back spectra written by DxpSpectraWriter, lazily"""
+    specs = {DxpSpectraWriter.spec}
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._file = h5py.File(filename, 'r')
+
+    def __call__(self, module, index):
+        return self._file[module]['mca'][index]
+
+    def get_file_list(self, datum_kwargs_gen):
+        return [self._filename]
+
+    def close(self):
+        self._file.close()
+
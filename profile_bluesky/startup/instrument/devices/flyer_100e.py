@@ -2,9 +2,10 @@ import threading
 import logging
 import time
 from pathlib import Path
-import ctypes
 
 import re
+from functools import reduce
+import operator
 
 import numpy as np
 import pandas as pd
@@ -14,14 +15,21 @@ from bluesky.preprocessors import fly_during_decorator
 
 import ophyd
 from ophyd import Device
-from ophyd import Component as Cpt
+from ophyd import Component as Cpt, FormattedComponent as FCpt
 from ophyd.signal import EpicsSignal, Signal
 from ophyd.sim import det
 from ophyd.flyers import FlyerInterface
+from ophyd.status import SubscriptionStatus
 
 import time as ttime
 from .dxp import Dxp
+from .dxp_worker import DxpDecodeWorker
+from .column_buffer import ColumnBuffer
+from .dxp_writer import DxpSpectraWriter
+from .fpga_decode import FpgaFrameLayout
+from .trajectory import load_compiled_trajectory
 from .misc_devices import CXASEpicsMotor
+from .lazy import registry
 #from .xspress3 import xsp3
 #from .fpga_flyer import FPGABox
 
@@ -29,75 +37,6 @@ logger = logging.getLogger()
 
 __all__ = ['flyer100E']
 
-so_eval_path = Path(__file__).parent / 'fpga_eval' / 'omFpgaEval.so'
-fpga_eval_lib = ctypes.cdll.LoadLibrary(so_eval_path)
-
-# C# helper functions to decode PV
-class FpgaFrameInfo(ctypes.Structure):
-    _fields_ =    [ ("lenData",     ctypes.c_uint),
-                    ("data",        ctypes.POINTER(ctypes.c_int)),
-
-                    ("self.num_frames",   ctypes.POINTER(ctypes.c_uint)),
-                    
-                    ("numAdc",      ctypes.POINTER(ctypes.c_uint)),
-                    ("numCounter",  ctypes.POINTER(ctypes.c_uint)),
-                    ("numEncoder",  ctypes.POINTER(ctypes.c_uint)),
-                    ("numMotor",    ctypes.POINTER(ctypes.c_uint)),
-                    
-                    ("lastErrorCode", ctypes.POINTER(ctypes.c_uint))]
-         
-class FpgaFrameData(ctypes.Structure):
-    _fields_ =    [ ("lenData",     ctypes.c_uint),
-                    ("data",        ctypes.POINTER(ctypes.c_int)),
-
-                    ("self.num_frames",   ctypes.POINTER(ctypes.c_uint)),
-                    
-                    ("numAdc",      ctypes.POINTER(ctypes.c_uint)),
-                    ("numCounter",  ctypes.POINTER(ctypes.c_uint)),
-                    ("numEncoder",  ctypes.POINTER(ctypes.c_uint)),
-                    ("numMotor",    ctypes.POINTER(ctypes.c_uint)),
-
-                    ("adc",         ctypes.POINTER(ctypes.c_uint)),
-                    ("counter",     ctypes.POINTER(ctypes.c_uint)),
-                    ("motor",       ctypes.POINTER(ctypes.c_uint)),    
-                    ("encoder",     ctypes.POINTER(ctypes.c_uint)),
-
-                    ("gate",        ctypes.POINTER(ctypes.c_uint)),
-                    ("time",        ctypes.POINTER(ctypes.c_uint)),
-                    
-                    ("lastErrorCode", ctypes.POINTER(ctypes.c_uint))]
-
-so_motion_path = Path(__file__).parent / 'fpga_motion' / 'motion.so'
-fpga_motion_lib = ctypes.cdll.LoadLibrary(so_motion_path)
-
-class FpgaTrigger(ctypes.Structure):
-    _fields_ = [    
-                    ("time",            ctypes.POINTER(ctypes.c_double)),
-                    ("energy",            ctypes.POINTER(ctypes.c_double)),
-                    ("timeEnergyLen",    ctypes.c_uint),
-                    
-                    ("trigger",            ctypes.POINTER(ctypes.c_double)),                    
-                    ("triggerLen",        ctypes.POINTER(ctypes.c_uint)),
-                    
-                    ("lastErrorCode",    ctypes.POINTER(ctypes.c_int))]
-                    
-class FpgaMotion(ctypes.Structure):
-    _fields_ = [    ("time",            ctypes.POINTER(ctypes.c_double)),
-                    ("energy",            ctypes.POINTER(ctypes.c_double)),
-                    ("timeEnergyLen",    ctypes.c_uint),
-                    
-                    ("crystalD",        ctypes.c_double),
-                    ("crystalGap",        ctypes.c_double),
-                    ("motorResPhi",        ctypes.c_double),
-                    ("motorResZ",        ctypes.c_double),
-                                        
-                    ("motionPhi",        ctypes.POINTER(ctypes.c_double)),
-                    ("motionPhiLen",    ctypes.POINTER(ctypes.c_uint)),
-                    
-                    ("motionZ",            ctypes.POINTER(ctypes.c_double)),
-                    ("motionZLen",        ctypes.POINTER(ctypes.c_uint)),
-                    
-                    ("lastErrorCode",    ctypes.POINTER(ctypes.c_int))]
 class FPGABox(Device):
     """
     Device to be subclassed for fpga continuous scan
@@ -137,9 +76,26 @@ class CXAS100EFlyer(FPGABox, FlyerInterface):
     use_x3 = Cpt(Signal, value=0, doc='Enabling x3 in this flyer')
     x3 = 1# xsp3
 
-    dxp1 = Dxp('DXP1:DXP', name='dxp1')
-    dxp2 = Dxp('DXP2:DXP', name='dxp2')
-    dxp3 = Dxp('DXP3:DXP', name='dxp3')
+    use_dxp_writer = Cpt(Signal, value=1, 
+                         doc='Write DXP spectra to HDF5, events hold datum ids')
+    dxp_write_root = Cpt(Signal, value='/bluedata/b_mehta/dxp', 
+                         doc='Root directory for DXP spectra files')
+    dxp_arm_timeout = Cpt(Signal, value=30, 
+                         doc='s to wait for the DXP modules to report armed')
+    dxp_queue_size = Cpt(Signal, value=8, 
+                         doc='Raw DXP buffers allowed to wait for decoding')
+    dxp_drain_timeout = Cpt(Signal, value=30, 
+                         doc='s to wait for DXP decoding after acquisition ends')
+    arm_time = Cpt(Signal, value=0.0, kind='omitted',
+                   doc='s the DXP modules took to arm at the last kickoff')
+    dead_time = Cpt(Signal, value=0.0, kind='omitted',
+                    doc='s from the previous run\'s last collect to kickoff done')
+
+    # own IOCs, not under the flyer prefix.  Built with the flyer, so they
+    # are lazy and connected in bulk along with it
+    dxp1 = FCpt(Dxp, 'DXP1:DXP', kind='omitted')
+    dxp2 = FCpt(Dxp, 'DXP2:DXP', kind='omitted')
+    dxp3 = FCpt(Dxp, 'DXP3:DXP', kind='omitted')
 
     def __init__(self, prefix, *, config_attrs=None, read_attrs=None, **kwargs):
         
@@ -147,13 +103,24 @@ class CXAS100EFlyer(FPGABox, FlyerInterface):
         self.kickoff_status = None
         self.complete_status = None
         self.last_update_time = None
+        self.fpga_layout = None # cached, see _info_update()
         self.traj_file_path=Path(__file__).parent / 'fpga_motion' / 'Co_XANES_1kpts_41s.tra'
-        self.dxp_list = [self.dxp1, self.dxp2, self.dxp3]
-        self.buffer_dict = []
+        self.fpga_buffer = ColumnBuffer() # one column per fpga channel
+        self.dxp_buffer = ColumnBuffer() # shared by all dxp modules
+        self.dxp_writer = None
+        self._dxp_lock = threading.Lock() # keeps datum docs ahead of events
+        self._dxp_staged = None
+        self._dxp_mca_length = None # channels per spectrum, same for all modules
+        self.dxp_workers = {} # dxp name -> DxpDecodeWorker
+        self._dxp_finishing = False
+        self._data_lock = threading.Lock()
+        self._data_waiter = None # (status, batch_size, max_latency)
+        self._data_timer = None
 
         super().__init__(prefix, **kwargs) 
             # config attrs kinda broken at the moment?  Disabling works
                             #configuration_attrs=config_attrs, read_attrs=read_attrs, **kwargs)
+        self.dxp_list = [self.dxp1, self.dxp2, self.dxp3]
 
     def kickoff(self):
         logger.info("kickoff()")
@@ -163,9 +130,28 @@ class CXAS100EFlyer(FPGABox, FlyerInterface):
         self._info_update() # read config PV's, initialize frames
 
         # initialize data format for describe_collect(), collect()
-        self.buffer_dict = [] # will store event dictionaries
+        # size from last trajectory, grows if needed.  
+        self.fpga_buffer = ColumnBuffer(capacity=len(getattr(self, 'time_list', [])))
+        self.dxp_buffer = ColumnBuffer()
+        self._dxp_staged = None
+        self._dxp_mca_length = None
+        self._dxp_finishing = False
+
+        if self.use_dxp_writer.get():
+            self.dxp_writer = DxpSpectraWriter(self.dxp_write_root.get())
+            self.dxp_writer.open()
+        else:
+            self.dxp_writer = None
 
         self._setup_describe_collect() # given info dataframe
+
+        # bluesky (1.15) rebuilds collect_pages() pages from 'data' and 
+        # 'timestamps' only, 'filled' would be lost.  Offer pages only when
+        # no key is external, bluesky falls back to collect() otherwise
+        if self.use_x3.get() or self.dxp_writer is not None:
+            self.__dict__.pop('collect_pages', None)
+        else:
+            self.collect_pages = self._collect_pages
         
         # Don't block RunEngine thread, construct a different one
         thread = threading.Thread(target=self.my_activity, daemon=True)
@@ -220,18 +206,40 @@ class CXAS100EFlyer(FPGABox, FlyerInterface):
         # stage self and components (x3)
         self.stage()
 
-        self.load_trajectory()
+        try:
+            self.load_trajectory()
+
+            # arm DXP's, could find a better way to do this with stage_sigs
+            # all modules at once, done when the IOC reports them armed
+            self.dxp_finished = [False, False, False]
+            t0 = ttime.monotonic()
+            arm_status = reduce(operator.and_, 
+                                [dxp.arm(len(self.time_list), 
+                                         timeout=self.dxp_arm_timeout.get())
+                                 for dxp in self.dxp_list])
+            ophyd.status.wait(arm_status)
+            self.arm_time.put(ttime.monotonic() - t0)
+        except Exception as err:
+            logger.error(f'DXP arming failed: {err}')
+            # stop the modules that did arm and leave the flyer unstaged, 
+            # so the next kickoff can stage again
+            for dxp in self.dxp_list:
+                try:
+                    dxp.disarm()
+                except Exception as disarm_err:
+                    logger.error(f'{dxp.name}: disarm failed: {disarm_err}')
+            self.unstage()
+            self.kickoff_status._finished(success=False)
+            return
 
-        # arm DXP's, could find a better way to do this with stage_sigs
-        self.dxp_finished = [False, False, False]
-        for dxp in self.dxp_list:
-            dxp.num_map_pixels.put(len(self.time_list))
-            dxp.update_dxp.put(1)
-            dxp.curr_buff_pixels = None
-            dxp.curr_num_elems  = None
-            ttime.sleep(1)
-            dxp.start_acquire.put(1)
-            ttime.sleep(1)
+        # decode off the monitor thread, one ordered worker per module
+        for w in self.dxp_workers.values():
+            w.stop()
+        self.dxp_workers = {dxp.name: DxpDecodeWorker(dxp, self._publish_dxp,
+                                            maxsize=self.dxp_queue_size.get())
+                            for dxp in self.dxp_list}
+        for w in self.dxp_workers.values():
+            w.start()
 
         # sub before to make sure we don't miss any data?
         self.data.subscribe(self._fpga_data_update)
@@ -259,6 +267,62 @@ class CXAS100EFlyer(FPGABox, FlyerInterface):
 
         return self.complete_status
 
+    def data_available(self, batch_size=1000, max_latency=1.0):
+        """ status that finishes once there is data worth collecting: 
+        ``batch_size`` buffered rows (fpga frames + dxp rows), ``max_latency``
+        seconds after the first row arrived, or when the flyer completes.
+
+        Only the most recent status is tracked, wait on it before asking 
+        for another.
+
+        :param batch_size: rows to buffer before notifying
+        :type batch_size: int
+        :param max_latency: longest time (s) data may wait in the buffer
+        :type max_latency: float
+        :rtype: ophyd.DeviceStatus
+        """
+        status = ophyd.DeviceStatus(self)
+        with self._data_lock:
+            if self._data_timer is not None:
+                self._data_timer.cancel()
+            self._data_waiter = (status, batch_size, max_latency)
+            self._data_timer = None
+        self._notify_data()
+        return status
+
+    def _num_pending(self):
+        staged = self._dxp_staged
+        return (len(self.fpga_buffer) + len(self.dxp_buffer) 
+                + (len(staged[0]) if staged is not None else 0))
+
+    def _notify_data(self, expired=None):
+        """ finish the data_available() status if its threshold is met.  
+        Called whenever the buffers grow, and by the latency timer with 
+        ``expired`` set to the status it was started for
+        """
+        with self._data_lock:
+            if self._data_waiter is None:
+                return
+            status, batch_size, max_latency = self._data_waiter
+            n = self._num_pending()
+            done = (expired is status or n >= batch_size
+                    or (self.complete_status is not None 
+                        and self.complete_status.done))
+            if not done:
+                if n and self._data_timer is None:
+                    # oldest data starts the latency clock
+                    self._data_timer = threading.Timer(max_latency, 
+                                            self._notify_data, 
+                                            kwargs={'expired': status})
+                    self._data_timer.daemon = True
+                    self._data_timer.start()
+                return
+            if self._data_timer is not None:
+                self._data_timer.cancel()
+            self._data_waiter = None
+            self._data_timer = None
+        status._finished()
+
     def describe_collect(self):
         """
         Describe details for ``collect()`` method
@@ -271,14 +335,48 @@ class CXAS100EFlyer(FPGABox, FlyerInterface):
         Start this Flyer
         """
         logger.info("collect()")
-        # yield dictionary to bluesky
-        # clear data dictionary
-        #d = self.buffer_dict
-        #self.buffer_dict = []
-        print(f'collect({len(self.buffer_dict)})')
-        for subd in self.buffer_dict:
-            yield subd
-        self.buffer_dict=[]
+        # yield dictionary to bluesky, event dicts are only built here
+        t, columns = self.fpga_buffer.drain()
+        dxp_t, dxp_columns = self._drain_dxp()
+        logger.debug(f'collect({len(t) + len(dxp_t)})')
+
+        filled = ['mca_0', 'mca_1'] if self.use_x3.get() else None
+        yield from ColumnBuffer.to_events(t, columns, filled=filled)
+        yield from ColumnBuffer.to_events(dxp_t, dxp_columns, 
+                                          filled=self._dxp_external_keys())
+
+    def _collect_pages(self):
+        """
+        Yield one event page per stream (FPGA and DXP_100E) holding all 
+        buffered rows.  Preferred by the RunEngine over ``collect()``, 
+        installed as ``collect_pages()`` by ``kickoff()`` when no data key is
+        external.
+
+        The RunEngine keeps only 'data' and 'timestamps' of each page, event
+        'time' is the collect time.  Row arrival times stay in 'timestamps'.
+        """
+        logger.info("collect_pages()")
+        t, columns = self.fpga_buffer.drain()
+        dxp_t, dxp_columns = self._drain_dxp()
+        logger.debug(f'collect_pages({len(t)}, {len(dxp_t)})')
+
+        if len(t):
+            filled = ['mca_0', 'mca_1'] if self.use_x3.get() else None
+            yield ColumnBuffer.to_page(t, columns, filled=filled)
+        if len(dxp_t):
+            yield ColumnBuffer.to_page(dxp_t, dxp_columns, 
+                                       filled=self._dxp_external_keys())
+
+    def _drain_dxp(self):
+        """ rows staged by collect_asset_docs(), or everything buffered """
+        with self._dxp_lock:
+            staged, self._dxp_staged = self._dxp_staged, None
+            if staged is None:
+                staged = self.dxp_buffer.drain()
+        return staged
+
+    def _dxp_external_keys(self):
+        return ['mca'] if self.dxp_writer is not None else None
 
     def trigger(self):
         """ trigger: Capture a single frame, write to buffer dict. 
@@ -290,15 +388,15 @@ class CXAS100EFlyer(FPGABox, FlyerInterface):
     def read(self):
         """read: overwrite ophyd.device.read for this specific flyer
         """
-        if len(self.buffer_dict) < 1:
+        if len(self.fpga_buffer) < 1:
             self._fpga_data_update()
         
-        curr_frame = self.buffer_dict[-1]
+        t, curr_frame = self.fpga_buffer.last()
 
         results = {}
-        for k in curr_frame['data'].keys():
-            results[k] = {'value': curr_frame['data'][k],
-                           'timestamp': curr_frame['timestamps'][k] }
+        for k, v in curr_frame.items():
+            results[k] = {'value': v, 'timestamp': t}
+        return results
 
     def stage(self):
         """ stage: initialize variables?  Record resting config PV's? 
@@ -323,6 +421,14 @@ class CXAS100EFlyer(FPGABox, FlyerInterface):
             d.start_acquire.unsubscribe_all()
         self.trigger_signal.unsubscribe_all()
 
+        for w in self.dxp_workers.values():
+            w.stop()
+            logger.info(f'dxp decode stats: {w.stats()}')
+        self.dxp_workers = {}
+
+        if self.dxp_writer is not None:
+            self.dxp_writer.close()
+
         if self.use_x3.get():
             self.x3.unstage()
             # stop file writing
@@ -342,13 +448,9 @@ class CXAS100EFlyer(FPGABox, FlyerInterface):
         )
        
         # construct the fpga schema
-        dd = {}
-        dd.update({'cycletime':d})
-        dd.update({'gate':d})
-        dd.update({f'motor_{i}':d for i in range(self.num_motor.item())})
-        dd.update({f'adc_{i}':d for i in range(self.num_adc.item())})
-        dd.update({f'encoder_{i}':d for i in range(self.num_encoder.item())})
-        dd.update({f'counter_{i}':d for i in range(self.num_counter.item())})
+        # one key per field of the decoded frames: cycletime, gate, 
+        # motor_i, adc_i, encoder_i, counter_i
+        dd = {name: d for name in self.fpga_layout.dtype.names}
         
         if self.use_x3.get():
             dmca = dict(
@@ -363,6 +465,8 @@ class CXAS100EFlyer(FPGABox, FlyerInterface):
         # add schema for 100E detector
         dd_100e = self.dxp1.describe_data() # all data is the same, what to do 
                                             # with source?
+        if self.dxp_writer is not None:
+            dd_100e['mca'] = dict(dd_100e['mca'], external='FILESTORE:')
 
         self.desc = {self.name: dd,
                     'DXP_100E': dd_100e}
@@ -378,155 +482,157 @@ class CXAS100EFlyer(FPGABox, FlyerInterface):
             #self.complete_status._finished()
             # remove callbacks, could do this in unstage(), but wait to gather more tasks?
             print('falling edge found')
-    def _info_update(self):
-        # initialize parameters
-        self.num_frames         = np.zeros(1, np.uint32)
-        self.num_adc            = np.zeros(1, np.uint32)
-        self.num_counter        = np.zeros(1, np.uint32)
-        self.num_encoder        = np.zeros(1, np.uint32)
-        self.num_motor          = np.zeros(1, np.uint32)
-        self.last_error_code    = np.zeros(1, np.uint32)
-
-        pv_data = self.data.get() # array of ints
-
-        # get info from the FPGA box and record
-        fpgaFrameInfo = FpgaFrameInfo(0,
-                                np.ctypeslib.as_ctypes(pv_data),
-                                
-                                np.ctypeslib.as_ctypes(self.num_frames),
-                                
-                                np.ctypeslib.as_ctypes(self.num_adc),
-                                np.ctypeslib.as_ctypes(self.num_counter),
-                                np.ctypeslib.as_ctypes(self.num_encoder),
-                                np.ctypeslib.as_ctypes(self.num_motor),
-                                # 1 for success
-                                np.ctypeslib.as_ctypes(self.last_error_code))
-
-        fpga_eval_lib.GetFpgaFrameInfo.restype = None
-        fpga_eval_lib.GetFpgaFrameInfo(ctypes.byref(fpgaFrameInfo)) 
-
-        # initialize data 
-        self.adc         = np.zeros(self.num_frames * self.num_adc, np.uint32)
-        self.counter     = np.zeros(self.num_frames * self.num_counter, np.uint32)
-        self.motor       = np.zeros(self.num_frames * self.num_motor, np.uint32)
-        self.encoder     = np.zeros(self.num_frames * self.num_encoder, np.uint32)
-        self.gate        = np.zeros(self.num_frames, np.uint32)
-        self.time        = np.zeros(self.num_frames, np.uint32)
-
-    def _dxp_data_update(self, timestamp=None, obj=None, **kwargs):
-        """ Update in-python buffer with data from dxp.  
-
-        for now make multiple callbacks
+    def _info_update(self, pv_data=None):
+        """ read the frame layout (channel counts) from the .DATA header 
+
+        :param pv_data: .DATA value to parse, defaults to reading the PV
+        :type pv_data: np.ndarray, optional
         """
-        #print('dxp_data_update')
-        dxp = obj.parent # get relevant dxp object.
-        data_dict = dxp.get_data()
+        if pv_data is None:
+            pv_data = self.data.get() # array of ints
+        self.fpga_layout = FpgaFrameLayout.from_words(pv_data)
+
+    def _dxp_data_update(self, value=None, timestamp=None, obj=None, **kwargs):
+        """ Hand the new .Data buffer to the module's decode worker.  
 
-        time_frame = {}
-        for key in data_dict[0].keys():
-            time_frame.update({key:timestamp})
+        Runs in the monitor callback thread, so only enqueues.  Blocks if the
+        worker is more than ``dxp_queue_size`` buffers behind.
+        """
+        dxp = obj.parent # get relevant dxp object.
+        worker = self.dxp_workers.get(dxp.name)
+        if worker is None:
+            self._publish_dxp(dxp, dxp.get_data(value), timestamp)
+        else:
+            worker.submit(value, timestamp)
+
+    def _publish_dxp(self, dxp, data, timestamp=None):
+        """ Update in-python buffer with decoded data from dxp.  
+        Called from the decode worker threads, in arrival order per module
+        """
+        if data is None:
+            return
 
-        for i in range(len(data_dict)):
-            final_dict = {  'time':timestamp,
-                            'data':data_dict[i],
-                            'timestamps':time_frame
-                        }
-            self.buffer_dict.append(final_dict)
+        # single vectorized copy per column, spectra stay 2-D arrays
+        with self._dxp_lock:
+            mca_length = data['mca'].shape[1]
+            if self._dxp_mca_length is None:
+                self._dxp_mca_length = mca_length
+            elif mca_length != self._dxp_mca_length:
+                # the shared buffer (and 'mca' key) holds one spectrum length
+                logger.warning(f'{dxp.name}: mca length {mca_length} differs '
+                               f'from {self._dxp_mca_length}, dropping buffer')
+                return
+            if self.dxp_writer is not None:
+                # spectra go to file, only their datum ids stay inline
+                data['mca'] = self.dxp_writer.write(dxp.name, data['mca'])
+            self.dxp_buffer.extend(data, timestamp)
+        self._notify_data()
 
     def _dxp_acquire_finish(self, value=None, obj=None, **kwargs):
-        """ if all dxps are finished, finish run """
+        """ if all dxps are finished, finish run once their queued buffers 
+        are decoded 
+        """
         if value == 0: 
-            n = int(re.findall('\d', obj.parent.name)[0])
-            print(f'dxp{n} finished collecting')
-            self.dxp_finished[n-1] = True
+            n = self.dxp_list.index(obj.parent)
+            print(f'{obj.parent.name} finished collecting')
+            self.dxp_finished[n] = True
          
-        if all(self.dxp_finished):
-            self.complete_status._finished()
+        if all(self.dxp_finished) and not self._dxp_finishing:
+            self._dxp_finishing = True
             print('all dxps finished')
+            # don't block the monitor thread while waiting on the decoders
+            threading.Thread(target=self._drain_dxp_workers, daemon=True).start()
+
+    def _drain_dxp_workers(self):
+        """ wait for the decode queues to empty, then mark the flyer complete """
+        timeout = self.dxp_drain_timeout.get()
+        deadline = ttime.monotonic() + timeout # for all workers together
+        for w in self.dxp_workers.values():
+            if not w.join(max(deadline - ttime.monotonic(), 0)):
+                logger.warning(f'{w.dxp.name}: decode queue not drained after '
+                               f'{timeout} s, {w.stats()}')
+            logger.info(f'dxp decode stats: {w.stats()}')
+        self.complete_status._finished()
+        self._notify_data()
+
+    def dxp_idle_status(self, timeout=None):
+        """ status that finishes once every dxp module is idle 
+        (start_acquire == 0) and ready to be re-armed, monitored rather than 
+        polled.
+
+        :param timeout: fail the status after this many seconds
+        :type timeout: float, optional
+        """
+        def _idle(*, value, **kwargs):
+            return value == 0
+
+        statuses = [SubscriptionStatus(dxp.start_acquire, _idle, timeout=timeout)
+                    for dxp in self.dxp_list]
+        return reduce(operator.and_, statuses)
+
+    def dxp_decode_stats(self):
+        """ back-pressure metrics of the dxp decode workers, one row each """
+        return pd.DataFrame([w.stats() for w in self.dxp_workers.values()])
 
     def _fpga_data_update(self, value=None, timestamp=None, **kwargs):
         """ Update in python buffer with data PV information.  
-        Could have frame info change between collections, so be sure to update
+        Uses the monitored value when called as a callback, so .DATA is only 
+        read once.  Frame layout is cached and only re-parsed when the config
+        words in the header change.
         """
         logging.info('_fpga_data_update()')
-        self._info_update()
-
-        pv_data = self.data.get()
-
-        # parse new frame data
-        #print('--init fpgaFrameData')
-        fpgaFrameData = FpgaFrameData (	0,
-								np.ctypeslib.as_ctypes(pv_data),
-								
-								np.ctypeslib.as_ctypes(self.num_frames),
-								
-								np.ctypeslib.as_ctypes(self.num_adc),
-								np.ctypeslib.as_ctypes(self.num_counter),
-								np.ctypeslib.as_ctypes(self.num_encoder),
-								np.ctypeslib.as_ctypes(self.num_motor),
-								
-								np.ctypeslib.as_ctypes(self.adc),
-								np.ctypeslib.as_ctypes(self.counter),
-								np.ctypeslib.as_ctypes(self.motor),
-								np.ctypeslib.as_ctypes(self.encoder),
-								
-								np.ctypeslib.as_ctypes(self.gate),
-								np.ctypeslib.as_ctypes(self.time),
-								
-								np.ctypeslib.as_ctypes(self.last_error_code))
-
-        # C function call
-        #print('--calling EvalFpgaData')
-        fpga_eval_lib.EvalFpgaData.restype = None
-        fpga_eval_lib.EvalFpgaData(ctypes.byref(fpgaFrameData))
+        pv_data = value if value is not None else self.data.get()
+
+        # parse new frame data, one structured array of all frames
+        try:
+            if self.fpga_layout is None or not self.fpga_layout.matches(pv_data):
+                flying = (self.complete_status is not None
+                          and not self.complete_status.done)
+                if self.fpga_layout is not None and flying:
+                    # this run's descriptor and buffered columns follow the
+                    # old layout, fail the scan instead of dropping frames
+                    logger.error('_fpga_data_update(): FPGA frame layout '
+                                 'changed during the fly scan')
+                    self.complete_status._finished(success=False)
+                    return
+                self._info_update(pv_data)
+                self.fpga_buffer.drain() # rows of the old layout, if any
+                logger.info('_fpga_data_update(): FPGA frame layout changed')
+            frames = self.fpga_layout.decode(pv_data)
+        except ValueError as err:
+            logger.warning(f'_fpga_data_update(): {err}')
+            return
        
         # if we don't have a new frame
-        #print('--checking timestamps')
-        if self.last_update_time == self.time[0]:
+        if len(frames) == 0 or self.last_update_time == frames['cycletime'][0]:
             return # we don't have a new frame
         else: 
-            self.last_update_time = self.time[0] # remember last update time
-
-        # for each frame in self.frame_num, append to buffer
-        #print('--setup dictionary')
-        for frame in range(self.num_frames.item()):
-            self.trigger_ctr +=1
-            curr_frame = {}
-            curr_frame.update({'cycletime': self.time[frame]})
-            curr_frame.update({'gate': self.gate[frame]})
-            curr_frame.update({f'adc_{i}': self.adc[frame*self.num_adc.item()+i] 
-                                for i in range(self.num_adc.item())})
-            curr_frame.update({f'motor_{i}': self.motor[frame*self.num_motor.item()+i] 
-                                for i in range(self.num_motor.item())})
-            curr_frame.update({f'encoder_{i}': self.encoder[frame*self.num_encoder.item()+i] 
-                                  for i in range(self.num_encoder.item())})
-            curr_frame.update({f'counter_{i}': self.counter[frame*self.num_counter.item()+i] 
-                                for i in range(self.num_counter.item())})
-
-            if self.use_x3.get():
-                datums = list(self.x3._datum_ids)
-                curr_frame.update({'mca_0': datums[self.frame_ctr]})
-                curr_frame.update({'mca_1': datums[self.frame_ctr + 1]})
-                
-                self.frame_ctr += 2
-
-            t = time.time() 
-            time_frame ={}
-            for key in curr_frame.keys():
-                time_frame.update({key:t})
-                
-            final_dict = {'time':t,
-                          'data':curr_frame,
-                          'timestamps':time_frame}
-            if self.use_x3.get():
-                final_dict.update({'filled' : 
-                               {key: False for key in ['mca_0', 'mca_1']} })
-
-            #print('  --append to buffer')
-            self.buffer_dict.append(final_dict)
+            self.last_update_time = frames['cycletime'][0] # remember last update time
+
+        # write all frames into the column buffer in one go
+        nf = len(frames)
+        self.trigger_ctr += nf
+        frames = {name: frames[name] for name in frames.dtype.names}
+
+        if self.use_x3.get():
+            datums = self.x3.datum_ids(self.frame_ctr, self.frame_ctr + nf)
+            frames.update({'mca_0': datums[:, 0], 'mca_1': datums[:, 1]})
+            self.frame_ctr += nf
+
+        self.fpga_buffer.extend(frames)
+        self._notify_data()
 
     def collect_asset_docs(self):
         """ default to the asset docs in x3? """
+        if self.dxp_writer is not None:
+            # stage the dxp rows whose datums are emitted here, so no event 
+            # references a datum that has not been emitted yet
+            with self._dxp_lock:
+                if self._dxp_staged is None:
+                    self._dxp_staged = self.dxp_buffer.drain()
+                docs = list(self.dxp_writer.collect_asset_docs())
+            yield from docs
+
         if self.use_x3.get():
             yield from self.x3.collect_asset_docs()        
 
@@ -535,78 +641,45 @@ class CXAS100EFlyer(FPGABox, FlyerInterface):
         self.traj_file_path = traj_file_path
 
     def load_trajectory(self):
-        
-        traData = pd.read_csv(  self.traj_file_path,
-                                sep='\t',
-                                skiprows=6,
-                                comment='#',
-                                usecols=[1,2],
-                                names=['sec', 'energy'])
-
-        # hard code, assume positions
-        header = []
-        with open(self.traj_file_path) as traj_file:
-            for _ in range(6):
-                header.append(traj_file.readline())
-
-        bragg_start            = header[0].split()[1]
-        bragg_stop            = header[1].split()[1]
-        beam_height_start    = header[2].split()[1]
-        beam_height_stop    = header[3].split()[1]
-        traj_length            = header[5].split()[1]
-
-        self.time_list = traData['sec'].to_numpy()
-        self.energy_list = traData['energy'].to_numpy()
-
-        # initialize variables
-        self.trigger_list           = np.zeros(16384, np.float64)
-        self.motion_phi_list            = np.zeros(16384, np.float64)
-        self.motion_Z_list                = np.zeros(16384, np.float64)
-        self.trigger_len            = np.zeros(1, np.uint32)
-        self.motion_phi_len        = np.zeros(1, np.uint32)
-        self.motion_Z_len            = np.zeros(1, np.uint32)
-        last_error_code        = np.zeros(1, np.int32)
-
-        fpgaTrigger = FpgaTrigger(    np.ctypeslib.as_ctypes(self.time_list),
-                                    np.ctypeslib.as_ctypes(self.energy_list),
-                                    len(self.time_list),
-                                    
-                                    np.ctypeslib.as_ctypes(self.trigger_list),
-                                    np.ctypeslib.as_ctypes(self.trigger_len),
-                                    
-                                    np.ctypeslib.as_ctypes(last_error_code))
-                                    
-        # C function call, determine trigger details
-        fpga_motion_lib.restype = None
-        fpga_motion_lib.CalcTrigger(ctypes.byref(fpgaTrigger))
-
-        fpgaMotion = FpgaMotion(    np.ctypeslib.as_ctypes(self.time_list),
-                            np.ctypeslib.as_ctypes(self.energy_list),
-                            len(self.time_list),
-                            
-                            1.9202e-10,        # crystalD        [m]
-                            5,                # crystalGap    [mm]
-                            50000,            # motorPhiRes:    [counts/EGU]        ### please verify
-                            40320,            # motorZRes:    [counts/EGU]        ### please verify
-                            
-                            np.ctypeslib.as_ctypes(self.motion_phi_list),
-                            np.ctypeslib.as_ctypes(self.motion_phi_len),
-                            
-                            np.ctypeslib.as_ctypes(self.motion_Z_list),
-                            np.ctypeslib.as_ctypes(self.motion_Z_len),
-                            
-                            np.ctypeslib.as_ctypes(last_error_code))
-
-        # C function call, calculate trigger details
-        fpga_motion_lib.restype = None
-        fpga_motion_lib.CalcMotion(ctypes.byref(fpgaMotion))
-
-        self.trigger_profile_list.put(self.trigger_list)
-        self.phi.profile_list.put(self.motion_phi_list)
-        #self.z1.profile_list.put(self.motion_Z_list)
-        #self.z2.profile_list.put(self.motion_Z_list)
-
-flyer100E = CXAS100EFlyer('BL93:SCAN:MASTER', name='flyer') #, configuration_attrs=['trigger_width'])
-
-# add configuration attrs
-flyer100E.configuration_attrs.extend(['dout1_width', 'trigger_width', 'trigger_base_rate'])
+        """ compile the trajectory (cached, see load_compiled_trajectory) and
+        upload the trigger and phi profiles, unless the IOC already has them
+        """
+        traj = load_compiled_trajectory(self.traj_file_path)
+
+        self.time_list = traj['time']
+        self.energy_list = traj['energy']
+        self.fpga_buffer.reserve(len(self.time_list))
+
+        self.trigger_list = traj['trigger']
+        self.motion_phi_list = traj['phi']
+        self.motion_Z_list = traj['z']
+        self.trigger_len = traj['trigger_len']
+        self.motion_phi_len = traj['phi_len']
+        self.motion_Z_len = traj['z_len']
+
+        self._upload_profile(self.trigger_profile_list, self.trigger_list)
+        self._upload_profile(self.phi.profile_list, self.motion_phi_list)
+        #self._upload_profile(self.z1.profile_list, self.motion_Z_list)
+        #self._upload_profile(self.z2.profile_list, self.motion_Z_list)
+
+    def _upload_profile(self, signal, profile):
+        """ write ``profile`` to ``signal`` unless the IOC already holds it """
+        try:
+            current = signal.get()
+        except Exception as err:
+            logger.debug(f'{signal.name}: readback failed ({err}), uploading')
+            current = None
+        if (current is not None and len(current) >= len(profile) 
+                and np.array_equal(current[:len(profile)], profile)):
+            logger.info(f'{signal.name}: profile unchanged, skipping upload')
+            return
+        signal.put(profile)
+
+def _make_flyer100E():
+    flyer = CXAS100EFlyer('BL93:SCAN:MASTER', name='flyer') #, configuration_attrs=['trigger_width'])
+
+    # add configuration attrs
+    flyer.configuration_attrs.extend(['dout1_width', 'trigger_width', 'trigger_base_rate'])
+    return flyer
+
+flyer100E = registry.declare('flyer100E', _make_flyer100E)
@@ -0,0 +1,156 @@
+"""
+Pure NumPy decoder for the FPGA box .DATA PV
+
+Equivalent to GetFpgaFrameInfo / EvalFpgaData in fpga_eval/omFpgaEval.c, but
+returns all frames as a single structured array, one named field per channel.
+
+layout = FpgaFrameLayout.from_words(pv_data)
+frames = layout.decode(pv_data)
+frames['adc_0'], frames['cycletime'], ...
+"""
+
+__all__ = ['FpgaFrameLayout', 'decode_fpga_frames']
+
+import numpy as np
+
+# see fpga_eval/omFpgaEval.h
+OFFSET_DATA_LEN = 0
+OFFSET_TRIG_REG_1 = 1
+OFFSET_CONF_REG_1 = 3
+OFFSET_CONF_REG_2 = 4
+
+MASK_TRIGGER_TIME_MSB = 0xFC000000
+MASK_TRIGGER_TIME_LSB = 0x7FFFFFFF
+MASK_TRIGGER_WIDTH = 0x3FFFFFF
+
+MASK_CONFIG = 0x3F
+MASK_ADC = 0x3FC00
+MASK_MOTOR_ENCODER = 0x3C0000
+
+SHIFT_CONFIG_ADC = 10
+SHIFT_CONFIG_MOTOR_ENCODER = 18
+
+MASK_STATUS_REPORT = 0x80000000
+
+NUM_TRIGGER_WORDS = 2
+
+
+def _count_high_bits(word):
+    return bin(int(word)).count('1')
+
+
+class FpgaFrameLayout:
+    """Frame layout described by the two config words in the .DATA header.
+
+    Every frame holds 2 trigger words, then config, counter, adc, encoder and
+    motor words and one i/o word.  The first frame carries the two config
+    registers after its trigger words.
+    """
+    def __init__(self, config_1, config_2):
+        self.config_words = (int(config_1), int(config_2))
+
+        self.num_config = _count_high_bits(config_1 & MASK_CONFIG)
+        self.num_adc = _count_high_bits((config_1 & MASK_ADC) >> SHIFT_CONFIG_ADC)
+        self.num_encoder = _count_high_bits((config_1 & MASK_MOTOR_ENCODER)
+                                            >> SHIFT_CONFIG_MOTOR_ENCODER)
+        self.num_motor = self.num_encoder
+        self.num_counter = _count_high_bits(config_2)
+
+        self.frame_size = (self.num_config + self.num_adc + self.num_encoder
+                           + self.num_motor + self.num_counter + 3)
+
+        # (field name, word offset relative to the config block)
+        self.fields = []
+        offset = self.num_config
+        for key, n in [('counter', self.num_counter), ('adc', self.num_adc),
+                       ('encoder', self.num_encoder), ('motor', self.num_motor)]:
+            self.fields.extend((f'{key}_{i}', offset + i) for i in range(n))
+            offset += n
+
+        self.dtype = np.dtype([('cycletime', np.uint32), ('gate', np.uint32)]
+                        + [(f'motor_{i}', np.uint32) for i in range(self.num_motor)]
+                        + [(f'adc_{i}', np.uint32) for i in range(self.num_adc)]
+                        + [(f'encoder_{i}', np.uint32) for i in range(self.num_encoder)]
+                        + [(f'counter_{i}', np.uint32) for i in range(self.num_counter)])
+
+    @classmethod
+    def from_words(cls, words):
+        """ build the layout from the header of a .DATA array """
+        words = np.asarray(words).astype(np.uint32, copy=False)
+        if len(words) < 5 or words[OFFSET_DATA_LEN] < 20:
+            raise ValueError('FPGA data too short to hold a header')
+        return cls(words[OFFSET_CONF_REG_1], words[OFFSET_CONF_REG_2])
+
+    def matches(self, words):
+        """ True if ``words`` were written with this layout's config """
+        if len(words) <= OFFSET_CONF_REG_2:
+            return False
+        return (int(words[OFFSET_CONF_REG_1]) & 0xFFFFFFFF,
+                int(words[OFFSET_CONF_REG_2]) & 0xFFFFFFFF) == self.config_words
+
+    def num_frames(self, words):
+        """ number of frames in ``words``, validating the header """
+        data_num_bytes = int(words[OFFSET_DATA_LEN]) & 0xFFFFFFFF
+        if data_num_bytes < 20:
+            raise ValueError(f'FPGA data length too short: {data_num_bytes}')
+        if int(words[OFFSET_TRIG_REG_1]) & MASK_STATUS_REPORT:
+            raise ValueError('FPGA data is a status report, not DAQ data')
+        if (data_num_bytes - 8) % (4 * self.frame_size):
+            raise ValueError(f'FPGA data length {data_num_bytes} does not fit '
+                             f'frame size {self.frame_size}')
+        return (data_num_bytes - 8) // (4 * self.frame_size)
+
+    def frame_offsets(self, num_frames):
+        """ word offset of the trigger words of each frame """
+        offsets = self.frame_size * np.arange(num_frames) + 3
+        if num_frames:
+            offsets[0] = 1
+        return offsets
+
+    def decode(self, words):
+        """ decode all frames in ``words`` into a structured array
+
+        :param words: .DATA PV value
+        :type words: np.ndarray (int32)
+        :return: shape (num_frames,), one uint32 field per channel
+        :rtype: np.ndarray
+        """
+        words = np.asarray(words).astype(np.uint32, copy=False)
+        num_frames = self.num_frames(words)
+        frames = np.empty(num_frames, self.dtype)
+
+        trig = self.frame_offsets(num_frames)
+        trig_1 = words[trig]
+        trig_2 = words[trig + 1]
+        # uint32 arithmetic, msb bits beyond 32 are dropped as in C
+        frames['cycletime'] = ((trig_1 & MASK_TRIGGER_TIME_LSB)
+                               | ((trig_2 & MASK_TRIGGER_TIME_MSB) << np.uint32(5)))
+        frames['gate'] = trig_2 & MASK_TRIGGER_WIDTH
+
+        # config block starts after the trigger words, and after the config
+        # registers in the first frame
+        config = trig + NUM_TRIGGER_WORDS
+        if num_frames:
+            config[0] += 2
+        for name, offset in self.fields:
+            frames[name] = words[config + offset]
+
+        for i in range(self.num_encoder):
+            name = f'encoder_{i}'
+            frames[name] = np.uint32(0) - (frames[name] + np.uint32(0x7FFFFFFF))
+
+        return frames
+
+
+def decode_fpga_frames(words, layout=None):
+    """ decode a .DATA PV value into a structured array of frames.
+
+    :param words: .DATA PV value
+    :param layout: reuse a previously parsed layout, defaults to parsing the
+                   header of ``words``
+    :type layout: FpgaFrameLayout, optional
+    :raises ValueError: if the data is not valid DAQ data
+    """
+    if layout is None:
+        layout = FpgaFrameLayout.from_words(words)
+    return layout.decode(words)
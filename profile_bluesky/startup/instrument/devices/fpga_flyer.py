@@ -18,50 +18,14 @@ from ophyd.sim import det
 from ophyd.flyers import FlyerInterface
 
 from .misc_devices import CXASEpicsMotor
+from .column_buffer import ColumnBuffer
+from .fpga_decode import FpgaFrameLayout
 from .xspress3 import xsp3
 
 logger = logging.getLogger()
 
 __all__ = ['flyer']
 
-so_eval_path = Path(__file__).parent / 'fpga_eval' / 'omFpgaEval.so'
-fpga_eval_lib = ctypes.cdll.LoadLibrary(so_eval_path)
-
-# C# helper functions to decode PV
-class FpgaFrameInfo(ctypes.Structure):
-    _fields_ =    [ ("lenData",     ctypes.c_uint),
-                    ("data",        ctypes.POINTER(ctypes.c_int)),
-
-                    ("self.num_frames",   ctypes.POINTER(ctypes.c_uint)),
-                    
-                    ("numAdc",      ctypes.POINTER(ctypes.c_uint)),
-                    ("numCounter",  ctypes.POINTER(ctypes.c_uint)),
-                    ("numEncoder",  ctypes.POINTER(ctypes.c_uint)),
-                    ("numMotor",    ctypes.POINTER(ctypes.c_uint)),
-                    
-                    ("lastErrorCode", ctypes.POINTER(ctypes.c_uint))]
-         
-class FpgaFrameData(ctypes.Structure):
-    _fields_ =    [ ("lenData",     ctypes.c_uint),
-                    ("data",        ctypes.POINTER(ctypes.c_int)),
-
-                    ("self.num_frames",   ctypes.POINTER(ctypes.c_uint)),
-                    
-                    ("numAdc",      ctypes.POINTER(ctypes.c_uint)),
-                    ("numCounter",  ctypes.POINTER(ctypes.c_uint)),
-                    ("numEncoder",  ctypes.POINTER(ctypes.c_uint)),
-                    ("numMotor",    ctypes.POINTER(ctypes.c_uint)),
-
-                    ("adc",         ctypes.POINTER(ctypes.c_uint)),
-                    ("counter",     ctypes.POINTER(ctypes.c_uint)),
-                    ("motor",       ctypes.POINTER(ctypes.c_uint)),    
-                    ("encoder",     ctypes.POINTER(ctypes.c_uint)),
-
-                    ("gate",        ctypes.POINTER(ctypes.c_uint)),
-                    ("time",        ctypes.POINTER(ctypes.c_uint)),
-                    
-                    ("lastErrorCode", ctypes.POINTER(ctypes.c_uint))]
-
 so_motion_path = Path(__file__).parent / 'fpga_motion' / 'motion.so'
 fpga_motion_lib = ctypes.cdll.LoadLibrary(so_motion_path)
 
@@ -296,13 +260,7 @@ class CXASFlyer(FPGABox, FlyerInterface):
         )
        
         # construct the schema
-        dd = {}
-        dd.update({'cycletime':d})
-        dd.update({'gate':d})
-        dd.update({f'motor_{i}':d for i in range(self.num_motor.item())})
-        dd.update({f'adc_{i}':d for i in range(self.num_adc.item())})
-        dd.update({f'encoder_{i}':d for i in range(self.num_encoder.item())})
-        dd.update({f'counter_{i}':d for i in range(self.num_counter.item())})
+        dd = {name: d for name in self.fpga_layout.dtype.names}
         
         if self.use_x3.get():
             dmca = dict(
@@ -338,39 +296,9 @@ class CXASFlyer(FPGABox, FlyerInterface):
                 self.x3.hdf5.capture.put(0)
 
     def _info_update(self):
-        # initialize parameters
-        self.num_frames         = np.zeros(1, np.uint32)
-        self.num_adc            = np.zeros(1, np.uint32)
-        self.num_counter        = np.zeros(1, np.uint32)
-        self.num_encoder        = np.zeros(1, np.uint32)
-        self.num_motor          = np.zeros(1, np.uint32)
-        self.last_error_code    = np.zeros(1, np.uint32)
-
+        """ read the frame layout (channel counts) from the .DATA header """
         pv_data = self.data.get() # array of ints
-
-        # get info from the FPGA box and record
-        fpgaFrameInfo = FpgaFrameInfo(0,
-                                np.ctypeslib.as_ctypes(pv_data),
-                                
-                                np.ctypeslib.as_ctypes(self.num_frames),
-                                
-                                np.ctypeslib.as_ctypes(self.num_adc),
-                                np.ctypeslib.as_ctypes(self.num_counter),
-                                np.ctypeslib.as_ctypes(self.num_encoder),
-                                np.ctypeslib.as_ctypes(self.num_motor),
-                                # 1 for success
-                                np.ctypeslib.as_ctypes(self.last_error_code))
-
-        fpga_eval_lib.GetFpgaFrameInfo.restype = None
-        fpga_eval_lib.GetFpgaFrameInfo(ctypes.byref(fpgaFrameInfo)) 
-
-        # initialize data 
-        self.adc         = np.zeros(self.num_frames * self.num_adc, np.uint32)
-        self.counter     = np.zeros(self.num_frames * self.num_counter, np.uint32)
-        self.motor       = np.zeros(self.num_frames * self.num_motor, np.uint32)
-        self.encoder     = np.zeros(self.num_frames * self.num_encoder, np.uint32)
-        self.gate        = np.zeros(self.num_frames, np.uint32)
-        self.time        = np.zeros(self.num_frames, np.uint32)
+        self.fpga_layout = FpgaFrameLayout.from_words(pv_data)
 
     def _data_update(self, value=None, timestamp=None, **kwargs):
         """ Update in python buffer with data PV information.  
@@ -381,77 +309,32 @@ class CXASFlyer(FPGABox, FlyerInterface):
 
         pv_data = self.data.get()
 
-        # parse new frame data
-        #print('--init fpgaFrameData')
-        fpgaFrameData = FpgaFrameData (	0,
-								np.ctypeslib.as_ctypes(pv_data),
-								
-								np.ctypeslib.as_ctypes(self.num_frames),
-								
-								np.ctypeslib.as_ctypes(self.num_adc),
-								np.ctypeslib.as_ctypes(self.num_counter),
-								np.ctypeslib.as_ctypes(self.num_encoder),
-								np.ctypeslib.as_ctypes(self.num_motor),
-								
-								np.ctypeslib.as_ctypes(self.adc),
-								np.ctypeslib.as_ctypes(self.counter),
-								np.ctypeslib.as_ctypes(self.motor),
-								np.ctypeslib.as_ctypes(self.encoder),
-								
-								np.ctypeslib.as_ctypes(self.gate),
-								np.ctypeslib.as_ctypes(self.time),
-								
-								np.ctypeslib.as_ctypes(self.last_error_code))
-
-        # C function call
-        #print('--calling EvalFpgaData')
-        fpga_eval_lib.EvalFpgaData.restype = None
-        fpga_eval_lib.EvalFpgaData(ctypes.byref(fpgaFrameData))
+        # parse new frame data, one structured array of all frames
+        try:
+            frames = self.fpga_layout.decode(pv_data)
+        except ValueError as err:
+            logger.warning(f'_data_update(): {err}')
+            return
        
         # if we don't have a new frame
-        #print('--checking timestamps')
-        if self.last_update_time == self.time[0]:
+        if len(frames) == 0 or self.last_update_time == frames['cycletime'][0]:
             return # we don't have a new frame
         else: 
-            self.last_update_time = self.time[0] # remember last update time
-
-        # for each frame in self.frame_num, append to buffer
-        #print('--setup dictionary')
-        for frame in range(self.num_frames.item()):
-            self.trigger_ctr +=1
-            curr_frame = {}
-            curr_frame.update({'cycletime': self.time[frame]})
-            curr_frame.update({'gate': self.gate[frame]})
-            curr_frame.update({f'adc_{i}': self.adc[frame*self.num_adc.item()+i] 
-                                for i in range(self.num_adc.item())})
-            curr_frame.update({f'motor_{i}': self.motor[frame*self.num_motor.item()+i] 
-                                for i in range(self.num_motor.item())})
-            curr_frame.update({f'encoder_{i}': self.encoder[frame*self.num_encoder.item()+i] 
-                                  for i in range(self.num_encoder.item())})
-            curr_frame.update({f'counter_{i}': self.counter[frame*self.num_counter.item()+i] 
-                                for i in range(self.num_counter.item())})
+            self.last_update_time = frames['cycletime'][0] # remember last update time
 
-            if self.use_x3.get():
-                datums = list(self.x3._datum_ids)
-                curr_frame.update({'mca_0': datums[self.frame_ctr]})
-                curr_frame.update({'mca_1': datums[self.frame_ctr + 1]})
-                
-                self.frame_ctr += 2
-
-            t = time.time() 
-            time_frame ={}
-            for key in curr_frame.keys():
-                time_frame.update({key:t})
-                
-            final_dict = {'time':t,
-                          'data':curr_frame,
-                          'timestamps':time_frame}
-            if self.use_x3.get():
-                final_dict.update({'filled' : 
-                               {key: False for key in ['mca_0', 'mca_1']} })
+        nf = len(frames)
+        self.trigger_ctr += nf
+        columns = {name: frames[name] for name in frames.dtype.names}
+
+        filled = None
+        if self.use_x3.get():
+            datums = self.x3.datum_ids(self.frame_ctr, self.frame_ctr + nf)
+            columns.update({'mca_0': datums[:, 0], 'mca_1': datums[:, 1]})
+            self.frame_ctr += nf
+            filled = ['mca_0', 'mca_1']
 
-            #print('  --append to buffer')
-            self.buffer_dict.append(final_dict)
+        self.buffer_dict.extend(ColumnBuffer.to_events(np.full(nf, time.time()),
+                                                       columns, filled=filled))
 
     def collect_asset_docs(self):
         """ default to the asset docs in x3? """
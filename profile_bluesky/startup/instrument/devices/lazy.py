@@ -0,0 +1,255 @@
+"""
+Lazy device registry
+
+Devices are declared at import, but only constructed when first touched
+(attribute access, or ``registry.connect_in_background()`` once the prompt
+is up, which also connects all PVs in bulk, see connection.py).  Blocking
+hardware setup like ``hdf5.warmup()`` is registered as a ``first_use`` hook
+and runs on the first access from user code, so a missing IOC no longer
+stalls the whole profile.
+
+xsp3 = registry.declare('xsp3', lambda: CXASXspress3Detector(...),
+                        first_use=lambda dev: dev.hdf5.warmup())
+xsp3.settings # constructs, then warms up
+"""
+
+__all__ = ['LazyDevice', 'DeviceRegistry', 'registry']
+
+from collections import OrderedDict
+import logging
+import threading
+import time as ttime
+
+from .connection import connect_signals, connection_report
+from ..startup_profile import profiler, memory_mb
+
+logger = logging.getLogger()
+
+
+class LazyDevice:
+    """Stand-in for a device that builds it on first attribute access.
+
+    Attribute get/set, ``dir()``, ``repr()`` and ``isinstance()`` are
+    forwarded to the real device, so plans can take the proxy in place of
+    the device.  ``first_use`` runs once, on the first forwarded access.
+    """
+    __slots__ = ('_lazy_name', '_lazy_factory', '_lazy_first_use',
+                 '_lazy_device', '_lazy_used', '_lazy_error', '_lazy_lock',
+                 '__weakref__')
+
+    def __init__(self, name, factory, first_use=None):
+        """
+        :param name: name the device is declared under
+        :type name: str
+        :param factory: builds the device, called at most once
+        :type factory: callable
+        :param first_use: called as ``first_use(device)`` before the first
+                          forwarded attribute access
+        :type first_use: callable, optional
+        """
+        object.__setattr__(self, '_lazy_name', name)
+        object.__setattr__(self, '_lazy_factory', factory)
+        object.__setattr__(self, '_lazy_first_use', first_use)
+        object.__setattr__(self, '_lazy_device', None)
+        object.__setattr__(self, '_lazy_used', first_use is None)
+        object.__setattr__(self, '_lazy_error', None)
+        object.__setattr__(self, '_lazy_lock', threading.RLock())
+
+    @property
+    def is_constructed(self):
+        return self._lazy_device is not None
+
+    def _construct(self):
+        """ build the device if needed, without running ``first_use`` """
+        device = self._lazy_device
+        if device is not None:
+            return device
+        with self._lazy_lock:
+            if self._lazy_device is None:
+                t0 = ttime.monotonic()
+                rss = memory_mb()
+                try:
+                    device = self._lazy_factory()
+                except Exception as err:
+                    object.__setattr__(self, '_lazy_error', err)
+                    raise
+                object.__setattr__(self, '_lazy_device', device)
+                object.__setattr__(self, '_lazy_error', None)
+                wall = ttime.monotonic() - t0
+                profiler.record('device', self._lazy_name, wall,
+                                rss_mb=memory_mb() - rss)
+                logger.debug(f'{self._lazy_name}: constructed in {wall:.3f} s')
+            return self._lazy_device
+
+    def _resolve(self):
+        """ the real device, constructed and set up for use """
+        device = self._construct()
+        if not self._lazy_used:
+            with self._lazy_lock:
+                if not self._lazy_used:
+                    logger.info(f'{self._lazy_name}: first use setup')
+                    self._lazy_first_use(device)
+                    object.__setattr__(self, '_lazy_used', True)
+        return device
+
+    def __getattr__(self, attr):
+        # only called for names not found on the proxy itself
+        return getattr(self._resolve(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._resolve(), attr, value)
+
+    def __delattr__(self, attr):
+        delattr(self._resolve(), attr)
+
+    def __dir__(self):
+        return dir(self._resolve())
+
+    @property
+    def __class__(self):
+        return type(self._resolve())
+
+    def __repr__(self):
+        if self._lazy_device is None:
+            return f'<LazyDevice {self._lazy_name!r} (not constructed)>'
+        return repr(self._lazy_device)
+
+    # neither constructs the device: putting a proxy in a set or dict must
+    # not run first_use.  Proxies compare by registry name, a device only
+    # equals the proxy that built it.  The hash stays the name's, so a
+    # proxy and its device are not interchangeable as dict keys
+    def __eq__(self, other):
+        if isinstance(other, LazyDevice):
+            return self._lazy_name == other._lazy_name
+        return self._lazy_device is not None and self._lazy_device == other
+
+    def __hash__(self):
+        return hash(self._lazy_name)
+
+
+class DeviceRegistry:
+    """Declared devices by name, in declaration order"""
+    def __init__(self):
+        self._devices = OrderedDict()
+        self._thread = None
+        self.connection_table = None
+
+    def declare(self, name, factory, first_use=None):
+        """ declare a device without constructing it.
+
+        :param name: session name of the device
+        :type name: str
+        :param factory: builds the device
+        :type factory: callable
+        :param first_use: blocking setup, run on the first access
+        :type first_use: callable, optional
+        :return: proxy to bind to the module level name
+        :rtype: LazyDevice
+        """
+        if name in self._devices:
+            logger.warning(f'device {name} declared twice, replacing')
+        proxy = LazyDevice(name, factory, first_use=first_use)
+        self._devices[name] = proxy
+        return proxy
+
+    def __getitem__(self, name):
+        return self._devices[name]
+
+    def __contains__(self, name):
+        return name in self._devices
+
+    def __iter__(self):
+        return iter(self._devices)
+
+    def names(self):
+        return list(self._devices)
+
+    def proxies(self):
+        return list(self._devices.values())
+
+    def get(self, name):
+        """ the real device, constructed and set up """
+        return self._devices[name]._resolve()
+
+    def construct_all(self):
+        """ build every declared device, skipping ``first_use`` setup.
+
+        :return: {name: exception} for devices that failed to construct
+        :rtype: dict
+        """
+        failed = {}
+        t0 = ttime.monotonic()
+        for name, proxy in self._devices.items():
+            try:
+                proxy._construct()
+            except Exception as err:
+                logger.warning(f'{name}: construction failed: {err}')
+                failed[name] = err
+        logger.info(f'constructed {len(self._devices) - len(failed)}/'
+                    f'{len(self._devices)} devices in '
+                    f'{ttime.monotonic() - t0:.2f} s')
+        return failed
+
+    def connect_all(self, timeout=5.0, slow=1.0):
+        """ build every device, then wait once for all their PVs.
+
+        :param timeout: global connection timeout [s]
+        :param slow: latency above which a PV is reported as slow [s]
+        :return: one row per PV, also kept as ``connection_table``
+        :rtype: pd.DataFrame
+        """
+        self.construct_all()
+        t0 = ttime.monotonic()
+        devices = OrderedDict((name, proxy._lazy_device)
+                              for name, proxy in self._devices.items()
+                              if proxy._lazy_device is not None)
+        self.connection_table = connect_signals(devices, timeout=timeout,
+                                                slow=slow)
+        profiler.record('connect', 'all devices', ttime.monotonic() - t0)
+        return self.connection_table
+
+    def connection_report(self):
+        """ text table of the last ``connect_all()`` """
+        if self.connection_table is None:
+            return 'devices not connected yet'
+        return connection_report(self.connection_table)
+
+    def connect_in_background(self, timeout=5.0, slow=1.0):
+        """ run ``connect_all()`` in a daemon thread and log the report
+        when it is done (``connection_report()`` shows it again), returns
+        the thread
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+
+        def run():
+            try:
+                self.connect_all(timeout=timeout, slow=slow)
+            except Exception:
+                logger.exception('device connection failed')
+                return
+            report = self.connection_report()
+            logger.info('device connections:\n' + report)
+            profiler.write()
+
+        self._thread = threading.Thread(target=run, daemon=True,
+                                        name='device_registry')
+        self._thread.start()
+        return self._thread
+
+    def status(self):
+        """ {name: 'pending' | 'constructed' | 'ready' | 'failed'} """
+        state = OrderedDict()
+        for name, proxy in self._devices.items():
+            if proxy._lazy_error is not None:
+                state[name] = 'failed'
+            elif proxy._lazy_device is None:
+                state[name] = 'pending'
+            elif not proxy._lazy_used:
+                state[name] = 'constructed'
+            else:
+                state[name] = 'ready'
+        return state
+
+
+registry = DeviceRegistry()
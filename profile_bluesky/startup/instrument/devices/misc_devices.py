@@ -6,19 +6,30 @@ __all__ = ['shutter', 'I1', 'I0', 'lrf', 'table_trigger', 'table_busy',
 
 from ophyd import EpicsSignalRO, EpicsSignal, Device, Component as Cpt
 
-shutter = EpicsSignal('BL00:RIO.DO00', name='FastShutter')
-I1 = EpicsSignalRO('BL00:RIO.AI2', name='I1')
-I0 = EpicsSignalRO('BL00:RIO.AI1', name='I0')
-
-lrf = EpicsSignalRO('BL00:RIO.AI0', name='lrf')
-
-table_trigger = EpicsSignal('BL00:RIO.DO01', name='tablev_scan trigger')
-table_busy = EpicsSignalRO('BL00:RIO.AI3', name='tablev_scan busy')
-
-filter1 = EpicsSignal('BL00:RIO.AO1', name='filter1') # high (4.9V) = filter out
-filter2 = EpicsSignal('BL00:RIO.AO2', name='filter2') 
-filter3 = EpicsSignal('BL00:RIO.AO3', name='filter3') 
-filter4 = EpicsSignal('BL00:RIO.AO4', name='filter4') 
+from .lazy import registry
+
+# declared here, constructed on first use (see lazy.py)
+shutter = registry.declare('shutter',
+                lambda: EpicsSignal('BL00:RIO.DO00', name='FastShutter'))
+I1 = registry.declare('I1', lambda: EpicsSignalRO('BL00:RIO.AI2', name='I1'))
+I0 = registry.declare('I0', lambda: EpicsSignalRO('BL00:RIO.AI1', name='I0'))
+
+lrf = registry.declare('lrf', lambda: EpicsSignalRO('BL00:RIO.AI0', name='lrf'))
+
+table_trigger = registry.declare('table_trigger',
+                lambda: EpicsSignal('BL00:RIO.DO01', name='tablev_scan trigger'))
+table_busy = registry.declare('table_busy',
+                lambda: EpicsSignalRO('BL00:RIO.AI3', name='tablev_scan busy'))
+
+# high (4.9V) = filter out
+filter1 = registry.declare('filter1',
+                lambda: EpicsSignal('BL00:RIO.AO1', name='filter1'))
+filter2 = registry.declare('filter2',
+                lambda: EpicsSignal('BL00:RIO.AO2', name='filter2'))
+filter3 = registry.declare('filter3',
+                lambda: EpicsSignal('BL00:RIO.AO3', name='filter3'))
+filter4 = registry.declare('filter4',
+                lambda: EpicsSignal('BL00:RIO.AO4', name='filter4'))
 
 
 from ophyd.utils.epics_pvs import fmt_time
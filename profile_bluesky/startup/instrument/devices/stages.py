@@ -4,19 +4,21 @@ stages
 
 __all__ = ['s_stage', 'px', 'py'] #, 'pz', 'th', 'vx', 'vy']
 
-from ..framework import sd
+from ..framework.initialize import sd
 from ..session_logs import logger
 logger.info(__file__)
 
 from ophyd import Component as Cpt, MotorBundle, EpicsMotor
 
+from .lazy import registry
+
 class HiTpStage(MotorBundle):
     """HiTp Sample Stage"""
     #stage x, y
     px = Cpt(EpicsMotor, 'BL22:IMS:MOTOR1', kind='hinted', labels=('sample',))
     py = Cpt(EpicsMotor, 'BL22:IMS:MOTOR2', kind='hinted', labels=('sample',))
 
-s_stage = HiTpStage('', name='s_stage')
+s_stage = registry.declare('s_stage', lambda: HiTpStage('', name='s_stage'))
 
 class FPGABoxMotors(MotorBundle):
     """FPGA box motors"""
@@ -27,5 +29,5 @@ class FPGABoxMotors(MotorBundle):
 #sd.baseline.append(s_stage)
 
 # convenience definitions 
-px = s_stage.px
-py = s_stage.py
+px = registry.declare('px', lambda: s_stage.px)
+py = registry.declare('py', lambda: s_stage.py)
@@ -0,0 +1,531 @@
+"""
+Trajectory files (.tra) and their compiled FPGA trigger / motion profiles
+
+calc_trigger / calc_motion are a NumPy port of fpga_motion/motion.c and give
+identical output (checked against motion.so on the bundled trajectories by
+tests/test_trajectory.py, see compile_trajectory_c).  Compiled results are
+cached as '<name>-<key>.npz' in a user cache directory
+(trajectory_cache_dir()), keyed on the file contents and the crystal / motor
+parameters, so repeated scans with the same trajectory skip the parse and
+compile.
+
+traj = load_compiled_trajectory(path)
+traj['trigger'], traj['phi'], traj['time'], ...
+"""
+
+__all__ = ['MOTION_PARAMS', 'read_trajectory', 'write_trajectory',
+           'energy_to_angle',
+           'angle_to_energy', 'calc_trigger', 'calc_motion',
+           'compile_trajectory', 'compile_trajectory_c',
+           'load_compiled_trajectory', 'trajectory_cache_dir']
+
+import ctypes
+import hashlib
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import sys
+
+import numpy as np
+
+logger = logging.getLogger()
+
+so_motion_path = Path(__file__).parent / 'fpga_motion' / 'motion.so'
+
+# see fpga_motion/motion.h
+PI = 3.14159265358979323846
+H_PLANCK = 6.62607004e-34
+C_LIGHT = 299792458
+Q_E = 1.60217662e-19
+
+# length of the profile arrays expected by the IOC
+PROFILE_LENGTH = 16384
+
+# header fields holding the number of triggers / motion segments
+MASK_TRIGGER_SEGMENTS = 0x3fff
+MASK_MOTION_SEGMENTS = 0x1fff
+
+# default crystal and motor parameters for CalcMotion
+MOTION_PARAMS = {'crystal_d': 1.9202e-10,     # [m]
+                 'crystal_gap': 5,            # [mm]
+                 'motor_res_phi': 50000,      # [counts/EGU]  ### please verify
+                 'motor_res_z': 40320}        # [counts/EGU]  ### please verify
+
+# bump when the compiled output changes, invalidates old cache files
+CACHE_VERSION = 1
+
+def trajectory_cache_dir():
+    """ directory of the compiled trajectory cache, per user """
+    if sys.platform == "win32":
+        base = os.environ["LOCALAPPDATA"]
+    else:
+        base = os.environ.get("XDG_CACHE_HOME",
+                              os.path.join(os.environ["HOME"], ".cache"))
+    return Path(base) / "bluesky_trajectories"
+
+class FpgaTrigger(ctypes.Structure):
+    _fields_ = [
+                    ("time",            ctypes.POINTER(ctypes.c_double)),
+                    ("energy",            ctypes.POINTER(ctypes.c_double)),
+                    ("timeEnergyLen",    ctypes.c_uint),
+
+                    ("trigger",            ctypes.POINTER(ctypes.c_double)),
+                    ("triggerLen",        ctypes.POINTER(ctypes.c_uint)),
+
+                    ("lastErrorCode",    ctypes.POINTER(ctypes.c_int))]
+
+class FpgaMotion(ctypes.Structure):
+    _fields_ = [    ("time",            ctypes.POINTER(ctypes.c_double)),
+                    ("energy",            ctypes.POINTER(ctypes.c_double)),
+                    ("timeEnergyLen",    ctypes.c_uint),
+
+                    ("crystalD",        ctypes.c_double),
+                    ("crystalGap",        ctypes.c_double),
+                    ("motorResPhi",        ctypes.c_double),
+                    ("motorResZ",        ctypes.c_double),
+
+                    ("motionPhi",        ctypes.POINTER(ctypes.c_double)),
+                    ("motionPhiLen",    ctypes.POINTER(ctypes.c_uint)),
+
+                    ("motionZ",            ctypes.POINTER(ctypes.c_double)),
+                    ("motionZLen",        ctypes.POINTER(ctypes.c_uint)),
+
+                    ("lastErrorCode",    ctypes.POINTER(ctypes.c_int))]
+
+
+def read_trajectory(path):
+    """ read a .tra file in a single pass.
+
+    :param path: trajectory file
+    :return: (header, time, energy), header maps the 'Key:' of each of the
+             six header lines to its value
+    :rtype: (dict, np.ndarray, np.ndarray)
+    """
+    header = {}
+    rows = []
+    with open(path) as traj_file:
+        for i, line in enumerate(traj_file):
+            if i < 6:
+                if not line.startswith('#'):
+                    key, value = line.split()[:2]
+                    header[key.rstrip(':')] = value
+                continue
+            if line.startswith('#') or not line.strip():
+                continue
+            fields = line.split('\t')
+            rows.append((float(fields[1]), float(fields[2])))
+
+    data = np.array(rows, np.float64).reshape(-1, 2)
+    return header, np.ascontiguousarray(data[:, 0]), np.ascontiguousarray(data[:, 1])
+
+
+def write_trajectory(path, time, energy, crystal_d=MOTION_PARAMS['crystal_d'],
+                     beam_height=(0, 0)):
+    """ write a .tra file, header angles are computed from the energies.
+
+    :param path: trajectory file
+    :param time: time points [s]
+    :param energy: energies [eV]
+    :param crystal_d: crystal lattice spacing [m]
+    :param beam_height: (start, stop) beam height
+    """
+    angle = energy_to_angle([energy[0], energy[-1]], crystal_d)
+    lines = [f'BraggAngleStart:\t{float(angle[0])!r}',
+             f'BraggAngleStop:\t{float(angle[1])!r}',
+             f'BeamHeightStart:\t{beam_height[0]}',
+             f'BeamHeightStop:\t{beam_height[1]}',
+             '#' + '-' * 60,
+             f'TrajectoryLength:\t{len(time)}']
+    lines += [f'Trajectory:\t{t!r}\t{e!r}' 
+              for t, e in zip(np.asarray(time, np.float64).tolist(), 
+                              np.asarray(energy, np.float64).tolist())]
+    with open(path, 'w') as traj_file:
+        traj_file.write('\n'.join(lines) + '\n')
+
+
+def energy_to_angle(energy, crystal_d):
+    """ Bragg angle [deg] for ``energy`` [eV].  Energies below the
+    convert_energy_to_angle threshold give 0, as in motion.c
+    """
+    energy = np.asarray(energy, np.float64)
+    low_threshold = H_PLANCK * C_LIGHT / (PI * Q_E * crystal_d)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        arg = H_PLANCK * C_LIGHT / (2.0 * crystal_d * Q_E * energy)
+    # libm asin, NumPy's SIMD arcsin can differ in the last bit and motor
+    # steps are computed from small differences of these angles
+    angle = _libm(math.asin, arg) * 180.0 / PI
+    return np.where(energy < low_threshold, 0.0, angle)
+
+
+def angle_to_energy(angle, crystal_d):
+    """ energy [eV] for Bragg ``angle`` [deg], NaN outside (0, 90) """
+    angle = np.asarray(angle, np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        energy = H_PLANCK * C_LIGHT / (2.0 * crystal_d * Q_E
+                                       * np.sin(angle * PI / 180.0))
+    return np.where((angle <= 0) | (angle >= 90.0), np.nan, energy)
+
+
+def _libm(func, x):
+    """ apply a math module function elementwise, NaN outside its domain.
+
+    Deliberately not vectorized: NumPy's SIMD arcsin / cos can differ from
+    libm in the last bit, and the profiles must stay bit-identical to
+    motion.so (tests/test_trajectory.py)
+    """
+    def f(v):
+        try:
+            return func(v)
+        except ValueError:
+            return math.nan
+    return np.fromiter(map(f, np.ravel(x).tolist()), np.float64,
+                       count=np.size(x)).reshape(np.shape(x))
+
+
+def _round(x):
+    """ C round(): halfway cases away from zero """
+    t = np.trunc(x)
+    return t + np.where(np.abs(x - t) >= 0.5, np.sign(x), 0)
+
+
+# (int) of a double outside the int range, as on x86-64
+INT_INDEFINITE = -2**31
+
+def _round_scalar(x):
+    """ (int)round(x) """
+    if not math.isfinite(x):
+        return INT_INDEFINITE
+    t = math.trunc(x)
+    n = t + (int(math.copysign(1, x)) if abs(x - t) >= 0.5 else 0)
+    return n if -2**31 <= n < 2**31 else INT_INDEFINITE
+
+
+def _near_tie(s, tol):
+    """ True if any value is within ``tol`` of a rounding tie """
+    return bool(np.any(np.abs(s - np.floor(s) - 0.5) <= tol))
+
+
+def _carry_round(x, err=0.0):
+    """ error-diffusion rounding as in motion.c:
+
+        n[i] = round(x[i] + e[i-1]),  e[i] = x[i] + e[i-1] - n[i]
+
+    Vectorized as the difference of the rounded running sum, kept as an exact
+    integer part plus a running sum of fractional parts.  The C loop picks up
+    different floating point noise, so if any running sum is close enough to
+    a rounding tie for that noise to matter (or values overflow int, which 
+    the C code saturates), the sequential recurrence is used instead.
+
+    :return: (n, e) integer array and the final rounding error
+    :rtype: (np.ndarray, float)
+    """
+    x = np.asarray(x, np.float64)
+    if len(x) == 0:
+        return np.zeros(0, np.int64), err
+
+    in_range = np.all(np.abs(x) < 2**30) and abs(err) < 2**30
+    if in_range:
+        whole = np.floor(x)
+        frac_sum = np.cumsum(x - whole) + err
+        eps = np.finfo(np.float64).eps
+        tol = 4 * len(x) * eps * (np.max(np.abs(x)) + len(x) + abs(err) + 1)
+        if not _near_tie(frac_sum, tol):
+            whole_sum = np.cumsum(whole)
+            c = whole_sum + np.floor(frac_sum + 0.5)
+            n = np.diff(c, prepend=0).astype(np.int64)
+            return n, float(whole_sum[-1] - c[-1] + frac_sum[-1])
+
+    n = np.empty(len(x), np.int64)
+    for i, xi in enumerate(x.tolist()):
+        v = xi + err
+        n[i] = _round_scalar(v)
+        err = v - n[i]
+    return n, err
+
+
+def calc_trigger(time):
+    """ trigger profile for a trajectory, as calc_trigger in motion.c.
+
+    Header word with the number of triggers, then the interval to each next
+    point in ms, rounded with the error carried to the next interval.
+
+    :param time: trajectory time points [s]
+    :rtype: np.ndarray (float64), len(time) elements
+    """
+    time = np.asarray(time, np.float64)
+    num_seg = len(time) - 1
+    if num_seg > MASK_TRIGGER_SEGMENTS:
+        logger.warning(f'calc_trigger: {num_seg} triggers do not fit the header')
+
+    intervals, _ = _carry_round(np.diff(time) * 1000.0)
+
+    trigger = np.empty(num_seg + 1, np.float64)
+    trigger[0] = num_seg & MASK_TRIGGER_SEGMENTS # time base: ms
+    trigger[1:] = intervals & 0xFFFFFFFF # (unsigned int)
+    return trigger
+
+
+def _segments_sequential(time, pos, res, st_err):
+    """ segment loop of calc_motion, one grid point at a time """
+    starts, ends, num_steps, step_time = [], [], [], []
+    t = time.tolist()
+    p = pos.tolist()
+    i, j = 0, 1
+    steps_err = 0.0
+    while i + j < len(p):
+        seg_time = (t[i + j] - t[i]) * 1000000.0
+        dist = abs(p[i + j] - p[i]) * res
+        steps = dist + steps_err
+        n = _round_scalar(steps)
+        if n < 1:
+            j += 1 # merge grid points until there is a step
+            continue
+        steps_err = steps - n
+
+        st = seg_time / dist + st_err
+        st_int = _round_scalar(st)
+        st_err = st - st_int
+
+        starts.append(i)
+        ends.append(i + j)
+        num_steps.append(n)
+        step_time.append(st_int)
+        i += j
+        j = 1
+    return (np.array(starts, np.int64), np.array(ends, np.int64),
+            np.array(num_steps, np.int64), np.array(step_time, np.int64),
+            st_err)
+
+
+def _segments(time, pos, res, st_err):
+    """ split a motion into segments of at least one motor step.
+
+    Grid points without a step are merged into the next segment, step counts
+    and initial step times are rounded with error carry.
+
+    :return: (starts, ends, num_steps, step_time, st_err), grid indices of
+             each segment, its step count and initial time between steps [us]
+    """
+    dpos = np.diff(pos)
+    monotonic = np.all(dpos >= 0) or np.all(dpos <= 0)
+    # for a monotonic motion the carried step count is the rounded distance
+    # from the start, a segment ends where it increases
+    dist = np.abs(pos - pos[0]) * res
+    tol = 4 * len(pos) * np.finfo(np.float64).eps * (np.max(np.abs(pos)) * res + 1)
+    if not monotonic or _near_tie(dist, tol):
+        return _segments_sequential(time, pos, res, st_err)
+
+    total = _round(dist)
+    ends = np.flatnonzero(np.diff(total) > 0) + 1
+    starts = np.concatenate([[0], ends[:-1]]).astype(np.int64)
+    num_steps = np.diff(total[np.concatenate([[0], ends])]).astype(np.int64)
+
+    seg_time = (time[ends] - time[starts]) * 1000000.0
+    step_time, st_err = _carry_round(
+                            seg_time / (np.abs(pos[ends] - pos[starts]) * res),
+                            st_err)
+    return starts, ends, num_steps, step_time, st_err
+
+
+def _pack_motion(num_steps, step_time, delta_step_time, ccw):
+    """ motion profile words: header, then two words per segment """
+    num_seg = len(num_steps)
+    words = np.zeros(2 * num_seg + 2, np.int64)
+    words[0] = num_seg & MASK_MOTION_SEGMENTS
+    if ccw:
+        words[0] |= 1 << 31 # initial direction: 0 - CW, 1 - CCW
+
+    step_time = (step_time - 1) & 0xFFFFFFFF # (unsigned int), less 1
+    words[2::2] = (((num_steps - 1) & 0x7fffff)          # steps, less 1
+                   | ((step_time & 0x1ff) << 23))        # interval, 9 LSBs
+    words[3::2] = (((step_time >> 9) & 0x7ff)            # interval, 11 MSBs
+                   | ((np.abs(delta_step_time) & 0xfffff) << 11)
+                   | np.where(delta_step_time < 0, 1 << 31, 0)) # accelerate
+    return words.astype(np.float64)
+
+
+def _axis_motion(time, pos, res, st_err, delta_err, seg_pos_steps):
+    """ segments, delta step times and packed words for one motor """
+    starts, ends, num_steps, step_time, st_err = _segments(time, pos, res,
+                                                            st_err)
+    num_seg = len(num_steps)
+    if num_seg > MASK_MOTION_SEGMENTS:
+        logger.warning(f'calc_motion: {num_seg} segments do not fit the header')
+
+    delta_step_time = np.zeros(num_seg, np.int64)
+    if num_seg > 0:
+        seg_time = (time[ends] - time[starts]) * 1000000.0
+        seg_steps = seg_pos_steps(pos, starts, num_seg)
+        seg_step_time = seg_time / seg_steps
+        delta_step_time[:-1], delta_err = _carry_round(
+                    (seg_step_time[1:] - seg_step_time[:-1]) / seg_steps[:-1],
+                    delta_err)
+    return num_steps, step_time, delta_step_time, st_err, delta_err
+
+
+def calc_motion(time, energy, crystal_d, crystal_gap, motor_res_phi,
+                motor_res_z):
+    """ phi and z motion profiles, as calc_motion in motion.c.
+
+    :param time: trajectory time points [s]
+    :param energy: trajectory energies [eV]
+    :param crystal_d: crystal lattice spacing [m]
+    :param crystal_gap: crystal gap [mm]
+    :param motor_res_phi: phi motor resolution [counts/deg]
+    :param motor_res_z: z motor resolution [counts/mm]
+    :return: (phi_motion, z_motion), each 2 * segments + 2 words
+    :rtype: (np.ndarray, np.ndarray)
+    """
+    time = np.asarray(time, np.float64)
+    phi = energy_to_angle(energy, crystal_d)
+    z = 2.0 * crystal_gap * _libm(math.cos, phi * PI / 180.0)
+
+    # steps per segment for the delta step time.  motion.c uses the segment
+    # start positions for phi (0 past the last one) but consecutive grid
+    # points for z, kept as is so profiles stay identical
+    def phi_steps(pos, starts, num_seg):
+        seg_pos = pos[starts]
+        return np.abs(np.append(seg_pos[1:], 0.0) - seg_pos) * motor_res_phi
+
+    def z_steps(pos, starts, num_seg):
+        return np.abs(pos[1:num_seg + 1] - pos[:num_seg]) * motor_res_z
+
+    # rounding errors of step and delta step times carry over from phi to z
+    *phi_segs, st_err, delta_err = _axis_motion(time, phi, motor_res_phi,
+                                                0.0, 0.0, phi_steps)
+    *z_segs, _, _ = _axis_motion(time, z, motor_res_z, st_err, delta_err,
+                                 z_steps)
+
+    return (_pack_motion(*phi_segs, ccw=True),
+            _pack_motion(*z_segs, ccw=False))
+
+
+def compile_trajectory(time, energy, crystal_d, crystal_gap,
+                       motor_res_phi, motor_res_z):
+    """ trigger and motion profiles for a trajectory.
+
+    :return: trigger, phi and z profiles, zero padded to PROFILE_LENGTH (or
+             longer if needed), and their used lengths
+    :rtype: dict
+    """
+    trigger = calc_trigger(time)
+    phi, z = calc_motion(time, energy, crystal_d, crystal_gap,
+                         motor_res_phi, motor_res_z)
+
+    out = {}
+    for key, profile in [('trigger', trigger), ('phi', phi), ('z', z)]:
+        padded = np.zeros(max(PROFILE_LENGTH, len(profile)), np.float64)
+        padded[:len(profile)] = profile
+        out[key] = padded
+        out[f'{key}_len'] = np.array([len(profile)], np.uint32)
+    return out
+
+
+def compile_trajectory_c(time, energy, crystal_d, crystal_gap,
+                         motor_res_phi, motor_res_z):
+    """ reference implementation, CalcTrigger and CalcMotion from motion.so.
+    Limited to PROFILE_LENGTH elements.
+
+    :return: same as compile_trajectory
+    :rtype: dict
+    """
+    fpga_motion_lib = ctypes.cdll.LoadLibrary(so_motion_path)
+    time = np.ascontiguousarray(time, np.float64)
+    energy = np.ascontiguousarray(energy, np.float64)
+
+    out = {'trigger':     np.zeros(PROFILE_LENGTH, np.float64),
+           'phi':         np.zeros(PROFILE_LENGTH, np.float64),
+           'z':           np.zeros(PROFILE_LENGTH, np.float64),
+           'trigger_len': np.zeros(1, np.uint32),
+           'phi_len':     np.zeros(1, np.uint32),
+           'z_len':       np.zeros(1, np.uint32)}
+    last_error_code = np.zeros(1, np.int32)
+
+    fpgaTrigger = FpgaTrigger(  np.ctypeslib.as_ctypes(time),
+                                np.ctypeslib.as_ctypes(energy),
+                                len(time),
+
+                                np.ctypeslib.as_ctypes(out['trigger']),
+                                np.ctypeslib.as_ctypes(out['trigger_len']),
+
+                                np.ctypeslib.as_ctypes(last_error_code))
+
+    # C function call, determine trigger details
+    fpga_motion_lib.restype = None
+    fpga_motion_lib.CalcTrigger(ctypes.byref(fpgaTrigger))
+
+    fpgaMotion = FpgaMotion(    np.ctypeslib.as_ctypes(time),
+                                np.ctypeslib.as_ctypes(energy),
+                                len(time),
+
+                                crystal_d, crystal_gap,
+                                motor_res_phi, motor_res_z,
+
+                                np.ctypeslib.as_ctypes(out['phi']),
+                                np.ctypeslib.as_ctypes(out['phi_len']),
+
+                                np.ctypeslib.as_ctypes(out['z']),
+                                np.ctypeslib.as_ctypes(out['z_len']),
+
+                                np.ctypeslib.as_ctypes(last_error_code))
+
+    # C function call, calculate motion profile
+    fpga_motion_lib.restype = None
+    fpga_motion_lib.CalcMotion(ctypes.byref(fpgaMotion))
+
+    return out
+
+
+def _cache_key(raw, params):
+    h = hashlib.sha256(raw)
+    h.update(json.dumps({'version': CACHE_VERSION, **params},
+                        sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def load_compiled_trajectory(path, **params):
+    """ compiled trigger / motion profiles for the trajectory at ``path``,
+    from the '.npz' cache when the file and parameters are unchanged.
+
+    :param path: .tra file
+    :param params: overrides for MOTION_PARAMS
+    :return: 'time', 'energy', 'trigger', 'phi', 'z', their lengths
+             ('trigger_len', ...), 'header' (dict) and 'key' (cache key)
+    :rtype: dict
+    """
+    path = Path(path)
+    params = {**MOTION_PARAMS, **params}
+    raw = path.read_bytes()
+    key = _cache_key(raw, params)
+    # the bundled .tra files may sit in a read-only checkout
+    cache_path = trajectory_cache_dir() / f'{path.stem}-{key[:16]}.npz'
+
+    try:
+        with np.load(cache_path, allow_pickle=False) as cached:
+            if str(cached['key']) == key:
+                traj = {k: cached[k] for k in cached.files if k != 'header'}
+                traj['header'] = json.loads(str(cached['header']))
+                traj['key'] = key
+                logger.info(f'trajectory cache hit: {cache_path}')
+                return traj
+    except (OSError, KeyError, ValueError):
+        pass # no or unreadable cache, compile
+
+    header, time, energy = read_trajectory(path)
+    traj = compile_trajectory(time, energy, **params)
+    traj.update(time=time, energy=energy)
+
+    try:
+        # write then rename, never leave a partial cache behind
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, key=key, header=json.dumps(header), **traj)
+        tmp_path.replace(cache_path)
+    except OSError as err:
+        logger.warning(f'could not write trajectory cache {cache_path}: {err}')
+
+    traj.update(header=header, key=key)
+    return traj
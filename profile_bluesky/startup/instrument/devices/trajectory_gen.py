@@ -0,0 +1,176 @@
+"""
+Generate .tra trajectories from edge parameters
+
+Points are dense near the edge and sparse elsewhere: uniform energy steps
+over the pre-edge and XANES, uniform k steps over the EXAFS.  Dwell time per
+point follows a k-weight in the EXAFS so high k (weak signal) gets more time,
+and the whole spectrum is scaled to a time budget.  Segments are slowed
+down where the phi motor would exceed its velocity or acceleration limit.
+
+time, energy = generate_trajectory(7708.9, k_end=12, total_time=120,
+                                   **phi_limits(flyer100E.phi),
+                                   path='Co_EXAFS_k12_120s.tra')
+"""
+
+__all__ = ['energy_to_k', 'k_to_energy', 'phi_limits', 'generate_trajectory']
+
+import logging
+
+import numpy as np
+
+from .trajectory import MOTION_PARAMS, energy_to_angle, write_trajectory
+
+logger = logging.getLogger()
+
+# k^2 [1/A^2] = ETOK * (E - E0) [eV], 2 m_e / hbar^2
+ETOK = 0.2624682917
+
+
+def energy_to_k(energy, edge_energy):
+    """ photoelectron wavenumber [1/A], 0 below the edge """
+    return np.sqrt(np.clip(ETOK * (np.asarray(energy) - edge_energy), 0, None))
+
+
+def k_to_energy(k, edge_energy):
+    """ energy [eV] for photoelectron wavenumber ``k`` [1/A] """
+    return edge_energy + np.asarray(k) ** 2 / ETOK
+
+
+def _energy_grid(edge_energy, pre_edge, pre_edge_step, xanes_end, xanes_step,
+                 k_end, k_step):
+    """ energies and a region label per point (0: pre-edge, 1: XANES,
+    2: EXAFS)
+    """
+    pre = edge_energy + np.arange(pre_edge[0], pre_edge[1], pre_edge_step)
+    xanes = edge_energy + np.arange(pre_edge[1], xanes_end, xanes_step)
+    regions = [pre, xanes]
+    if k_end is not None:
+        k_start = float(energy_to_k(edge_energy + xanes_end, edge_energy))
+        exafs = k_to_energy(np.arange(k_start, k_end + k_step / 2, k_step),
+                            edge_energy)
+        regions.append(exafs)
+    else:
+        regions[-1] = np.append(xanes, edge_energy + xanes_end)
+
+    energy = np.concatenate(regions)
+    label = np.concatenate([np.full(len(r), i) for i, r in enumerate(regions)])
+    return energy, label
+
+
+def phi_limits(motor):
+    """ velocity and acceleration limits of the phi motor, as keyword
+    arguments for generate_trajectory
+
+    :param motor: phi motor, e.g. ``flyer100E.phi``
+    :type motor: CXASEpicsMotor
+    :return: {'max_phi_velocity': VELO [deg/s],
+              'max_phi_acceleration': VELO / ACCL [deg/s^2]}
+    :rtype: dict
+    """
+    velocity = motor.velocity.get()
+    accel_time = motor.acceleration.get() # .ACCL, s to reach VELO
+    return {'max_phi_velocity': velocity,
+            'max_phi_acceleration': (velocity / accel_time if accel_time > 0
+                                     else np.inf)}
+
+def _limit_acceleration(dt, dphi, max_acceleration):
+    """ lengthen segments so the phi speed changes by at most
+    ``max_acceleration`` per second, forward then backward pass
+    """
+    dt = dt.copy()
+    for order in (range(len(dt)), reversed(range(len(dt)))):
+        v_prev = None
+        for i in order:
+            v = dphi[i] / dt[i]
+            if v_prev is not None:
+                # largest v with (v - v_prev) <= a * dphi / v
+                v_max = (v_prev + np.sqrt(v_prev**2
+                                          + 4 * max_acceleration * dphi[i])) / 2
+                if v > v_max:
+                    v = v_max
+                    dt[i] = dphi[i] / v
+            v_prev = v
+    return dt
+
+
+def generate_trajectory(edge_energy, *, pre_edge=(-150, -20), pre_edge_step=5.0,
+                        xanes_end=50, xanes_step=0.3, k_end=12, k_step=0.05,
+                        k_weight=1, pre_edge_weight=1, xanes_weight=1,
+                        total_time=60, min_dwell=0.002,
+                        max_phi_velocity=None, max_phi_acceleration=None,
+                        crystal_d=MOTION_PARAMS['crystal_d'], path=None):
+    """ build a trajectory for one absorption edge.
+
+    :param edge_energy: edge energy E0 [eV]
+    :param pre_edge: (start, end) of the pre-edge, relative to E0 [eV]
+    :param pre_edge_step: pre-edge energy step [eV]
+    :param xanes_end: end of the XANES region, relative to E0 [eV]
+    :param xanes_step: XANES energy step [eV]
+    :param k_end: end of the EXAFS region [1/A], None for XANES only
+    :param k_step: EXAFS k step [1/A]
+    :param k_weight: EXAFS dwell time grows as k**k_weight
+    :param pre_edge_weight: relative dwell time per pre-edge point
+    :param xanes_weight: relative dwell time per XANES point
+    :param total_time: time budget for the whole spectrum [s]
+    :param min_dwell: shortest time per point [s]
+    :param max_phi_velocity: phi speed limit [deg/s], required, see
+                             phi_limits().  np.inf to not check
+    :type max_phi_velocity: float
+    :param max_phi_acceleration: phi acceleration limit [deg/s^2], required,
+                                 see phi_limits().  np.inf to not check
+    :type max_phi_acceleration: float
+    :param crystal_d: crystal lattice spacing [m]
+    :param path: also write the trajectory to this .tra file
+    :type path: str or Path, optional
+    :return: (time, energy)
+    :rtype: (np.ndarray, np.ndarray)
+    """
+    if max_phi_velocity is None or max_phi_acceleration is None:
+        raise ValueError('generate_trajectory needs the phi motor limits, '
+                         'pass **phi_limits(flyer100E.phi) or '
+                         'max_phi_velocity / max_phi_acceleration')
+
+    energy, label = _energy_grid(edge_energy, pre_edge, pre_edge_step,
+                                 xanes_end, xanes_step, k_end, k_step)
+    phi = energy_to_angle(energy, crystal_d)
+    if np.any(phi == 0) or np.any(np.isnan(phi)):
+        raise ValueError('energy range not reachable with crystal_d '
+                         f'{crystal_d}')
+    dphi = np.abs(np.diff(phi))
+
+    # relative dwell time per segment, by the region of its end point
+    weight = np.where(label[1:] == 0, float(pre_edge_weight),
+                      float(xanes_weight))
+    if k_end is not None:
+        k = energy_to_k(energy[1:], edge_energy)
+        k_start = energy_to_k(edge_energy + xanes_end, edge_energy)
+        weight = np.where(label[1:] == 2, (k / k_start) ** k_weight, weight)
+    target = total_time * weight / weight.sum()
+
+    # lower bounds from the trigger and motor limits, then give the time
+    # left over to the unconstrained segments
+    scale = 1.0
+    for _ in range(50):
+        dt = np.maximum(target * scale, min_dwell)
+        if max_phi_velocity:
+            dt = np.maximum(dt, dphi / max_phi_velocity)
+        if max_phi_acceleration:
+            dt = _limit_acceleration(dt, dphi, max_phi_acceleration)
+
+        constrained = dt > target * scale
+        free_time = total_time - dt[constrained].sum()
+        if abs(dt.sum() - total_time) <= 1e-9 * total_time:
+            break
+        if free_time <= 0 or not np.any(~constrained):
+            logger.warning('generate_trajectory: time budget too short for '
+                           f'the motor limits, needs {dt.sum():.1f} s')
+            break
+        scale *= free_time / (target[~constrained] * scale).sum()
+
+    time = np.concatenate([[0.0], np.cumsum(dt)])
+    logger.info(f'generate_trajectory: {len(time)} points, {time[-1]:.1f} s, '
+                f'{energy[0]:.1f}-{energy[-1]:.1f} eV')
+
+    if path is not None:
+        write_trajectory(path, time, energy, crystal_d)
+    return time, energy
@@ -5,9 +5,11 @@ xspress3 configuration
 __all__ = ['xsp3', ]
 
 from collections import OrderedDict, deque
-import itertools
+import logging
 import time as ttime
 
+import numpy as np
+
 from ophyd import Component as Cpt
 from ophyd.sim import NullStatus  # TODO: remove after complete/collect are defined
 from ophyd.areadetector.plugins import PluginBase
@@ -15,8 +17,9 @@ from ssrltools.devices.xspress3 import (Xspress3Channel, Xspress3FileStore,
 										XspressTrigger, Xspress3Detector)
 from ophyd import Signal
 
-from ..session_logs import logger
+from .lazy import registry
 
+logger = logging.getLogger()
 logger.info(__file__)
 
 class CXASXspress3Detector(XspressTrigger, Xspress3Detector):
@@ -42,6 +45,7 @@ class CXASXspress3Detector(XspressTrigger, Xspress3Detector):
 
         self._asset_docs_cache = deque()
         self._datum_counter = None
+        self._datum_ids = np.empty((0, 0), dtype=object)
 
     def trigger(self):
         if self.hdf5.capture.get() == 0:
@@ -69,7 +73,7 @@ class CXASXspress3Detector(XspressTrigger, Xspress3Detector):
             raise NotImplementedError(
                 "multi spectra per point not supported yet")
         ret = super().stage()
-        self._datum_counter = itertools.count()
+        self._datum_counter = 0
         return ret
 
     def unstage(self):
@@ -77,23 +81,38 @@ class CXASXspress3Detector(XspressTrigger, Xspress3Detector):
         super().unstage()
         self._datum_counter = None
 
+    def _generate_datum_pages(self, num_frames):
+        """ one DatumPage per channel for ``num_frames`` frames, ids are 
+        '<resource>/<n>' with n counting frame by frame, channel by channel.
+        Ids are kept as a (frame, channel) array for ``datum_ids()``
+        """
+        resource_uid = self.hdf5._resource_uid
+        channels = list(self.hdf5.channels)  # Channels (1, 2) as of 03/04/2020
+
+        start = self._datum_counter
+        stop = start + num_frames * len(channels)
+        self._datum_counter = stop
+        counter = np.arange(start, stop).reshape(num_frames, len(channels))
+        ids = np.char.add(f'{resource_uid}/', counter.astype(str))
+        self._datum_ids = ids.astype(object)
+
+        frames = list(range(num_frames))
+        for i, channel_num in enumerate(channels):
+            datum_page = {'resource': resource_uid,
+                          'datum_id': self._datum_ids[:, i].tolist(),
+                          'datum_kwargs': {'frame': frames,
+                                           'channel': [channel_num] * num_frames}}
+            self._asset_docs_cache.append(('datum_page', datum_page))
+
+    def datum_ids(self, start, stop):
+        """ datum ids of frames [start, stop), shape (frames, channels) """
+        return self._datum_ids[start:stop]
+
     def complete(self, *args, **kwargs):
         for resource in self.hdf5._asset_docs_cache:
             self._asset_docs_cache.append(('resource', resource[1]))
 
-        self._datum_ids = []
-
-        num_frames = self.hdf5.num_captured.get()
-
-        for frame_num in range(num_frames):
-            for channel_num in self.hdf5.channels:  # Channels (1, 2) as of 03/04/2020
-                datum_id = '{}/{}'.format(self.hdf5._resource_uid, next(self._datum_counter))
-                datum = {'resource': self.hdf5._resource_uid,
-                         'datum_kwargs': {'frame': frame_num,
-                                          'channel': channel_num},
-                         'datum_id': datum_id}
-                self._asset_docs_cache.append(('datum', datum))
-                self._datum_ids.append(datum_id)
+        self._generate_datum_pages(self.hdf5.num_captured.get())
 
         return NullStatus()
 
@@ -107,24 +126,12 @@ class CXASXspress3Detector(XspressTrigger, Xspress3Detector):
         for resource in self.hdf5._asset_docs_cache:
             self._asset_docs_cache.append(('resource', resource[1]))
 
-        self._datum_ids = []
-
-
-        for n in range(self.total_points.get().item()):
-            for channel_num in self.hdf5.channels:  # Channels (1, 2) as of 03/04/2020
-                datum_id = '{}/{}'.format(self.hdf5._resource_uid, next(self._datum_counter))
-                datum = {'resource': self.hdf5._resource_uid,
-                         'datum_kwargs': {'frame': n,
-                                          'channel': channel_num},
-                         'datum_id': datum_id}
-                self._asset_docs_cache.append(('datum', datum))
-                self._datum_ids.append(datum_id)
-
+        self._generate_datum_pages(self.total_points.get().item())
 
     def collect(self):
         now = ttime.time()
         print(f'now: {now}')
-        for datum_id in self._datum_ids:
+        for datum_id in self._datum_ids.ravel():
             data = {self.name: datum_id}
             yield {'data': data,
                    'timestamps': {key: now for key in data}, 'time': now,  # TODO: use the proper timestams from the mono start and stop times
@@ -141,42 +148,48 @@ class CXASXspress3Detector(XspressTrigger, Xspress3Detector):
         for item in items:
             yield item
 
-xsp3 = CXASXspress3Detector('XSPRESS3-EXAMPLE:', name='xsp3', roi_sums=True)
-
-# bp=blueskyplans, imported by nslsii startup configuration, 
-xsp3.settings.configuration_attrs = ['acquire_period',
-			           'acquire_time',
-			           'gain',
-			           'image_mode',
-			           'manufacturer',
-			           'model',
-			           'num_exposures',
-			           'num_images',
-			           'temperature',
-			           'temperature_actual',
-			           'trigger_mode',
-			           'config_path',
-			           'config_save_path',
-			           'invert_f0',
-			           'invert_veto',
-			           'xsp_name',
-			           'num_channels',
-			           'num_frames_config',
-			           'run_flags',
-                        'trigger_signal']
-
-for n, d in xsp3.channels.items():
-    roi_names = ['roi{:02}'.format(j) for j in [1, 2, 3, 4, 5, 6, 7]]
-    d.rois.read_attrs = roi_names
-    d.rois.configuration_attrs = roi_names
-    for roi_n in roi_names:
-        getattr(d.rois, roi_n).value_sum.kind = 'omitted'
-
-# set up ROI hints for best effort callback
-xsp3.channel1.rois.roi01.value.kind = 'hinted'
-xsp3.channel1.rois.roi02.value.kind = 'hinted'
-xsp3.channel1.rois.roi03.value.kind = 'hinted'
-xsp3.channel1.rois.roi04.value.kind = 'hinted'
-
-xsp3.hdf5.warmup()
-xsp3.external_trig.put(True)
+def _make_xsp3():
+    xsp3 = CXASXspress3Detector('XSPRESS3-EXAMPLE:', name='xsp3', roi_sums=True)
+
+    # bp=blueskyplans, imported by nslsii startup configuration, 
+    xsp3.settings.configuration_attrs = ['acquire_period',
+                                         'acquire_time',
+                                         'gain',
+                                         'image_mode',
+                                         'manufacturer',
+                                         'model',
+                                         'num_exposures',
+                                         'num_images',
+                                         'temperature',
+                                         'temperature_actual',
+                                         'trigger_mode',
+                                         'config_path',
+                                         'config_save_path',
+                                         'invert_f0',
+                                         'invert_veto',
+                                         'xsp_name',
+                                         'num_channels',
+                                         'num_frames_config',
+                                         'run_flags',
+                                         'trigger_signal']
+
+    for n, d in xsp3.channels.items():
+        roi_names = ['roi{:02}'.format(j) for j in [1, 2, 3, 4, 5, 6, 7]]
+        d.rois.read_attrs = roi_names
+        d.rois.configuration_attrs = roi_names
+        for roi_n in roi_names:
+            getattr(d.rois, roi_n).value_sum.kind = 'omitted'
+
+    # set up ROI hints for best effort callback
+    xsp3.channel1.rois.roi01.value.kind = 'hinted'
+    xsp3.channel1.rois.roi02.value.kind = 'hinted'
+    xsp3.channel1.rois.roi03.value.kind = 'hinted'
+    xsp3.channel1.rois.roi04.value.kind = 'hinted'
+    return xsp3
+
+def _setup_xsp3(xsp3):
+    """ blocking IOC-side setup, deferred until xsp3 is first used """
+    xsp3.hdf5.warmup()
+    xsp3.external_trig.put(True)
+
+xsp3 = registry.declare('xsp3', _make_xsp3, first_use=_setup_xsp3)
@@ -1,6 +1,5 @@
-from .check_python import *
-from .check_bluesky import *
+"""
+Bluesky framework
 
-from .initialize import *
-from .metadata import *
-from .user_dir import *
\ No newline at end of file
+Import modules directly, the session re-exports are set up in collection.py
+"""
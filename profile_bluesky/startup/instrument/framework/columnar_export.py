@@ -0,0 +1,266 @@
+'''
+Columnar export of fly scan streams
+
+Each selected stream of a run becomes one Parquet file (pyarrow) with one
+row group per event page, or, without pyarrow, a directory of uncompressed
+.npz files, one per page.  Columns keep their dtype, array valued keys
+(spectra) become fixed size lists / 2D arrays.  Both read back memory
+mapped:
+
+serializer = ColumnarSerializer('/bluedata/b_mehta/export/columnar/')
+for name, doc in hdr.documents(fill=True):
+    serializer(name, doc)
+serializer.close()
+
+pages = load_columnar('/bluedata/.../Scan12-flyer.parquet') # [{key: array}]
+data = load_columnar('/bluedata/.../Scan12-flyer', join=True) # copied
+'''
+
+__all__ = ['ColumnarSerializer', 'load_columnar', 'HAVE_PYARROW']
+
+import json
+import logging
+from pathlib import Path
+import struct
+import zipfile
+
+import numpy as np
+from event_model import DocumentRouter, pack_event_page
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+logger = logging.getLogger()
+
+STREAMS = ('flyer', 'DXP_100E')
+
+
+def _page_columns(page):
+    ''' {column: np.ndarray} of an event page, time and seq_num first '''
+    columns = {'time': np.asarray(page['time'], dtype=np.float64),
+               'seq_num': np.asarray(page['seq_num'], dtype=np.int64)}
+    for key, values in page['data'].items():
+        array = np.asarray(values)
+        if array.dtype == object:
+            try:
+                array = array.astype(str) # datum ids
+            except (TypeError, ValueError):
+                logger.warning(f'columnar export: skipping ragged key {key}')
+                continue
+        columns[key] = array
+    return columns
+
+
+class _ParquetStream:
+    ''' one Parquet file, one row group per page '''
+    suffix = '.parquet'
+
+    def __init__(self, path, metadata):
+        self.path = Path(str(path) + self.suffix)
+        self.metadata = metadata
+        self._writer = None
+        self._shapes = {}
+
+    def write(self, columns):
+        arrays = []
+        for key, array in columns.items():
+            if array.ndim > 1:
+                self._shapes[key] = list(array.shape[1:])
+                width = int(np.prod(array.shape[1:]))
+                flat = pa.array(np.ascontiguousarray(array).reshape(-1))
+                arrays.append(pa.FixedSizeListArray.from_arrays(flat, width))
+            else:
+                arrays.append(pa.array(array))
+        table = pa.Table.from_arrays(arrays, names=list(columns))
+
+        if self._writer is None:
+            meta = dict(self.metadata, shapes=self._shapes)
+            schema = table.schema.with_metadata(
+                            {b'bluesky': json.dumps(meta, default=str)})
+            self._writer = pq.ParquetWriter(self.path, schema)
+        self._writer.write_table(table.replace_schema_metadata(
+                                    self._writer.schema.metadata),
+                                 row_group_size=len(table))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class _NpzStream:
+    ''' a directory of uncompressed page_NNNNN.npz files '''
+    suffix = ''
+
+    def __init__(self, path, metadata):
+        self.path = Path(path)
+        self.metadata = metadata
+        self._num_pages = 0
+
+    def write(self, columns):
+        self.path.mkdir(parents=True, exist_ok=True)
+        if not self._num_pages:
+            with open(self.path / 'metadata.json', 'w') as f:
+                json.dump(self.metadata, f, default=str)
+        # np.savez stores without compression, so pages can be memory mapped
+        np.savez(self.path / f'page_{self._num_pages:05d}.npz', **columns)
+        self._num_pages += 1
+
+    def close(self):
+        pass
+
+
+class ColumnarSerializer(DocumentRouter):
+    '''Writes the selected streams of a run as typed columns.
+
+    Event pages are written as they arrive, single events are gathered into
+    pages of ``page_size`` rows.
+    '''
+    def __init__(self, directory, file_prefix='Scan{start[scan_id]}-',
+                 streams=STREAMS, page_size=1000, use_pyarrow=None):
+        '''
+        :param directory: export directory
+        :param file_prefix: formatted with the start document
+        :param streams: stream names to export, None for all
+        :type streams: tuple, optional
+        :param page_size: rows per page when events come one by one
+        :param use_pyarrow: force the Parquet (True) or .npz (False) format,
+                            defaults to Parquet if pyarrow is installed
+        '''
+        super().__init__()
+        self.directory = Path(directory)
+        self.file_prefix = file_prefix
+        self.streams = None if streams is None else set(streams)
+        self.page_size = page_size
+        if use_pyarrow is None:
+            use_pyarrow = HAVE_PYARROW
+        elif use_pyarrow and not HAVE_PYARROW:
+            raise ImportError('pyarrow is needed for Parquet export')
+        self._stream_class = _ParquetStream if use_pyarrow else _NpzStream
+
+        self._start = None
+        self._descriptors = {} # uid: descriptor, selected streams only
+        self._writers = {} # descriptor uid: stream writer
+        self._stream_counts = {} # stream name: number of writers
+        self._events = {} # descriptor uid: [event], not yet written
+        self.artifacts = []
+
+    def start(self, doc):
+        self._start = doc
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def descriptor(self, doc):
+        if self.streams is None or doc['name'] in self.streams:
+            self._descriptors[doc['uid']] = doc
+
+    def _writer(self, descriptor_uid):
+        if descriptor_uid not in self._writers:
+            descriptor = self._descriptors[descriptor_uid]
+            prefix = self.file_prefix.format(start=self._start)
+            # several descriptors of one stream get numbered files
+            n = self._stream_counts.get(descriptor['name'], 0)
+            self._stream_counts[descriptor['name']] = n + 1
+            name = prefix + descriptor['name'] + (f'-{n}' if n else '')
+            metadata = {'run_uid': self._start['uid'],
+                        'stream': descriptor['name'],
+                        'descriptor_uid': descriptor_uid,
+                        'data_keys': descriptor['data_keys']}
+            writer = self._stream_class(self.directory / name, metadata)
+            self._writers[descriptor_uid] = writer
+            self.artifacts.append(writer.path)
+        return self._writers[descriptor_uid]
+
+    def event_page(self, doc):
+        if doc['descriptor'] not in self._descriptors:
+            return
+        self._flush(doc['descriptor'])
+        if len(doc['seq_num']):
+            self._writer(doc['descriptor']).write(_page_columns(doc))
+
+    def event(self, doc):
+        if doc['descriptor'] not in self._descriptors:
+            return
+        events = self._events.setdefault(doc['descriptor'], [])
+        events.append(doc)
+        if len(events) >= self.page_size:
+            self._flush(doc['descriptor'])
+
+    def _flush(self, descriptor_uid):
+        events = self._events.pop(descriptor_uid, None)
+        if events:
+            page = pack_event_page(*events)
+            self._writer(descriptor_uid).write(_page_columns(page))
+
+    def stop(self, doc):
+        self.close()
+
+    def close(self):
+        for descriptor_uid in list(self._events):
+            self._flush(descriptor_uid)
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
+
+
+def _mmap_npz(path):
+    ''' memory map every array of an uncompressed .npz '''
+    arrays = {}
+    with zipfile.ZipFile(path) as zf, open(path, 'rb') as f:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f'{path} is compressed, cannot memory map')
+            # local header: 30 bytes, then file name and extra field
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack('<HH', f.read(4))
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            read_header = (np.lib.format.read_array_header_1_0
+                           if version == (1, 0)
+                           else np.lib.format.read_array_header_2_0)
+            shape, fortran, dtype = read_header(f)
+            arrays[info.filename[:-len('.npy')]] = np.memmap(
+                    path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                    order='F' if fortran else 'C')
+    return arrays
+
+
+def load_columnar(path, join=False):
+    ''' read back one exported stream, one dict per page.  .npz pages are
+    memory mapped, Parquet row groups are read from a memory mapped file.
+
+    :param path: .parquet file or .npz page directory
+    :param join: return a single dict with the pages concatenated, this
+                 copies the data into memory
+    :return: [{column: np.ndarray}] per page, or {column: np.ndarray} if
+             ``join``, array columns as 2D (or more) arrays
+    '''
+    path = Path(path)
+    if path.suffix == '.parquet':
+        pf = pq.ParquetFile(path, memory_map=True)
+        meta = json.loads(pf.schema_arrow.metadata[b'bluesky'])
+        groups = [None] if join else range(pf.num_row_groups)
+        result = []
+        for i in groups:
+            table = pf.read() if i is None else pf.read_row_group(i)
+            columns = {}
+            for key in table.column_names:
+                column = table.column(key).combine_chunks()
+                if key in meta['shapes']:
+                    columns[key] = column.flatten().to_numpy(
+                        zero_copy_only=False).reshape([-1] + meta['shapes'][key])
+                else:
+                    columns[key] = column.to_numpy(zero_copy_only=False)
+            result.append(columns)
+        return result[0] if join else result
+
+    result = [_mmap_npz(p) for p in sorted(path.glob('page_*.npz'))]
+    if not join:
+        return result
+    if not result:
+        return {}
+    return {key: np.concatenate([page[key] for page in result])
+            for key in result[0]}
@@ -2,47 +2,211 @@
 Batch export functions (csv summaries, primarily)
 
 Since csv doesn't work live.
+
+Runs are exported in parallel worker processes, each run's documents are
+read once and fed to the csv, tiff, json and columnar (columnar_export.py)
+serializers together.  A manifest in the export directory records every
+exported run uid with a hash of its start and stop documents and the files
+written, so exporting the same query again only touches new or changed
+(e.g. finished since) runs.  A run is exported into a staging directory
+first and its files then replace the previous export of that run.
 '''
 
-from itertools import tee
-import suitcase.csv as sc
-import suitcase.tiff_series as ts
+__all__ = ['std_exporter', 'my_exporter', 'load_manifest']
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import shutil
+import time as ttime
+
 import suitcase.csv
+import suitcase.json_metadata
+import suitcase.tiff_series
 
 from databroker import Broker
 
+from .columnar_export import ColumnarSerializer
+
+MANIFEST_NAME = 'export_manifest.json'
+MANIFEST_INTERVAL = 5 # s between manifest writes during an export
+
+_brokers = {} # per worker process
+
+
 def std_exporter(docs, directory):
     '''
-    Batch exporter for data.  
+    Batch exporter for data.
 
-    docs: documents from a Bluesky Run.  
+    docs: documents from a Bluesky Run.
 
     directory: Parent directory where exported files will be written to.
                 Files will be further separated into subdirectories
     '''
+    serializers = [
+        suitcase.csv.Serializer(directory, file_prefix='scan/Scan{start[scan_id]}-'),
+        suitcase.tiff_series.Serializer(directory, file_prefix='tiff/Scan{start[scan_id]}-'),
+        suitcase.json_metadata.Serializer(directory, file_prefix='meta/Scan{start[scan_id]}-'),
+        ColumnarSerializer(Path(directory) / 'columnar'),
+    ]
+    try:
+        for name, doc in docs:
+            for serializer in serializers:
+                serializer(name, doc)
+    finally:
+        for serializer in serializers:
+            serializer.close()
+
+
+def run_hash(start, stop):
+    ''' content hash of a run, changes when the run is finished or its
+    metadata edited
+    '''
+    text = json.dumps([start, stop], sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def load_manifest(parent_directory):
+    ''' {run uid: {'hash', 'scan_id', 'exported', 'artifacts'}} of previous
+    exports, artifacts relative to ``parent_directory``
+    '''
+    path = Path(parent_directory) / MANIFEST_NAME
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(parent_directory, manifest):
+    path = Path(parent_directory) / MANIFEST_NAME
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _export_uid(broker_name, handlers, uid, directory, old_artifacts=()):
+    ''' worker process: export one run by uid.
+
+    The serializers refuse to overwrite files, so the run is written to a
+    staging directory, the files of its previous export are removed and the
+    new ones moved into place.
+
+    :param old_artifacts: files of the previous export, relative to
+                          ``directory``
+    :return: files written, relative to ``directory``
+    :rtype: list
+    '''
+    if broker_name not in _brokers:
+        # one connection per worker process, reused for all its runs
+        broker = Broker.named(broker_name)
+        for spec, handler in handlers.items():
+            broker.reg.register_handler(spec, handler, overwrite=True)
+        _brokers[broker_name] = broker
+    hdr = _brokers[broker_name][uid]
+
+    directory = Path(directory)
+    staging = directory / f'.export-{uid}'
+    shutil.rmtree(staging, ignore_errors=True)
+    try:
+        std_exporter(hdr.documents(fill=True), staging)
+        artifacts = sorted(str(p.relative_to(staging))
+                           for p in staging.rglob('*') if p.is_file())
+        for name in set(old_artifacts) - set(artifacts):
+            try:
+                (directory / name).unlink()
+            except FileNotFoundError:
+                pass
+        for name in artifacts:
+            (directory / name).parent.mkdir(parents=True, exist_ok=True)
+            os.replace(staging / name, directory / name)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return artifacts
 
-    docs1, docs2, docs3 = tee(docs, 3)
-    suitcase.csv.export(docs1, directory, 'scan/Scan{start[scan_id]}-')
-    suitcase.tiff_series.export(docs2, directory, 'tiff/Scan{start[scan_id]}-')
-    suitcase.json_metadata.export(docs3, directory, 'meta/Scan{start[scan_id]}-')
 
-def my_exporter(db, query, parent_directory):
+def my_exporter(db, query, parent_directory, max_workers=None, force=False):
     '''
     Batch exports data, given a database and a query
 
+    Only runs that are new or changed since the last export into
+    ``parent_directory`` are exported, unless ``force``.  Runs that have
+    not finished are skipped.
 
     Example queries:
-    
+
     my_exporter(db, 'plan_name="scan"', 'export/')
     my_exporter(db, 'motor="s_stage.pz"', 'export/')
 
-
+    :param db: broker, or the name to open it with ``Broker.named``
+    :param max_workers: export processes, defaults to the cpu count
+    :return: {'exported': [uid], 'skipped': [uid], 'failed': {uid: error}}
+    :rtype: dict
     '''
+    broker_name = db if isinstance(db, str) else db.name
+    if isinstance(db, str):
+        db = Broker.named(db)
+    Path(parent_directory).mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(parent_directory)
+
+    todo = {}
+    result = {'exported': [], 'skipped': [], 'failed': {}}
     try:
         for hdr in db(query):
-            print(f'-- exporting hdr: {hdr.start["scan_id"]}')
-            std_exporter()
-
+            uid = hdr.start['uid']
+            if hdr.stop is None:
+                print(f'-- skipping unfinished hdr: {hdr.start["scan_id"]}')
+                continue
+            digest = run_hash(hdr.start, hdr.stop)
+            if not force and manifest.get(uid, {}).get('hash') == digest:
+                result['skipped'].append(uid)
+                continue
+            todo[uid] = (hdr.start.get('scan_id'), digest)
     except Exception as e:
         print('Query was ')
-        print(e)
\ No newline at end of file
+        print(e)
+        return result
+
+    print(f'-- exporting {len(todo)} runs, {len(result["skipped"])} '
+          'already exported')
+    if not todo:
+        return result
+
+    # handlers registered in this session, e.g. DXP_HDF5
+    handlers = dict(getattr(db.reg, 'handler_reg', {}))
+    # spawned, a fork would inherit locks held by the session's threads
+    context = multiprocessing.get_context('spawn')
+    last_write = ttime.monotonic()
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=context) as pool:
+        futures = {pool.submit(_export_uid, broker_name, handlers, uid,
+                               str(parent_directory),
+                               manifest.get(uid, {}).get('artifacts', ())): uid
+                   for uid in todo}
+        try:
+            for future in as_completed(futures):
+                uid = futures[future]
+                scan_id, digest = todo[uid]
+                try:
+                    artifacts = future.result()
+                except Exception as e:
+                    print(f'-- export failed for hdr: {scan_id}: {e}')
+                    result['failed'][uid] = repr(e)
+                    continue
+                print(f'-- exported hdr: {scan_id}')
+                result['exported'].append(uid)
+                manifest[uid] = {'hash': digest, 'scan_id': scan_id,
+                                 'exported': datetime.now().isoformat(),
+                                 'artifacts': artifacts}
+                # keep progress if the export is interrupted
+                if ttime.monotonic() - last_write > MANIFEST_INTERVAL:
+                    _write_manifest(parent_directory, manifest)
+                    last_write = ttime.monotonic()
+        finally:
+            _write_manifest(parent_directory, manifest)
+
+    return result
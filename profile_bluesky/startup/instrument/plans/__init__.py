@@ -1,3 +1,4 @@
 from .helpers import *
+from .frame_stats import *
 from .cont_scan import *
 from .locs_15 import loc177_flip1
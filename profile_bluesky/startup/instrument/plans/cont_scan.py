@@ -1,19 +1,59 @@
 import logging
 logger = logging.getLogger()
+
+import asyncio
+import time
+
+import numpy as np
             
 import bluesky.plan_stubs as bps
 from bluesky.preprocessors import inject_md_decorator
 from ..devices.stages import px, py
 
-def fly_plan(flyer, *, md=None):
+def _status_future(status):
+    """ factory for Msg('wait_for'): an asyncio future on the RunEngine loop 
+    that resolves when the ophyd ``status`` finishes 
+    """
+    def factory():
+        loop = asyncio.get_event_loop()
+        fut = loop.create_future()
+
+        def _set_result():
+            if not fut.done():
+                fut.set_result(status)
+
+        # status callbacks run in ophyd threads, hop back onto the loop
+        status.add_callback(lambda st: loop.call_soon_threadsafe(_set_result))
+        return fut
+    return factory
+
+def fly_plan(flyer, *, batch_size=1000, max_latency=1.0, timing=None, md=None):
     """
     Perform a fly scan with one or more 'flyers'.
     Slight modification to bluesky.plans.fly, takes only single flyer
 
+    Collects whenever the flyer reports data available (``batch_size`` rows
+    or ``max_latency`` s old), flyers without ``data_available()`` are 
+    polled every 0.1 s
+
+    The RunEngine sets event 'time' at collect, row times are only kept in
+    'timestamps'.  It also drops 'filled' from ``collect_pages()`` pages, so
+    flyers with external data keys must only offer ``collect()`` (the
+    CXAS100EFlyer does so in kickoff)
+
     Parameters
     ----------
     flyers : collection
         objects that support the flyer interface
+    batch_size : int, optional
+        rows to buffer in the flyer before collecting
+    max_latency : float, optional
+        longest time (s) data may wait in the flyer before collecting
+    timing : dict, optional
+        filled with the monotonic times 'kickoff_done' and 'last_collect'.
+        If it holds the previous run's 'last_collect', the dead time up to
+        this kickoff is put in ``flyer.dead_time`` and, with
+        ``flyer.arm_time``, saved as a 'timing' event
     md : dict, optional
         metadata
 
@@ -30,34 +70,105 @@ def fly_plan(flyer, *, md=None):
     uid = yield from bps.open_run(md)
     
     yield from bps.kickoff(flyer, wait=True)
+    if timing is not None:
+        timing['kickoff_done'] = time.monotonic()
+        if timing.get('last_collect') is not None and hasattr(flyer, 'dead_time'):
+            flyer.dead_time.put(timing['kickoff_done'] - timing['last_collect'])
+            yield from bps.create('timing')
+            yield from bps.read(flyer.dead_time)
+            yield from bps.read(flyer.arm_time)
+            yield from bps.save()
     complete_status = yield from bps.complete(flyer, wait=False)
+    # page mode: flyer hands back one EventPage per stream per collect, 
+    # don't hold on to the payload
     while not complete_status.done:
-        yield from bps.sleep(0.1) # rate limit @ 40Hz
-        yield from bps.collect(flyer)
-        print('.')
+        if hasattr(flyer, 'data_available'):
+            # sleep until there is something to collect, or the flyer is done
+            data_status = flyer.data_available(batch_size=batch_size, 
+                                               max_latency=max_latency)
+            yield from bps.wait_for([_status_future(data_status)])
+        else:
+            yield from bps.sleep(0.1) # rate limit @ 40Hz
+        yield from bps.collect(flyer, stream=False, return_payload=False)
     # one last collect?
-    yield from bps.collect(flyer)
+    yield from bps.collect(flyer, stream=False, return_payload=False)
+    if timing is not None:
+        timing['last_collect'] = time.monotonic()
     print('fly completed, unstaging')
     flyer.unstage()
+    if not complete_status.success:
+        raise RuntimeError(f'{flyer.name}: fly scan failed, see the log')
     yield from bps.close_run()
     return uid
 
 @inject_md_decorator({'macro_name': 'fly_list'})
-def fly_list(flyer, locs, md={}):
+def fly_list(flyer, locs, *, dxp_timeout=120, md={}):
+    """
+    Fly scan at each (x, y) in ``locs``, pipelined: 
+
+    - px and py move together
+    - the move to the next position starts as soon as the previous run's 
+      data is collected, and overlaps waiting for the dxp's to go idle
+    - dxp readiness is monitored (``flyer.dxp_idle_status()``), not polled
+
+    Dead time per position (last collect of one run to the next kickoff
+    done, so including dxp arming and the trajectory upload) and the dxp
+    arming time are saved in each run's 'timing' stream and summarized at
+    the end.
+
+    Parameters
+    ----------
+    flyer : CXAS100EFlyer
+    locs : array-like
+        [x positions, y positions]
+    dxp_timeout : float, optional
+        s to wait for the dxp modules to go idle between positions
+    md : dict, optional
+        metadata
+    """
     uids = []
+    dead_times = []
+    arm_times = []
+    timing = {}
+    
+    yield from bps.mv(px, locs[0][0], py, locs[1][0])
     for i in range(len(locs[0])):
-        yield from bps.mv(px, locs[0][i])
-        yield from bps.mv(py, locs[1][i])
-        uid = yield from fly_plan(flyer, md={'x':locs[0][i], 'y':locs[1][i]})
-        print(f'x, y: {locs[0][i]}, {locs[1][i]}')
-        print(f'pos: {i}')
-        # check if dxp's are ok
-        yield from bps.sleep(10)
-        while ( (flyer.dxp1.start_acquire.get() !=0 ) or 
-                (flyer.dxp2.start_acquire.get() !=0 ) or
-                (flyer.dxp1.start_acquire.get() !=0 ) ):
-            print('dxps not ready')
-            yield from bps.sleep(10)
+        x, y = locs[0][i], locs[1][i]
+        if i > 0:
+            # move while the dxp's finish up, wait for both
+            grp = f'fly_list_move_{i}'
+            yield from bps.abs_set(px, x, group=grp)
+            yield from bps.abs_set(py, y, group=grp)
+            if hasattr(flyer, 'dxp_idle_status'):
+                idle = flyer.dxp_idle_status(timeout=dxp_timeout)
+                yield from bps.wait_for([_status_future(idle)])
+                if not idle.success:
+                    raise RuntimeError(f'dxps not idle after {dxp_timeout} s')
+            yield from bps.wait(group=grp)
+
+        t_prev = timing.get('last_collect')
+        uid = yield from fly_plan(flyer, timing=timing, 
+                                  md={**md, 'x': x, 'y': y})
+        dead_time = (None if t_prev is None 
+                     else timing['kickoff_done'] - t_prev)
+        arm_time = flyer.arm_time.get() if hasattr(flyer, 'arm_time') else None
+
+        print(f'pos: {i}, x, y: {x}, {y}'
+              + ('' if dead_time is None else f', dead time: {dead_time:.1f} s')
+              + ('' if arm_time is None else f', arm time: {arm_time:.1f} s'))
+        if dead_time is not None:
+            dead_times.append(dead_time)
+        if arm_time is not None:
+            arm_times.append(arm_time)
         uids.append(uid)
 
+    if dead_times:
+        logger.info(f'fly_list: {len(uids)} positions, dead time '
+                    f'mean {np.mean(dead_times):.1f} s, '
+                    f'max {np.max(dead_times):.1f} s, '
+                    f'total {np.sum(dead_times):.1f} s')
+    if arm_times:
+        logger.info(f'fly_list: dxp arm time mean {np.mean(arm_times):.1f} s, '
+                    f'max {np.max(arm_times):.1f} s')
+
     return uids
@@ -1,8 +1,6 @@
 import threading 
 import logging
 import time
-from pathlib import Path
-import ctypes
 
 import numpy as np
 
@@ -16,46 +14,10 @@ from ophyd.signal import EpicsSignal
 from ophyd.sim import det
 from ophyd.flyers import FlyerInterface
 
-logger = logging.getLogger()
+from ..devices.column_buffer import ColumnBuffer
+from ..devices.fpga_decode import FpgaFrameLayout
 
-so_path = Path.cwd() / 'fpga_eval' / 'omFpgaEval.so'
-fpga_eval_lib = ctypes.cdll.LoadLibrary(so_path)
-
-# C# helper functions to decode PV
-class FpgaFrameInfo(ctypes.Structure):
-    _fields_ =    [ ("lenData",     ctypes.c_uint),
-                    ("data",        ctypes.POINTER(ctypes.c_int)),
-
-                    ("self.num_frames",   ctypes.POINTER(ctypes.c_uint)),
-                    
-                    ("numAdc",      ctypes.POINTER(ctypes.c_uint)),
-                    ("numCounter",  ctypes.POINTER(ctypes.c_uint)),
-                    ("numEncoder",  ctypes.POINTER(ctypes.c_uint)),
-                    ("numMotor",    ctypes.POINTER(ctypes.c_uint)),
-                    
-                    ("lastErrorCode", ctypes.POINTER(ctypes.c_uint))]
-
-                    
-class FpgaFrameData(ctypes.Structure):
-    _fields_ =    [ ("lenData",     ctypes.c_uint),
-                    ("data",        ctypes.POINTER(ctypes.c_int)),
-
-                    ("self.num_frames",   ctypes.POINTER(ctypes.c_uint)),
-                    
-                    ("numAdc",      ctypes.POINTER(ctypes.c_uint)),
-                    ("numCounter",  ctypes.POINTER(ctypes.c_uint)),
-                    ("numEncoder",  ctypes.POINTER(ctypes.c_uint)),
-                    ("numMotor",    ctypes.POINTER(ctypes.c_uint)),
-
-                    ("adc",         ctypes.POINTER(ctypes.c_uint)),
-                    ("counter",     ctypes.POINTER(ctypes.c_uint)),
-                    ("motor",       ctypes.POINTER(ctypes.c_uint)),    
-                    ("encoder",     ctypes.POINTER(ctypes.c_uint)),
-
-                    ("gate",        ctypes.POINTER(ctypes.c_uint)),
-                    ("time",        ctypes.POINTER(ctypes.c_uint)),
-                    
-                    ("lastErrorCode", ctypes.POINTER(ctypes.c_uint))]
+logger = logging.getLogger()
 
 # Based off of implementations by: 
 # https://blueskyproject.io/tutorials/Flyer%20Basics.html
@@ -104,39 +66,10 @@ class CXASFlyer(FPGABox, FlyerInterface):
         self.kickoff_status = ophyd.DeviceStatus(self)
         self.complete_status = ophyd.DeviceStatus(self)
         
-        # initialize parameters
-        self.num_frames         = np.zeros(1, np.uint32)
-        self.num_adc            = np.zeros(1, np.uint32)
-        self.num_counter        = np.zeros(1, np.uint32)
-        self.num_encoder        = np.zeros(1, np.uint32)
-        self.num_motor          = np.zeros(1, np.uint32)
-        self.last_error_code    = np.zeros(1, np.uint32)
-
         pv_data = self.data.get() # array of ints
 
-        # get info from the FPGA box and record
-        fpgaFrameInfo = FpgaFrameInfo(0,
-                                np.ctypeslib.as_ctypes(pv_data),
-                                
-                                np.ctypeslib.as_ctypes(self.num_frames),
-                                
-                                np.ctypeslib.as_ctypes(self.num_adc),
-                                np.ctypeslib.as_ctypes(self.num_counter),
-                                np.ctypeslib.as_ctypes(self.num_encoder),
-                                np.ctypeslib.as_ctypes(self.num_motor),
-                                # 1 for success
-                                np.ctypeslib.as_ctypes(self.last_error_code))
-
-        fpga_eval_lib.GetFpgaFrameInfo.restype = None
-        fpga_eval_lib.GetFpgaFrameInfo(ctypes.byref(fpgaFrameInfo)) 
-
-        # initialize data 
-        self.adc         = np.zeros(self.num_frames * self.num_adc, np.uint32)
-        self.counter     = np.zeros(self.num_frames * self.num_counter, np.uint32)
-        self.motor       = np.zeros(self.num_frames * self.num_motor, np.uint32)
-        self.encoder     = np.zeros(self.num_frames * self.num_encoder, np.uint32)
-        self.gate        = np.zeros(self.num_frames, np.uint32)
-        self.time        = np.zeros(self.num_frames, np.uint32)
+        # get frame layout from the FPGA box header and record
+        self.fpga_layout = FpgaFrameLayout.from_words(pv_data)
 
         # initialize data format for describe_collect(), collect()
         self.buffer_dict = [] # will store event dictionaries
@@ -187,99 +120,23 @@ class CXASFlyer(FPGABox, FlyerInterface):
         logging.info('_data_update()')
         print('_data_update()')
         pv_data = self.data.get()
-        # initialize parameters
-        self.num_frames         = np.zeros(1, np.uint32)
-        self.num_adc            = np.zeros(1, np.uint32)
-        self.num_counter        = np.zeros(1, np.uint32)
-        self.num_encoder        = np.zeros(1, np.uint32)
-        self.num_motor          = np.zeros(1, np.uint32)
-        self.last_error_code    = np.zeros(1, np.uint32)
-
-        pv_data = self.data.get() # array of ints
 
-        # get info from the FPGA box and record
-        fpgaFrameInfo = FpgaFrameInfo(0,
-                                np.ctypeslib.as_ctypes(pv_data),
-                                
-                                np.ctypeslib.as_ctypes(self.num_frames),
-                                
-                                np.ctypeslib.as_ctypes(self.num_adc),
-                                np.ctypeslib.as_ctypes(self.num_counter),
-                                np.ctypeslib.as_ctypes(self.num_encoder),
-                                np.ctypeslib.as_ctypes(self.num_motor),
-                                # 1 for success
-                                np.ctypeslib.as_ctypes(self.last_error_code))
-
-        fpga_eval_lib.GetFpgaFrameInfo.restype = None
-        fpga_eval_lib.GetFpgaFrameInfo(ctypes.byref(fpgaFrameInfo)) 
-
-        # initialize data 
-        self.adc         = np.zeros(self.num_frames * self.num_adc, np.uint32)
-        self.counter     = np.zeros(self.num_frames * self.num_counter, np.uint32)
-        self.motor       = np.zeros(self.num_frames * self.num_motor, np.uint32)
-        self.encoder     = np.zeros(self.num_frames * self.num_encoder, np.uint32)
-        self.gate        = np.zeros(self.num_frames, np.uint32)
-        self.time        = np.zeros(self.num_frames, np.uint32)
-
-        # parse new frame data
-        #print('--init fpgaFrameData')
-        fpgaFrameData = FpgaFrameData (	0,
-								np.ctypeslib.as_ctypes(pv_data),
-								
-								np.ctypeslib.as_ctypes(self.num_frames),
-								
-								np.ctypeslib.as_ctypes(self.num_adc),
-								np.ctypeslib.as_ctypes(self.num_counter),
-								np.ctypeslib.as_ctypes(self.num_encoder),
-								np.ctypeslib.as_ctypes(self.num_motor),
-								
-								np.ctypeslib.as_ctypes(self.adc),
-								np.ctypeslib.as_ctypes(self.counter),
-								np.ctypeslib.as_ctypes(self.motor),
-								np.ctypeslib.as_ctypes(self.encoder),
-								
-								np.ctypeslib.as_ctypes(self.gate),
-								np.ctypeslib.as_ctypes(self.time),
-								
-								np.ctypeslib.as_ctypes(self.last_error_code))
-
-        
-
-        # C function call
-        #print('--calling EvalFpgaData')
-        fpga_eval_lib.EvalFpgaData.restype = None
-        fpga_eval_lib.EvalFpgaData(ctypes.byref(fpgaFrameData))
+        # parse new frame data, one structured array of all frames
+        try:
+            frames = self.fpga_layout.decode(pv_data)
+        except ValueError as err:
+            logger.warning(f'_data_update(): {err}')
+            return
        
         # if we don't have a new frame
-        #print('--checking timestamps')
-        if self.last_update_time == self.time[0]:
+        if len(frames) == 0 or self.last_update_time == frames['cycletime'][0]:
             return # we don't have a new frame
         else: 
-            self.last_update_time = self.time[0] # remember last update time
-
-        # for each frame in self.frame_num, append to buffer
-        #print('--setup dictionary')
-        for frame in range(self.num_frames.item()):
-            curr_frame = {}
-            curr_frame.update({'time': self.time[frame]})
-            curr_frame.update({'gate': self.gate[frame]})
-            curr_frame.update({f'adc_{i}': self.adc[frame+i] 
-                                for i in range(self.num_adc.item())})
-            curr_frame.update({f'motor_{i}': self.motor[frame+i] 
-                                for i in range(self.num_motor.item())})
-            curr_frame.update({f'encoder_{i}': self.encoder[frame+i] 
-                                  for i in range(self.num_encoder.item())})
-            curr_frame.update({f'counter_{i}': self.counter[frame+i] 
-                                for i in range(self.num_counter.item())})
-
-            t = time.time() 
-            time_frame ={}
-            for key in curr_frame.keys():
-                time_frame.update({key:t})
-            #print('  --append to buffer')
-            self.buffer_dict.append({'time':t,
-                                    'data':curr_frame,
-                                    'timestamps':time_frame})
+            self.last_update_time = frames['cycletime'][0] # remember last update time
+
+        columns = {name: frames[name] for name in frames.dtype.names}
+        self.buffer_dict.extend(ColumnBuffer.to_events(
+                                    np.full(len(frames), time.time()), columns))
 
     def complete(self):
         logger.info('complete()')
@@ -298,13 +155,7 @@ class CXASFlyer(FPGABox, FlyerInterface):
         )
        
         # construct the schema
-        dd = {}
-        dd.update({'time':d})
-        dd.update({'gate':d})
-        dd.update({f'motor_{i}':d for i in range(self.num_motor.item())})
-        dd.update({f'adc_{i}':d for i in range(self.num_adc.item())})
-        dd.update({f'encoder_{i}':d for i in range(self.num_encoder.item())})
-        dd.update({f'counter_{i}':d for i in range(self.num_counter.item())})
+        dd = {name: d for name in self.fpga_layout.dtype.names}
         
         self.desc = {self.name: dd}
 
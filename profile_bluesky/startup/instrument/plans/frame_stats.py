@@ -0,0 +1,263 @@
+"""
+Streaming statistics over detector frames
+
+Frames are read in chunks straight from the handlers, on a reader thread
+while the previous chunk is reduced, into per-pixel float64 count, mean,
+variance, sum and max, so memory does not grow with the number of frames.
+
+stats = reduce_images(db[-1], 'marCCD_image', handlers, dark=dark,
+                      reject_sigma=5)
+stats.mean, stats.std, stats.max, stats.count
+"""
+
+__all__ = ['FrameReducer', 'iter_frame_chunks', 'reduce_images']
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from event_model import Filler, unpack_event_page
+
+
+class FrameReducer:
+    """Running per-pixel statistics (Welford / Chan et al. merge).
+
+    With ``reject_sigma``, pixels further than ``reject_sigma`` standard
+    deviations from the running mean are left out of the statistics (e.g.
+    zingers).  The first ``min_frames`` frames are held back and judged
+    against their median and MAD, so outliers among them do not inflate
+    the spread.  The standard deviation used for rejection is at least the
+    Poisson ``sqrt(mean)`` and ``noise_floor``, a pixel that was constant
+    so far (e.g. zero counts) still accepts ordinary counts later.
+
+    r = FrameReducer(dark=dark_frame, reject_sigma=5)
+    for chunk in chunks:    # (n, rows, cols)
+        r.update(chunk)
+    r.mean, r.var, r.sum    # None before the first frame
+    """
+    def __init__(self, dark=None, reject_sigma=None, min_frames=5,
+                 track_max=True, noise_floor=1.0):
+        """
+        :param dark: subtracted from every frame
+        :type dark: np.ndarray or float, optional
+        :param reject_sigma: outlier threshold in standard deviations
+        :type reject_sigma: float, optional
+        :param min_frames: frames judged by median / MAD before the running
+                           statistics are used for rejection
+        :param track_max: also keep the per-pixel maximum
+        :param noise_floor: smallest standard deviation assumed for
+                            rejection, in detector counts
+        """
+        self.dark = None if dark is None else np.asarray(dark, np.float64)
+        self.reject_sigma = reject_sigma
+        self.min_frames = min_frames
+        self.track_max = track_max
+        self.noise_floor = noise_floor
+
+        self.num_frames = 0
+        self.num_rejected = 0
+        self._warmup = [] # frames held back until min_frames are there
+        self._count = None # per pixel, frames that were not rejected
+        self._mean = None
+        self._m2 = None # sum of squared deviations from the mean
+        self._max = None
+
+    def update(self, frames):
+        """ add a frame (rows, cols) or a chunk of frames (n, rows, cols) """
+        frames = np.asarray(frames, dtype=np.float64)
+        if frames.ndim == 2:
+            frames = frames[np.newaxis]
+        if not len(frames):
+            return
+        if self.dark is not None:
+            frames = frames - self.dark
+        self.num_frames += len(frames)
+
+        if self.reject_sigma is None:
+            self._accumulate(frames)
+        elif self._warmup is not None:
+            self._warmup.append(frames)
+            if self.num_frames >= self.min_frames:
+                self._flush()
+        else:
+            self._accumulate(frames, self._keep(frames, self._mean,
+                                                np.sqrt(self._var())))
+
+    def _flush(self):
+        """ reduce the held back first frames against their median """
+        if not self._warmup:
+            return # nothing held back, or already flushed
+        frames = np.concatenate(self._warmup)
+        self._warmup = None
+        keep = None
+        if len(frames) >= 3:
+            median = np.median(frames, axis=0)
+            mad = np.median(np.abs(frames - median), axis=0)
+            keep = self._keep(frames, median, 1.4826 * mad)
+        self._accumulate(frames, keep)
+
+    def _keep(self, frames, center, sigma):
+        """ mask of the pixels within reject_sigma of ``center`` """
+        sigma = np.maximum(sigma, np.sqrt(np.clip(center, 0, None)))
+        limit = self.reject_sigma * np.maximum(sigma, self.noise_floor)
+        keep = np.abs(frames - center) <= limit
+        self.num_rejected += int(keep.size - np.count_nonzero(keep))
+        return keep
+
+    def _accumulate(self, frames, keep=None):
+        if self._mean is None:
+            shape = frames.shape[1:]
+            self._count = np.zeros(shape, np.int64)
+            self._mean = np.zeros(shape)
+            self._m2 = np.zeros(shape)
+            if self.track_max:
+                self._max = np.full(shape, -np.inf)
+
+        # statistics of this chunk
+        if keep is None:
+            n_c = len(frames)
+            mean_c = frames.mean(axis=0)
+            m2_c = ((frames - mean_c) ** 2).sum(axis=0)
+        else:
+            n_c = keep.sum(axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean_c = np.where(keep, frames, 0).sum(axis=0) / n_c
+            mean_c = np.nan_to_num(mean_c)
+            m2_c = (np.where(keep, frames - mean_c, 0) ** 2).sum(axis=0)
+
+        # merge with the running statistics
+        n = self._count + n_c
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = mean_c - self._mean
+            self._mean = np.where(n > 0, self._mean + delta * n_c / n, 0.0)
+            self._m2 = np.where(n > 0, self._m2 + m2_c
+                                + delta ** 2 * self._count * n_c / n, 0.0)
+        self._count = n
+        if self.track_max:
+            chunk_max = (frames.max(axis=0) if keep is None
+                         else np.where(keep, frames, -np.inf).max(axis=0))
+            np.maximum(self._max, chunk_max, out=self._max)
+
+    def _var(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self._count > 1,
+                            self._m2 / (self._count - 1), 0.0)
+
+    @property
+    def count(self):
+        self._flush()
+        return self._count
+
+    @property
+    def mean(self):
+        self._flush()
+        return self._mean
+
+    @property
+    def max(self):
+        self._flush()
+        return self._max
+
+    @property
+    def sum(self):
+        mean = self.mean
+        return None if mean is None else mean * self._count
+
+    @property
+    def var(self):
+        """ sample variance per pixel """
+        self._flush()
+        return None if self._count is None else self._var()
+
+    @property
+    def std(self):
+        var = self.var
+        return None if var is None else np.sqrt(var)
+
+
+def iter_frame_chunks(hdr, img_key, handler_registry, chunk_size=8,
+                      stream='primary'):
+    """ images of ``img_key`` in ``stream``, yielded as (n, rows, cols)
+    chunks in event order.  The next chunk is read on a reader thread while
+    the caller works on the current one, at most two chunks are in memory.
+
+    A single reader thread: the Filler and its handler cache are not thread
+    safe, and HDF5 reads serialize on h5py's lock anyway.
+
+    :param hdr: databroker header
+    :param img_key: column holding the (external) images
+    :param handler_registry: {spec: handler class} to read the images with
+    :param chunk_size: frames per chunk
+    """
+    filler = Filler(handler_registry, include=[img_key], inplace=True)
+
+    def read_chunk(docs):
+        """ reader thread: feed ``docs`` to the filler, stack the images """
+        frames = []
+        for name, doc in docs:
+            if name != 'event':
+                filler(name, doc)
+                continue
+            arr = np.asarray(filler.fill_event(doc, include=[img_key])
+                             ['data'][img_key])
+            frames.append(arr[0] if arr.ndim == 3 else arr) # first frame
+        return np.stack(frames)
+
+    def batches():
+        """ documents up to and including the next ``chunk_size`` events
+        of ``stream``
+        """
+        descriptors = set()
+        docs, n = [], 0
+        for name, doc in hdr.documents(fill=False):
+            if name == 'event':
+                page = [doc]
+            elif name == 'event_page':
+                page = unpack_event_page(doc)
+            else:
+                if name == 'descriptor' and doc.get('name') == stream:
+                    descriptors.add(doc['uid'])
+                docs.append((name, doc))
+                continue
+            for event in page:
+                if event['descriptor'] in descriptors:
+                    docs.append(('event', event))
+                    n += 1
+                    if n == chunk_size:
+                        yield docs
+                        docs, n = [], 0
+        if n:
+            yield docs
+
+    try:
+        with ThreadPoolExecutor(max_workers=1) as reader:
+            pending = deque()
+            try:
+                for docs in batches():
+                    pending.append(reader.submit(read_chunk, docs))
+                    if len(pending) > 1:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+    finally:
+        filler.close()
+
+
+def reduce_images(hdr, img_key, handler_registry, dark=None,
+                  reject_sigma=None, chunk_size=8, track_max=True,
+                  noise_floor=1.0):
+    """ stream all images of a run into a FrameReducer, see FrameReducer
+    for ``reject_sigma`` and ``noise_floor``
+
+    :return: reducer holding mean, var, std, sum, max and count
+    :rtype: FrameReducer
+    """
+    reducer = FrameReducer(dark=dark, reject_sigma=reject_sigma,
+                           track_max=track_max, noise_floor=noise_floor)
+    for chunk in iter_frame_chunks(hdr, img_key, handler_registry,
+                                   chunk_size=chunk_size):
+        reducer.update(chunk)
+    return reducer
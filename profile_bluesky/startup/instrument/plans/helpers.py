@@ -2,16 +2,92 @@
 Helper plans, functions
 
 """
+from collections import OrderedDict
+
 from ..framework.initialize import db
 from ..devices.misc_devices import filter1, filter2, filter3, filter4
 import matplotlib.pyplot as plt
 import numpy as np
+from event_model import Filler, unpack_event_page
+
+from .frame_stats import reduce_images
+
+__all__ = ['show_table', 'get_image', 'show_image', 'show_scan', 'avg_images',
+           'image_stats', 'filters']
 
-__all__ = ['show_table', 'show_image', 'show_scan', 'avg_images', 'filters']
+IMAGE_CACHE_SIZE = 16 # recently viewed frames kept by get_image
+_image_cache = OrderedDict() # (run uid, data_pt, img_key): image
 
 def show_table(ind=-1):
     return db[ind].table()
 
+def _handler_registry():
+    # handlers registered with the broker, e.g. DXP_HDF5
+    reg = getattr(db.reg, 'handler_reg', None)
+    if reg:
+        return dict(reg)
+    from databroker.core import discover_handlers
+    return discover_handlers()
+
+def _find_event(hdr, data_pt, filler):
+    """ primary stream event ``data_pt``, unfilled.  Documents stream in 
+    order, so ``filler`` has seen the resources and datums it refers to
+    """
+    primary = set()
+    for name, doc in hdr.documents(fill=False):
+        if name == 'event':
+            events = [doc]
+        elif name == 'event_page':
+            events = unpack_event_page(doc)
+        else:
+            if name == 'descriptor' and doc.get('name') == 'primary':
+                primary.add(doc['uid'])
+            filler(name, doc)
+            continue
+        for event in events:
+            if event['descriptor'] in primary and event['seq_num'] == data_pt:
+                return event
+    raise KeyError(data_pt)
+
+def get_image(ind=-1, data_pt=1, img_key='pilatus300k_image', hdr=None):
+    """read a single image of a run: only the datum of event ``data_pt`` is
+    loaded through its handler, recently viewed frames are cached.
+
+    :param ind: Index of run, -1 referring to most recent run. defaults to -1
+    :type ind: int, optional
+    :param data_pt: row (seq_num) of the primary stream, defaults to 1
+    :type data_pt: int, optional
+    :param img_key: column name holding image data
+    :type img_key: str, optional
+    :param hdr: already resolved header, ``ind`` is ignored if given
+    :raises KeyError: if the run has no such data point or key
+    :return: image, first frame if the point holds several
+    :rtype: np.ndarray
+    """
+    if hdr is None:
+        hdr = db[ind]
+    key = (hdr.start['uid'], data_pt, img_key)
+    if key in _image_cache:
+        _image_cache.move_to_end(key)
+        return _image_cache[key]
+
+    filler = Filler(_handler_registry(), include=[img_key], inplace=True)
+    try:
+        event = _find_event(hdr, data_pt, filler)
+        if img_key not in event['data']:
+            raise KeyError(img_key)
+        event = filler.fill_event(event, include=[img_key])
+    finally:
+        filler.close()
+
+    arr = np.asarray(event['data'][img_key])
+    if arr.ndim == 3:
+        arr = arr[0]
+    _image_cache[key] = arr
+    while len(_image_cache) > IMAGE_CACHE_SIZE:
+        _image_cache.popitem(last=False)
+    return arr
+
 def show_image(ind=-1, data_pt=1, img_key='pilatus300k_image', max_val=500000):
     """show_image attempts to plot area detector data, plot a vertical slice, 
     and calculates number of pixels above the provided threshold.  
@@ -31,9 +107,9 @@ def show_image(ind=-1, data_pt=1, img_key='pilatus300k_image', max_val=500000):
     else:
         horizontal=False
 
+    hdr = db[ind]
     try:
-        hdr = db[ind].table(fill=True)
-        arr = hdr[img_key][data_pt][0]
+        arr = get_image(data_pt=data_pt, img_key=img_key, hdr=hdr)
         if horizontal:
             arr = np.rot90(arr, -1)
     except KeyError:
@@ -50,7 +126,7 @@ def show_image(ind=-1, data_pt=1, img_key='pilatus300k_image', max_val=500000):
     axes[0].text(100,100, f'{n_max} pixels > {max_val}', 
                     backgroundcolor='w')
     
-    scan_no = db[ind].start['scan_id']
+    scan_no = hdr.start['scan_id']
     axes[0].set_title(f'{img_key}, Scan #{scan_no}, data point: {data_pt}')
 
     height, width = arr.shape
@@ -90,33 +166,36 @@ def show_scan(ind=-1, dep_subkey='channel1_rois_', indep_subkey='s_stage'):
         print(e)
         return
 
-def avg_images(ind=-1,img_key='marCCD_image'):
-    """avg_images [summary]
-
-    [extended_summary]
+def avg_images(ind=-1, img_key='marCCD_image', dark=None, reject_sigma=None,
+               chunk_size=8):
+    """avg_images averages the images inside a run, streaming: frames are
+    read in chunks and reduced on the fly, see frame_stats.py
 
     :param ind: Run index, defaults to -1.  
                 If negative integer, counts backward from most recent run (-1=most recent, -2=second most recent)
                 If positive integer, matches 'scan_id'
                 If string, interprets as the start of a UID (ex: '8ee443d')
     :type ind: int, optional
-    :param img_key: [description], defaults to 'marCCD_image'
+    :param img_key: column name holding image data, defaults to 'marCCD_image'
     :type img_key: str, optional
-    :return: [description]
-    :rtype: [type]
+    :param dark: dark frame (or offset) subtracted from every image
+    :type dark: np.ndarray, optional
+    :param reject_sigma: leave out pixels this many standard deviations
+                         from the running mean (zingers)
+    :type reject_sigma: float, optional
+    :param chunk_size: images reduced at once
+    :type chunk_size: int, optional
+    :return: averaged image, None if the run holds no images
+    :rtype: np.ndarray
     """
-    ''' Tries to average images inside a run.  
-    Currently assumes MarCCD format 
-    returns the array after.'''
-
-    df = db[ind].table(fill=True)
-
-    #gather images
-    arr = []
-    for i in range(len(df)):
-        arr.append(df[img_key][i+1][0])
-
-    avg_arr = np.sum(arr, axis=0) / len(arr)
+    hdr = db[ind]
+    stats = reduce_images(hdr, img_key, _handler_registry(), dark=dark,
+                          reject_sigma=reject_sigma, chunk_size=chunk_size,
+                          track_max=False)
+    avg_arr = stats.mean
+    if avg_arr is None:
+        print(f'Scan #{hdr.start["scan_id"]}: no {img_key} images to average')
+        return None
 
     # plot
     fig, axes = plt.subplots(1,2, sharey=True, figsize=(7, 4.9),
@@ -126,15 +205,25 @@ def avg_images(ind=-1,img_key='marCCD_image'):
 
     axes[0].imshow(avg_arr, vmax=vmax)
     
-    scan_no = db[ind].start['scan_id']
-    axes[0].set_title(f'Scan #{scan_no}, averaged over {len(arr)} images')
+    scan_no = hdr.start['scan_id']
+    axes[0].set_title(f'Scan #{scan_no}, averaged over {stats.num_frames} images')
 
     sl = avg_arr[:, 900:1100]
-    axes[1].plot(sl.sum(axis=1), list(range(2048)))
+    axes[1].plot(sl.sum(axis=1), list(range(avg_arr.shape[0])))
     plt.tight_layout()
 
     return avg_arr
 
+def image_stats(ind=-1, img_key='marCCD_image', dark=None, reject_sigma=None,
+                chunk_size=8):
+    """per-pixel statistics over all images of a run, without plotting.
+
+    :return: reducer with mean, var, std, sum, max, count and num_frames
+    :rtype: FrameReducer
+    """
+    return reduce_images(db[ind], img_key, _handler_registry(), dark=dark,
+                         reject_sigma=reject_sigma, chunk_size=chunk_size)
+
 def filters(new_vals=None):
     if new_vals:
         filter1.put(new_vals[0]*4.9)
@@ -20,7 +20,7 @@ from bluesky.callbacks.fitting import PeakStats
 # devices to tune
 from ..devices.stages import s_stage
 from ..devices.misc_devices import shutter
-from ..framework import RE
+from ..framework.initialize import RE
 
 tune_params = {
     's_stage_px':{ 'width': 20, 'num': 20, 'peak_choice': 'com'},
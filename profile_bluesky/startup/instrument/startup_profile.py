@@ -0,0 +1,197 @@
+"""
+profile the startup: wall time and memory per module import and per device
+
+Started first thing in collection.py, every import statement that loads new
+modules is timed (inclusive and self time, RSS growth), devices add a row
+when they are constructed.  The table is written to
+.logs/startup_profile_<date>.csv and can be compared across sessions:
+
+compare_startup_profiles() # last two sessions, largest changes first
+"""
+
+__all__ = ['profiler', 'load_startup_profile', 'compare_startup_profiles']
+
+import builtins
+from datetime import datetime
+import glob
+import importlib.util
+import os
+import resource
+import sys
+import threading
+import time as ttime
+
+# same directory as session_logs.py, which is not imported yet when the
+# profiler starts
+LOG_PATH = os.path.join(os.getcwd(), ".logs")
+FILE_PREFIX = 'startup_profile_'
+
+COLUMNS = ['kind', 'name', 'parent', 'depth', 'start', 'wall', 'self_wall',
+           'rss_mb', 'new_modules']
+
+
+def memory_mb():
+    """ current resident memory [MB] """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 2**20
+    except (OSError, ValueError, IndexError):
+        # peak instead of current, kB on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+class StartupProfiler:
+    """Times import statements by wrapping ``builtins.__import__``.
+
+    Only the thread that called ``start()`` is profiled, imports that find
+    their module in ``sys.modules`` take the fast path untouched.
+    """
+    def __init__(self, log_path=LOG_PATH):
+        self.log_path = log_path
+        self.records = []
+        self.path = None
+        self._original_import = None
+        self._thread_id = None
+        self._stack = [] # [name, t_start, child wall]
+        self._t0 = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self._original_import is not None
+
+    def start(self):
+        if self.active:
+            return
+        self._t0 = ttime.perf_counter()
+        self._thread_id = threading.get_ident()
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+        self.path = os.path.join(self.log_path, FILE_PREFIX
+                        + datetime.now().strftime('%Y%m%d-%H%M%S') + '.csv')
+
+    def stop(self, write=True):
+        """ stop timing imports, optionally write what was recorded """
+        if not self.active:
+            return
+        builtins.__import__ = self._original_import
+        self._original_import = None
+        self.record('total', 'startup', ttime.perf_counter() - self._t0)
+        if write:
+            self.write()
+
+    def _resolve(self, name, globals, level):
+        """ absolute module name of an import statement """
+        if not level:
+            return name
+        package = (globals or {}).get('__package__')
+        if not package:
+            return name
+        try:
+            return importlib.util.resolve_name('.' * level + name, package)
+        except (ImportError, ValueError):
+            return name
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._original_import or builtins.__import__
+        if threading.get_ident() != self._thread_id:
+            return original(name, globals, locals, fromlist, level)
+        label = self._resolve(name, globals, level)
+        if not fromlist and label in sys.modules:
+            return original(name, globals, locals, fromlist, level)
+
+        n_modules = len(sys.modules)
+        rss = memory_mb()
+        t_start = ttime.perf_counter()
+        self._stack.append([label, t_start, 0.0])
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            _, _, child_wall = self._stack.pop()
+            wall = ttime.perf_counter() - t_start
+            new_modules = len(sys.modules) - n_modules
+            if self._stack:
+                self._stack[-1][2] += wall
+            if new_modules > 0:
+                self.records.append({'kind': 'import', 'name': label,
+                        'parent': self._stack[-1][0] if self._stack else '',
+                        'depth': len(self._stack),
+                        'start': t_start - self._t0, 'wall': wall,
+                        'self_wall': wall - child_wall,
+                        'rss_mb': memory_mb() - rss,
+                        'new_modules': new_modules})
+
+    def record(self, kind, name, wall, rss_mb=0.0, start=None):
+        """ add a row that is not an import, e.g. a device construction """
+        now = ttime.perf_counter()
+        t0 = self._t0 if self._t0 is not None else now
+        with self._lock:
+            self.records.append({'kind': kind, 'name': name, 'parent': '',
+                    'depth': 0,
+                    'start': (now - wall if start is None else start) - t0,
+                    'wall': wall, 'self_wall': wall, 'rss_mb': rss_mb,
+                    'new_modules': 0})
+
+    def to_dataframe(self):
+        import pandas as pd
+        with self._lock:
+            return pd.DataFrame(list(self.records), columns=COLUMNS)
+
+    def write(self):
+        """ (re)write this session's profile, returns the file path """
+        if self.path is None:
+            return None
+        os.makedirs(self.log_path, exist_ok=True)
+        self.to_dataframe().to_csv(self.path, index=False)
+        return self.path
+
+    def summary(self, top=15):
+        """ slowest imports by self time, and all devices """
+        import pandas as pd
+        df = self.to_dataframe()
+        return pd.concat([df[df.kind == 'import'].nlargest(top, 'self_wall'),
+                          df[df.kind != 'import']])
+
+
+profiler = StartupProfiler()
+
+
+def load_startup_profile(path=None, log_path=LOG_PATH):
+    """ read a startup profile, the latest one by default
+
+    :param path: file, or index into the sessions sorted by date (-2 for the
+                 one before the latest)
+    :type path: str or int, optional
+    :rtype: pd.DataFrame
+    """
+    import pandas as pd
+    if path is None or isinstance(path, int):
+        files = sorted(glob.glob(os.path.join(log_path, FILE_PREFIX + '*.csv')))
+        if not files:
+            raise FileNotFoundError(f'no startup profiles in {log_path}')
+        path = files[-1 if path is None else path]
+    df = pd.read_csv(path, keep_default_na=False,
+                     dtype={'kind': str, 'name': str, 'parent': str})
+    df.attrs['path'] = path
+    return df
+
+
+def compare_startup_profiles(old=-2, new=-1, log_path=LOG_PATH):
+    """ per import/device wall time of two sessions, largest change first
+
+    :param old: file or session index, see ``load_startup_profile``
+    :param new: file or session index
+    :rtype: pd.DataFrame
+    """
+    frames = []
+    for which, path in (('old', old), ('new', new)):
+        df = load_startup_profile(path, log_path=log_path)
+        # an import statement can appear under several parents
+        df = df.groupby(['kind', 'name'])[['wall', 'self_wall', 'rss_mb']].sum()
+        frames.append(df.add_suffix(f'_{which}'))
+
+    df = frames[0].join(frames[1], how='outer').fillna(0.0)
+    df['wall_change'] = df.wall_new - df.wall_old
+    df['rss_change'] = df.rss_mb_new - df.rss_mb_old
+    return df.reindex(df.wall_change.abs().sort_values(ascending=False).index)
@@ -0,0 +1,97 @@
+"""
+ColumnBuffer extend / drain / to_page / to_events
+"""
+
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+MODULE = (Path(__file__).parents[1] / 'profile_bluesky' / 'startup'
+          / 'instrument' / 'devices' / 'column_buffer.py')
+spec = importlib.util.spec_from_file_location('column_buffer', MODULE)
+column_buffer = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(column_buffer)
+ColumnBuffer = column_buffer.ColumnBuffer
+
+
+def test_extend_grows_and_drains_in_order():
+    buf = ColumnBuffer(capacity=2)
+    for i in range(5):
+        n = buf.extend({'adc_0': np.arange(3) + 3 * i,
+                        'mca': np.full((3, 4), i)}, timestamp=float(i))
+        assert n == 3
+    assert len(buf) == 15
+
+    t, columns = buf.drain()
+    assert len(buf) == 0
+    np.testing.assert_array_equal(t, np.repeat(np.arange(5.0), 3))
+    np.testing.assert_array_equal(columns['adc_0'], np.arange(15))
+    assert columns['mca'].shape == (15, 4)
+    np.testing.assert_array_equal(columns['mca'][:, 0], np.repeat(np.arange(5), 3))
+
+
+def test_drain_returns_copies():
+    buf = ColumnBuffer()
+    buf.extend({'gate': np.array([1, 2])}, timestamp=0.0)
+    _, columns = buf.drain()
+    buf.extend({'gate': np.array([7, 8])}, timestamp=1.0)
+    np.testing.assert_array_equal(columns['gate'], [1, 2])
+
+
+def test_empty_batch():
+    buf = ColumnBuffer()
+    assert buf.extend({'gate': np.array([])}) == 0
+    assert buf.extend({}) == 0
+    t, columns = buf.drain()
+    assert len(t) == 0
+    with pytest.raises(IndexError):
+        buf.last()
+
+
+def test_layout_change():
+    buf = ColumnBuffer()
+    buf.extend({'adc_0': np.arange(2)}, timestamp=0.0)
+    # keys must not change while rows are buffered
+    with pytest.raises(KeyError):
+        buf.extend({'adc_0': np.arange(2), 'adc_1': np.arange(2)})
+    assert len(buf) == 2
+
+    # after a drain the columns follow the new layout, dtype and shape
+    buf.drain()
+    buf.extend({'adc_1': np.ones((2, 3), np.float32)}, timestamp=1.0)
+    t, columns = buf.drain()
+    assert set(columns) == {'adc_1'}
+    assert columns['adc_1'].dtype == np.float32
+    assert columns['adc_1'].shape == (2, 3)
+
+
+def test_last():
+    buf = ColumnBuffer()
+    buf.extend({'gate': np.array([1, 2, 3])}, timestamp=5.0)
+    t, row = buf.last()
+    assert t == 5.0
+    assert row == {'gate': 3}
+
+
+def test_to_page_and_events():
+    buf = ColumnBuffer()
+    buf.extend({'gate': np.array([1, 2]), 'mca': np.array(['a', 'b'])},
+               timestamp=1.0)
+    buf.extend({'gate': np.array([3]), 'mca': np.array(['c'])}, timestamp=2.0)
+    t, columns = buf.drain()
+
+    page = ColumnBuffer.to_page(t, columns, filled=['mca'])
+    np.testing.assert_array_equal(page['time'], [1.0, 1.0, 2.0])
+    np.testing.assert_array_equal(page['data']['gate'], [1, 2, 3])
+    np.testing.assert_array_equal(page['timestamps']['mca'], [1.0, 1.0, 2.0])
+    np.testing.assert_array_equal(page['filled']['mca'], [False] * 3)
+    assert 'filled' not in ColumnBuffer.to_page(t, columns)
+
+    events = list(ColumnBuffer.to_events(t, columns, filled=['mca']))
+    assert [ev['data'] for ev in events] == [
+        {'gate': 1, 'mca': 'a'}, {'gate': 2, 'mca': 'b'},
+        {'gate': 3, 'mca': 'c'}]
+    assert [ev['time'] for ev in events] == [1.0, 1.0, 2.0]
+    assert all(ev['filled'] == {'mca': False} for ev in events)
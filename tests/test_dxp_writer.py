@@ -0,0 +1,72 @@
+"""
+DXP spectra round trip: DxpSpectraWriter -> Resource / DatumPage -> handler
+"""
+
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+import pytest
+from event_model import Filler, compose_run, unpack_datum_page
+
+pytest.importorskip('databroker')
+MODULE = (Path(__file__).parents[1] / 'profile_bluesky' / 'startup'
+          / 'instrument' / 'devices' / 'dxp_writer.py')
+spec = importlib.util.spec_from_file_location('dxp_writer', MODULE)
+dxp_writer = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(dxp_writer)
+
+
+def test_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    spectra = {'dxp1': [rng.integers(0, 2**16, (5, 8), dtype=np.uint32),
+                        rng.integers(0, 2**16, (3, 8), dtype=np.uint32)],
+               'dxp2': [rng.integers(0, 2**16, (4, 8), dtype=np.uint32)]}
+
+    writer = dxp_writer.DxpSpectraWriter(tmp_path, chunk_rows=2)
+    writer.open()
+    ids = {module: [writer.write(module, mca) for mca in batches]
+           for module, batches in spectra.items()}
+    docs = list(writer.collect_asset_docs())
+    writer.close()
+
+    names = [name for name, doc in docs]
+    assert names == ['resource'] + ['datum_page'] * 3
+    resource = docs[0][1]
+    assert resource['spec'] == 'DXP_HDF5'
+    datums = [datum for name, doc in docs[1:]
+              for datum in unpack_datum_page(doc)]
+    assert all(d['resource'] == resource['uid'] for d in datums)
+    # ids are unique and handed back in row order
+    all_ids = [i for batches in ids.values() for b in batches for i in b]
+    assert [d['datum_id'] for d in datums] == all_ids
+    assert len(set(all_ids)) == len(all_ids)
+
+    # fill events through the registered handler
+    run = compose_run()
+    desc = run.compose_descriptor(
+        name='DXP_100E',
+        data_keys={'mca': {'source': 'dxp', 'dtype': 'array',
+                           'shape': [-1, -1], 'external': 'FILESTORE:'}})
+    filler = Filler({'DXP_HDF5': dxp_writer.DxpHDF5Handler}, inplace=False)
+    filler('start', run.start_doc)
+    filler('descriptor', desc.descriptor_doc)
+    for name, doc in docs:
+        filler(name, doc)
+
+    for module, batches in spectra.items():
+        for mca, batch_ids in zip(batches, ids[module]):
+            for row, datum_id in zip(mca, batch_ids):
+                event = desc.compose_event(data={'mca': datum_id},
+                                           timestamps={'mca': 0},
+                                           filled={'mca': False})
+                _, filled = filler('event', event)
+                np.testing.assert_array_equal(filled['data']['mca'], row)
+                assert filled['data']['mca'].dtype == np.uint32
+    filler.close()
+
+
+def test_write_requires_open(tmp_path):
+    writer = dxp_writer.DxpSpectraWriter(tmp_path)
+    with pytest.raises(RuntimeError):
+        writer.write('dxp1', np.zeros((1, 4)))
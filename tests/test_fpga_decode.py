@@ -0,0 +1,120 @@
+"""
+decode_fpga_frames matches EvalFpgaData of omFpgaEval.so
+"""
+
+import ctypes
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+DEVICES = (Path(__file__).parents[1] / 'profile_bluesky' / 'startup'
+           / 'instrument' / 'devices')
+spec = importlib.util.spec_from_file_location('fpga_decode',
+                                              DEVICES / 'fpga_decode.py')
+fpga_decode = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(fpga_decode)
+
+try:
+    om_fpga_eval = ctypes.cdll.LoadLibrary(DEVICES / 'fpga_eval'
+                                           / 'omFpgaEval.so')
+except OSError:
+    om_fpga_eval = None
+
+UINT_P = ctypes.POINTER(ctypes.c_uint)
+
+
+class FpgaFrameData(ctypes.Structure):
+    # see fpga_eval/omFpgaEval.h
+    _fields_ = [('lenData', ctypes.c_uint),
+                ('data', ctypes.POINTER(ctypes.c_int)),
+                ('numFrames', UINT_P),
+                ('numAdc', UINT_P),
+                ('numCounter', UINT_P),
+                ('numMotor', UINT_P),
+                ('numEncoder', UINT_P),
+                ('adc', UINT_P),
+                ('counter', UINT_P),
+                ('motor', UINT_P),
+                ('encoder', UINT_P),
+                ('gate', UINT_P),
+                ('time', UINT_P),
+                ('lastErrorCode', UINT_P)]
+
+
+def eval_fpga_data(words, num_frames, layout):
+    """ run EvalFpgaData, return {field: array} like decode_fpga_frames """
+    words = np.ascontiguousarray(words, np.int32)
+    counts = {key: np.zeros(1, np.uint32)
+              for key in ('frames', 'adc', 'counter', 'motor', 'encoder')}
+    sizes = {'adc': layout.num_adc, 'counter': layout.num_counter,
+             'motor': layout.num_motor, 'encoder': layout.num_encoder}
+    # + 1 keeps the buffers valid when a channel is not configured
+    arrays = {key: np.zeros(num_frames * n + 1, np.uint32)
+              for key, n in sizes.items()}
+    gate = np.zeros(num_frames, np.uint32)
+    time = np.zeros(num_frames, np.uint32)
+    error = np.zeros(1, np.uint32)
+
+    as_p = np.ctypeslib.as_ctypes
+    frame_data = FpgaFrameData(
+        len(words), as_p(words), as_p(counts['frames']),
+        as_p(counts['adc']), as_p(counts['counter']), as_p(counts['motor']),
+        as_p(counts['encoder']),
+        as_p(arrays['adc']), as_p(arrays['counter']), as_p(arrays['motor']),
+        as_p(arrays['encoder']), as_p(gate), as_p(time), as_p(error))
+    om_fpga_eval.EvalFpgaData.restype = None
+    om_fpga_eval.EvalFpgaData(ctypes.byref(frame_data))
+    assert error[0] == 1
+    assert counts['frames'][0] == num_frames
+
+    out = {'cycletime': time, 'gate': gate}
+    for key, n in sizes.items():
+        per_frame = arrays[key][:num_frames * n].reshape(num_frames, n)
+        out.update({f'{key}_{i}': per_frame[:, i] for i in range(n)})
+    return out
+
+
+def synthetic_words(config_1, config_2, num_frames, seed=0):
+    """ .DATA words for ``num_frames`` frames of random data """
+    layout = fpga_decode.FpgaFrameLayout(config_1, config_2)
+    rng = np.random.default_rng(seed)
+    num_words = 2 + layout.frame_size * num_frames
+    words = rng.integers(-2**31, 2**31, num_words, dtype=np.int64)
+    # encoder words around the wrap of 0-(x+0x7FFFFFFF)
+    edges = np.array([0, 1, -1, 0x7FFFFFFF, 0x7FFFFFFE, -2**31, -2**31 + 1])
+    words[7::5] = np.resize(edges, len(words[7::5]))
+
+    words[0] = 4 * num_words # bytes
+    words[1] &= 0x7FFFFFFF # DAQ data, not a status report
+    words[3] = config_1
+    words[4] = config_2
+    return words.astype(np.int32), layout
+
+
+@pytest.mark.skipif(om_fpga_eval is None,
+                    reason='omFpgaEval.so cannot be loaded')
+@pytest.mark.parametrize('config_1, config_2', [
+    (0x3C0000 | 0x3FC00 | 0x3F, 0xFFFFFFFF), # everything
+    (0x0C0000 | 0x00C00 | 0x03, 0x0000000F),
+    (0x040000 | 0x00400, 0x00000001),
+    (0x000000, 0x00000000), # trigger words only
+])
+@pytest.mark.parametrize('num_frames', [1, 2, 17])
+def test_matches_eval_fpga_data(config_1, config_2, num_frames):
+    words, layout = synthetic_words(config_1, config_2, num_frames)
+    ref = eval_fpga_data(words, num_frames, layout)
+    frames = fpga_decode.decode_fpga_frames(words)
+
+    assert len(frames) == num_frames
+    assert set(frames.dtype.names) == set(ref)
+    for name in frames.dtype.names:
+        np.testing.assert_array_equal(frames[name], ref[name], err_msg=name)
+
+
+def test_rejects_status_report():
+    words, layout = synthetic_words(0x3C0000, 0x1, 3)
+    words[1] |= np.int32(-2**31)
+    with pytest.raises(ValueError):
+        fpga_decode.decode_fpga_frames(words)
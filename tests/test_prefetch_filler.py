@@ -0,0 +1,81 @@
+"""
+PrefetchFiller keeps up when the events outpace the prefetch thread
+"""
+
+import importlib.util
+from pathlib import Path
+import time as ttime
+
+import numpy as np
+from event_model import compose_run
+
+MODULE = (Path(__file__).parents[1] / 'profile_bluesky' / 'startup'
+          / 'instrument' / 'callbacks' / 'prefetch_filler.py')
+spec = importlib.util.spec_from_file_location('prefetch_filler', MODULE)
+prefetch_filler = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(prefetch_filler)
+
+
+class SlowHandler:
+    def __init__(self, resource_path, delay=0.05):
+        self.delay = delay
+
+    def __call__(self, index):
+        ttime.sleep(self.delay)
+        return np.full((4, 4), index)
+
+
+def run_docs(num_events, delay):
+    run = compose_run()
+    yield 'start', run.start_doc
+    desc = run.compose_descriptor(
+        name='primary',
+        data_keys={'img': {'source': 'sim', 'dtype': 'array',
+                           'shape': [4, 4], 'external': 'FILESTORE:'}})
+    yield 'descriptor', desc.descriptor_doc
+    res = run.compose_resource(spec='SLOW', root='/', resource_path='img',
+                               resource_kwargs={'delay': delay})
+    yield 'resource', res.resource_doc
+    datums = [res.compose_datum(datum_kwargs={'index': i})
+              for i in range(num_events)]
+    for datum in datums:
+        yield 'datum', datum
+    for i, datum in enumerate(datums):
+        yield 'event', desc.compose_event(
+            data={'img': datum['datum_id']}, timestamps={'img': 0},
+            filled={'img': False}, seq_num=i + 1)
+    yield 'stop', run.compose_stop()
+
+
+def test_events_outpace_loads():
+    filler = prefetch_filler.PrefetchFiller(
+        {'SLOW': SlowHandler}, prefetch=4, inplace=True)
+    filled = []
+    for name, doc in run_docs(num_events=40, delay=0.05):
+        if name == 'stop':
+            stats = filler.stats()
+        name, doc = filler(name, doc)
+        if name == 'event':
+            filled.append(doc['data']['img'][0, 0])
+            if len(filled) == 20:
+                # let the prefetcher catch up with the events again
+                ttime.sleep(0.5)
+    filler.close()
+
+    assert filled == list(range(40))
+    assert filler.num_hits + filler.num_misses == 40
+    # nothing is left orphaned, the prefetcher got ahead after the pause
+    assert filler.num_hits > 0
+    assert stats['pending'] <= 4
+    assert stats['ahead'] <= 4
+
+
+def test_prefetch_ahead_of_events():
+    filler = prefetch_filler.PrefetchFiller(
+        {'SLOW': SlowHandler}, prefetch=16, inplace=True)
+    for name, doc in run_docs(num_events=10, delay=0.0):
+        if name == 'event' and doc['seq_num'] == 1:
+            ttime.sleep(0.2)
+        filler(name, doc)
+    filler.close()
+    assert filler.num_hits == 10
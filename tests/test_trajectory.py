@@ -0,0 +1,41 @@
+"""
+compile_trajectory matches CalcTrigger / CalcMotion of motion.so bit for bit
+"""
+
+import ctypes
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+DEVICES = (Path(__file__).parents[1] / 'profile_bluesky' / 'startup'
+           / 'instrument' / 'devices')
+spec = importlib.util.spec_from_file_location('trajectory',
+                                              DEVICES / 'trajectory.py')
+trajectory = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(trajectory)
+
+try:
+    ctypes.cdll.LoadLibrary(trajectory.so_motion_path)
+except OSError:
+    motion_so = False
+else:
+    motion_so = True
+
+
+@pytest.mark.skipif(not motion_so, reason='motion.so cannot be loaded')
+@pytest.mark.parametrize('path', sorted((DEVICES / 'fpga_motion').glob('*.tra')),
+                         ids=lambda p: p.name)
+def test_matches_motion_so(path):
+    header, time, energy = trajectory.read_trajectory(path)
+    params = trajectory.MOTION_PARAMS
+    ours = trajectory.compile_trajectory(time, energy, **params)
+    ref = trajectory.compile_trajectory_c(time, energy, **params)
+
+    for key in ('trigger', 'phi', 'z'):
+        n = int(ref[f'{key}_len'][0])
+        assert int(ours[f'{key}_len'][0]) == n
+        # compare the bit patterns, NaN == NaN and -0.0 != 0.0
+        np.testing.assert_array_equal(ours[key][:n].view(np.uint64),
+                                      ref[key][:n].view(np.uint64))
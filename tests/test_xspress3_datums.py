@@ -0,0 +1,64 @@
+"""
+Xspress3 DatumPages and datum_ids keep the per-frame datum order
+"""
+
+from collections import deque
+from pathlib import Path
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('ssrltools')
+sys.path.insert(0, str(Path(__file__).parents[1] / 'profile_bluesky'
+                       / 'startup'))
+from instrument.devices.xspress3 import CXASXspress3Detector
+
+
+def detector(resource_uid='res', channels=(1, 2)):
+    """ the attributes _generate_datum_pages uses, without an IOC """
+    return SimpleNamespace(
+        hdf5=SimpleNamespace(_resource_uid=resource_uid,
+                             channels={c: None for c in channels}),
+        _datum_counter=0, _asset_docs_cache=deque())
+
+
+def per_frame_datums(resource_uid, channels, num_frames, start=0):
+    """ the datums as the per-frame loop in prep_asset_docs used to make """
+    counter = iter(range(start, start + num_frames * len(channels)))
+    return [{'resource': resource_uid,
+             'datum_kwargs': {'frame': n, 'channel': channel_num},
+             'datum_id': f'{resource_uid}/{next(counter)}'}
+            for n in range(num_frames) for channel_num in channels]
+
+
+def test_datum_pages_match_per_frame_order():
+    det = detector()
+    CXASXspress3Detector._generate_datum_pages(det, 4)
+    expected = per_frame_datums('res', [1, 2], 4)
+
+    pages = [doc for name, doc in det._asset_docs_cache]
+    assert [name for name, doc in det._asset_docs_cache] == ['datum_page'] * 2
+    datums = [{'resource': page['resource'],
+               'datum_kwargs': {'frame': frame, 'channel': channel},
+               'datum_id': datum_id}
+              for page in pages
+              for datum_id, frame, channel in zip(
+                  page['datum_id'], page['datum_kwargs']['frame'],
+                  page['datum_kwargs']['channel'])]
+    key = lambda d: d['datum_id']
+    assert sorted(datums, key=key) == sorted(expected, key=key)
+    assert det._datum_counter == 8
+
+
+def test_datum_ids_by_frame():
+    det = detector()
+    CXASXspress3Detector._generate_datum_pages(det, 5)
+    expected = [d['datum_id'] for d in per_frame_datums('res', [1, 2], 5)]
+
+    # fpga_flyer / flyer_100e take channel 1 and 2 of frames [start, stop)
+    datums = CXASXspress3Detector.datum_ids(det, 1, 4)
+    assert datums.shape == (3, 2)
+    assert list(datums[:, 0]) == expected[2:8:2]
+    assert list(datums[:, 1]) == expected[3:8:2]
+    assert list(CXASXspress3Detector.datum_ids(det, 0, 5).ravel()) == expected